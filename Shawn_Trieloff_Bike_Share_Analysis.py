@@ -60,45 +60,17 @@
 
 ## import all necessary packages and functions.
 import csv                     # read and write csv files
-from datetime import datetime  # operations to parse dates
-from pprint import pprint      # use to print data structures like dictionaries in
-                               # a nicer way than the base print function.
+from bikeshare.aggregate import summarize  # one-pass statistics over a summary file
+# the statistics functions below are instrumented by bikeshare.profiling;
+# set BIKESHARE_PROFILE=1 to get a timing report of a run
 
 
 # In[2]:
 
 
-def print_first_point(filename):
-    """
-    This function prints and returns the first data point (second row) from
-    a csv file that includes a header row.
-    """
-    # print city name for reference
-    city = filename.split('-')[0].split('/')[-1]
-    print('\nCity: {}'.format(city))
-    
-    with open(filename, 'r') as f_in:
-        ## TODO: Use the csv library to set up a DictReader object. ##
-        ## see https://docs.python.org/3/library/csv.html           ##
-        
-        ## BAM
-        trip_reader = csv.DictReader(f_in)
-             
-        ## TODO: Use a function on the DictReader object to read the     ##
-        ## first trip from the data file and store it in a variable.     ##
-        ## see https://docs.python.org/3/library/csv.html#reader-objects ##
-        
-        ## BAM
-        first_trip = next(trip_reader)
-        
-        ## TODO: Use the pprint library to print the first trip. ##
-        ## see https://docs.python.org/3/library/pprint.html     ##
-        
-        ## BAM
-        pprint(first_trip)
-        
-    # output city name and first trip for later testing
-    return (city, first_trip)
+# print_first_point lives in bikeshare/analysis.py with the other
+# statistics functions, so they can be imported without running this script.
+from bikeshare.analysis import print_first_point
 
 # list of files for each city
 data_files = ['./data/NYC-CitiBike-2016.csv',
@@ -133,33 +105,11 @@ for data_file in data_files:
 # In[3]:
 
 
-def duration_in_mins(datum, city):
-    """
-    Takes as input a dictionary containing info about a single trip (datum) and
-    its origin city (city) and returns the trip duration in units of minutes.
-    
-    Remember that Washington is in terms of milliseconds while Chicago and NYC
-    are in terms of seconds. 
-    
-    HINT: The csv module reads in all of the data as strings, including numeric
-    values. You will need a function to convert the strings into an appropriate
-    numeric type when making your transformations.
-    see https://docs.python.org/3/library/functions.html
-    """
-    
-    ## BAM
-    duration = 0
-    if city == 'NYC':
-        duration = float(datum['tripduration'])/60
-    elif city == 'Chicago':
-        duration = float(datum['tripduration'])/60
-    elif city == 'Washington':
-        duration = float(datum['Duration (ms)'])/60000
-    else:
-        print("City Unknown")
-    ## End BAM
-    
-    return duration
+## BAM
+# duration_in_mins lives in bikeshare/condense.py so that the parallel
+# condensing workers (bikeshare/parallel.py) can import it.
+from bikeshare.condense import duration_in_mins
+## End BAM
 
 
 # Some tests to check that your code works. There should be no output if all of
@@ -176,44 +126,11 @@ for city in tests:
 # In[4]:
 
 
-def time_of_trip(datum, city):
-    """
-    Takes as input a dictionary containing info about a single trip (datum) and
-    its origin city (city) and returns the month, hour, and day of the week in
-    which the trip was made.
-    
-    Remember that NYC includes seconds, while Washington and Chicago do not.
-    
-    HINT: You should use the datetime module to parse the original date
-    strings into a format that is useful for extracting the desired information.
-    see https://docs.python.org/3/library/datetime.html#strftime-and-strptime-behavior
-    """
-    
-    ## BAM
-    month = 0
-    hour = 0
-    day_of_week = 0
-    
-    if city == 'NYC':
-        w_date = datetime.strptime((datum['starttime']), "%m/%d/%Y %H:%M:%S") 
-        month = int(w_date.strftime("%m"))
-        hour = int(w_date.strftime("%H"))
-        day_of_week = w_date.strftime("%A")
-    elif city == 'Chicago':
-        w_date = datetime.strptime((datum['starttime']), "%m/%d/%Y %H:%M") 
-        month = int(w_date.strftime("%m"))
-        hour = int(w_date.strftime("%H"))
-        day_of_week = w_date.strftime("%A")
-    elif city == 'Washington':
-        w_date = datetime.strptime((datum['Start date']), "%m/%d/%Y %H:%M") 
-        month = int(w_date.strftime("%m"))
-        hour = int(w_date.strftime("%H"))
-        day_of_week = w_date.strftime("%A")
-    else:
-        print("City Unknown")
-    ## End BAM
-    
-    return (month, hour, day_of_week)
+## BAM
+# time_of_trip lives in bikeshare/condense.py; it reads the start timestamp
+# with bikeshare.timeparse.parse_start_time instead of strptime.
+from bikeshare.condense import time_of_trip
+## End BAM
 
 
 # Some tests to check that your code works. There should be no output if all of
@@ -230,34 +147,10 @@ for city in tests:
 # In[5]:
 
 
-def type_of_user(datum, city):
-    """
-    Takes as input a dictionary containing info about a single trip (datum) and
-    its origin city (city) and returns the type of system user that made the
-    trip.
-    
-    Remember that Washington has different category names compared to Chicago
-    and NYC. 
-    """
-    ## BAM
-    # Washington -> Registered for users with annual, monthly, and other longer-term subscriptions
-    #            -> Casual for users with 24-hour, 3-day, and other short-term passes.
-    # NYC & Chicago -> Subscriber == Registered
-    #               -> Customer == Casual    
-    
-    user_type =''
-    if (city == 'NYC') or (city == 'Chicago'):
-        user_type = str(datum['usertype'])
-    elif city == 'Washington':
-        if datum['Member Type'] == 'Registered':
-            user_type = 'Subscriber'
-        else:
-            user_type = 'Customer'
-    else:
-        print("City Unknown")
-    ## End BAM
-        
-    return user_type
+## BAM
+# type_of_user lives in bikeshare/condense.py.
+from bikeshare.condense import type_of_user
+## End BAM
 
 
 # Some tests to check that your code works. There should be no output if all of
@@ -276,51 +169,17 @@ for city in tests:
 # In[6]:
 
 
-def condense_data(in_file, out_file, city):
-    """
-    This function takes full data from the specified input file
-    and writes the condensed data to a specified output file. The city
-    argument determines how the input file will be parsed.
-    
-    HINT: See the cell below to see how the arguments are structured!
-    """
-    
-    with open(out_file, 'w') as f_out, open(in_file, 'r') as f_in:
-        # set up csv DictWriter object - writer requires column names for the
-        # first row as the "fieldnames" argument
-        out_colnames = ['duration', 'month', 'hour', 'day_of_week', 'user_type']        
-        trip_writer = csv.DictWriter(f_out, fieldnames = out_colnames)
-        trip_writer.writeheader()
-        
-        ## TODO: set up csv DictReader object ##
-        ## BAM
-        trip_reader =  csv.DictReader(f_in)
-        ## End BAM
-
-        # collect data from and process each row
-        for row in trip_reader:
-            # set up a dictionary to hold the values for the cleaned and trimmed
-            # data point
-            new_point = {}
-
-            ## TODO: use the helper functions to get the cleaned data from  ##
-            ## the original data dictionaries.                              ##
-            ## Note that the keys for the new_point dictionary should match ##
-            ## the column names set in the DictWriter object above.         ##
-            
-            ## BAM
-            new_point['duration'] = duration_in_mins(row, city)
-            new_point['month'] =  time_of_trip(row, city)[0]
-            new_point['hour'] = time_of_trip(row, city)[1]
-            new_point['day_of_week'] = time_of_trip(row, city)[2]
-            new_point['user_type'] = type_of_user(row, city)
-
-            ## TODO: write the processed information to the output file.     ##
-            ## see https://docs.python.org/3/library/csv.html#writer-objects ##
-            
-            ## BAM
-            trip_writer.writerow(new_point)
-            
+## BAM
+# condense_data lives in bikeshare/condense.py; condense_cities in
+# bikeshare/parallel.py condenses all cities (and chunks of each large raw
+# file) in a process pool, producing the same output byte for byte.
+from bikeshare.condense import condense_data
+from bikeshare.parallel import condense_cities
+# cities whose raw file has not changed since the last run are served from
+# the on-disk cache instead of being condensed again
+from bikeshare.cache import ResultCache, cached_condense_cities
+cache = ResultCache()
+## End BAM
 
 
 # In[7]:
@@ -334,8 +193,10 @@ city_info = {'Washington': {'in_file': './data/Washington-CapitalBikeshare-2016.
              'NYC': {'in_file': './data/NYC-CitiBike-2016.csv',
                      'out_file': './data/NYC-2016-Summary.csv'}}
 
+# also write the columnar copy (*-2016-Summary.cols) used by the
+# vectorized statistics in bikeshare/vectorized.py
+cached_condense_cities(cache, city_info, columnar=True)
 for city, filenames in city_info.items():
-    condense_data(filenames['in_file'], filenames['out_file'], city)
     print_first_point(filenames['out_file'])
 
 
@@ -361,46 +222,8 @@ for city, filenames in city_info.items():
 # In[8]:
 
 
-def number_of_trips(filename):
-    """
-    This function reads in a file with trip data and reports the number of
-    trips made by subscribers, customers, and total overall.
-    """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        
-        # initialize count variables
-        n_subscribers = 0
-        n_customers = 0
-        duration_subscriber = 0
-        duration_customer = 0
-               
-        # tally up ride types
-        
-        # Washington -> Registered for users with annual, monthly, and other longer-term subscriptions
-        #            -> Casual for users with 24-hour, 3-day, and other short-term passes.
-        # NYC & Chicago -> Subscriber == Registered
-        #               -> Customer == Casual    
-                
-        for row in reader:
-            if row['user_type'] == 'Subscriber':
-                n_subscribers += 1
-                duration_subscriber += float(row['duration'])
-            else:
-                n_customers += 1
-                duration_customer += float(row['duration'])
-        
-        # compute total number of rides
-        n_total = n_subscribers + n_customers
-        
-        # compute average per user_type
-        subscriber_average = duration_subscriber/n_subscribers
-        customer_average = duration_customer/n_customers
-               
-        # return tallies as a tuple
-        return(n_subscribers, n_customers, n_total, subscriber_average, customer_average)
-            
+# number_of_trips lives in bikeshare/analysis.py.
+from bikeshare.analysis import number_of_trips
 
 
 # In[9]:
@@ -425,11 +248,19 @@ perc_cust=0
 City=['NYC','Washington','Chicago']
 C=0
 
+# read every summary file once; the cells below answer their questions
+# from these results instead of re-reading the files per statistic
+city_stats={}
 for C_name in data_file:
-    trip_number=number_of_trips(C_name)
-    perc_sub=(trip_number[0]/trip_number[2])*100
-    perc_cust=(trip_number[1]/trip_number[2])*100
-    print(City[C] + " Total trips",trip_number[2]) 
+    city_stats[City[C]]=cache.call(summarize, C_name)
+    C = C+1
+
+C=0
+for C_name in data_file:
+    trip_number=city_stats[City[C]]['counts']
+    perc_sub=(trip_number['Subscriber']/trip_number['total'])*100
+    perc_cust=(trip_number['Customer']/trip_number['total'])*100
+    print(City[C] + " Total trips",trip_number['total']) 
     print(City[C] + " Proportion of trips by Subscribers","%.2f%%" % perc_sub)
     print(City[C] + " Proportion of trips by Customers","%.2f%%" % perc_cust)
     print("")
@@ -462,35 +293,9 @@ for C_name in data_file:
 ## and 3.5% of trips are longer than 30 minutes.                        ##
 
 ## BAM
-def trip_duration(filename):
-    """
-    This function reads in a file with trip data and reports average trip length per city
-    and proportion of trips with duration > 30 mins
-    """
-    
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-    
-        # find trip average
-        trips_total=0
-        trip_average=0.00
-        w_trip_average=0.00
-        trip_average_gt30=0
-        w_trip_average_gt30=0
-        
-        for row in reader:
-            w_trip_average += float(row['duration'])
-            if float(row['duration']) > 30:
-                w_trip_average_gt30 += 1
-            trips_total += 1
-            
-        trip_average=w_trip_average/trips_total
-        trip_average_gt30=(w_trip_average_gt30/trips_total)*100
-        
-        # return averages as a tuple
-        return (trip_average, trip_average_gt30)
-    
+# trip_duration lives in bikeshare/analysis.py.
+from bikeshare.analysis import trip_duration
+
 data_file=['./data/NYC-2016-Summary.csv',
            './data/Washington-2016-Summary.csv',
            './data/Chicago-2016-Summary.csv']    
@@ -498,7 +303,8 @@ data_file=['./data/NYC-2016-Summary.csv',
 City=['NYC','Washington','Chicago']
 C=0
 for C_name in data_file:
-    trip_average, trip_average_gt30 = trip_duration(C_name)
+    trip_average = city_stats[City[C]]['duration']['mean']['total']
+    trip_average_gt30 = city_stats[City[C]]['over_30']
     # round to two decimal places
     # percentages ensure twp decimal places if decimal is a zero when rounded
     print('{} average trip length is {}(mins), with proportion of trips > 30 minutes at {:.2f}%.'.
@@ -534,11 +340,9 @@ data_file=['./data/NYC-2016-Summary.csv',
 City=['NYC','Washington','Chicago']
 C=0
 for C_name in data_file:
-    # from number_of_trips
-    # return(n_subscribers, n_customers, n_total, subscriber_average, customer_average)    
-    trip_number=number_of_trips(C_name)
-    sub_avg=trip_number[3]
-    cust_avg=trip_number[4]
+    # average duration per user type, from the single summarize() pass
+    sub_avg=city_stats[City[C]]['duration']['mean']['Subscriber']
+    cust_avg=city_stats[City[C]]['duration']['mean']['Customer']
         
     print('{} average subscriber trip length is {}(mins), vs average customer trip length of {}(mins).'.
           format(City[C], round(sub_avg,2), round(cust_avg,2)))
@@ -561,7 +365,13 @@ import matplotlib.pyplot as plt
 # this is a 'magic word' that allows for plots to be displayed
 # inline with the notebook. If you want to know more, see:
 # http://ipython.readthedocs.io/en/stable/interactive/magics.html
-get_ipython().run_line_magic('matplotlib', 'inline')
+# get_ipython only exists inside IPython; run as a plain script, plots go
+# to matplotlib's default backend and the export cells at the end are skipped
+try:
+    get_ipython().run_line_magic('matplotlib', 'inline')
+    in_notebook = True
+except NameError:
+    in_notebook = False
 
 # example histogram, data taken from bay area sample
 data = [ 7.65,  8.92,  7.42,  5.50, 16.17,  4.20,  8.98,  9.62, 11.48, 14.33,
@@ -589,28 +399,28 @@ plt.show()
 #- Customers take longer rides on average
 
 ## BAM
+from bikeshare.histogram import StreamingHistogram
+
+# trip_times lives in bikeshare/analysis.py.
+from bikeshare.analysis import trip_times
 
-#reset the data list
-total_trip_time=[]
-
-def trip_times(filename):
-    """
-    This function reads in a file with trip data and reports average trip length per city
-    by subscribers and customers
-    """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        
-        # tally up duration times and append to the list
-        for row in reader:
-            total_trip_time.append(float(row['duration']))
-        return total_trip_time
-    
 data_file = './data/Washington-2016-Summary.csv'
 City='Washington'
 
-plt.hist(trip_times(data_file))
+# plt.hist's default is 10 bins over the data's range; count them in a
+# streaming histogram over the shortest/longest trip from summarize()
+# instead of holding every duration in a list
+w_range = city_stats[City]['extremes']['total']
+if w_range is None or None in w_range:
+    # no trips: an empty plot over plt.hist's default range
+    w_range = (0, 1)
+elif w_range[0] == w_range[1]:
+    # every trip is as long: widen the range by half a minute each way, as numpy does
+    w_range = (w_range[0] - .5, w_range[1] + .5)
+with open(data_file, 'r') as f_in:
+    w_hist = StreamingHistogram(10, w_range).update(
+        float(row['duration']) for row in csv.DictReader(f_in))
+w_hist.plot()
 plt.title('Distribution of {} Trip Durations'.format(City))
 plt.xlabel('Duration (m)')
 plt.show()
@@ -633,40 +443,26 @@ plt.show()
 ## Use this and additional cells to answer Question 5. ##
 
 ## BAM
-#reset the data list
-city_sub_times=[]
-city_cust_times=[]
-
-def city_trip_times(filename):
-    """
-    This function reads in a file with trip data and reports average trip length per city
-    by subscribers and customers seperatly
-    """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        
-        # tally up ride types
-        for row in reader:
-            if row['user_type'] == 'Subscriber':
-                city_sub_times.append(float(row['duration']))
-            elif row['user_type'] == 'Customer':
-                city_cust_times.append(float(row['duration']))
-        
-        return (city_sub_times, city_cust_times)
-                    
+# city_trip_times lives in bikeshare/analysis.py.
+from bikeshare.analysis import city_trip_times
+
 data_file = './data/Washington-2016-Summary.csv'
 City='Washington'
 
+# summarize() already counted the durations of each user type into 15 bins
+# over 0-75 minutes, so the plots are drawn from those counts without
+# reading the file again
+w_hist = city_stats[City]['histogram']
+
 ## 75/15 = 5 min intervals
-plt.hist(city_trip_times(data_file)[0],bins=15,range=(0,75),rwidth=.9)
+w_hist['Subscriber'].plot(rwidth=.9)
 plt.title('Distribution of {} Subscriber Trip Durations'.format(City))
 plt.xlabel('Duration (m)')
 plt.grid(True)
 plt.show()
 
 ## 75/15 = 5 min intervals
-plt.hist(city_trip_times(data_file)[1],bins=15,range=(0,75),rwidth=.9)
+w_hist['Customer'].plot(rwidth=.9)
 plt.title('Distribution of {} Customer Trip Durations'.format(City))
 plt.xlabel('Duration (m)')
 plt.grid(True)
@@ -733,67 +529,12 @@ plt.show()
 
 ## BAM
 
-import csv                     # read and write csv files
-import matplotlib.pyplot as plt
+# csv and matplotlib were imported in the cells above; numpy is only
+# needed here, to place the bar chart ticks
 import numpy as np
-#import datetime
-import calendar
-
-my_data=[]
-my_data_m=[]
-by_month={}
-by_season={}
-by_month_ratio={}
-by_month_ratio_subs={}
-by_month_ratio_cust={}
-by_season_ratio={}
-def city_monthly_trip_times(filename, w_month):
-    """
-    How does ridership differ by month or season? Which month / season has the highest 
-    ridership? Does the ratio of Subscriber trips to Customer trips change depending on the month or season?
-    
-    This function reads in a file with trip data and reports monthly trip length per city
-    by subscribers and customers seperatly
-    """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        
-        # initialize count variables
-        m_subs_duration = m_cust_duration = 0
-        m_subs_month = m_cust_month = 0
-        m_sum_month = 0
-        m_subs_ratio = m_cust_ratio = 0
-        #m = w_month
-        
-        #seasonal variables
-        spring_m =[3,4,5]
-        summer_m =[6,7,8]
-        fall_m =[9,10,11]
-        winter_m =[12,1,2]
-               
-        for row in reader:
-            if int(row['month']) == w_month:
-                if row['user_type'] == 'Subscriber':
-                    m_subs_duration += float(row['duration'])
-                    m_subs_month += 1
-                elif row['user_type'] == 'Customer':
-                    m_cust_duration += float(row['duration'])
-                    m_cust_month += 1
-                                  
-        m=calendar.month_name[w_month]
-                
-        m_sum_month=m_subs_month + m_cust_month
-        m_subs_ratio=round((m_subs_month/m_sum_month)*100,2)
-        m_cust_ratio=round((m_cust_month/m_sum_month)*100,2)
-        by_month.update({m:m_sum_month})
-        by_month_ratio.update({m:[m_subs_ratio,m_cust_ratio]})
-        by_month_ratio_subs.update({m:m_subs_ratio})
-        by_month_ratio_cust.update({m:m_cust_ratio})
-        my_data.extend((m, round(m_subs_duration,2), round(m_cust_duration,2)))
-        my_data_m.extend((m, m_subs_month, m_cust_month, m_sum_month))
-        
-        return (m_subs_duration, m_cust_duration)
+
+# city_monthly_trip_times lives in bikeshare/analysis.py.
+from bikeshare.analysis import city_monthly_trip_times
 
 ##########################
 
@@ -804,37 +545,22 @@ data_file=['./data/NYC-2016-Summary.csv',
 City=['NYC','Washington','Chicago']
 C=0
 for C_name in data_file:
-    city_monthly_trip_times(C_name, 1)
-    city_monthly_trip_times(C_name, 2)
-    city_monthly_trip_times(C_name, 3)
-    city_monthly_trip_times(C_name, 4)
-    city_monthly_trip_times(C_name, 5)
-    city_monthly_trip_times(C_name, 6)
-    city_monthly_trip_times(C_name, 7)
-    city_monthly_trip_times(C_name, 8)
-    city_monthly_trip_times(C_name, 9)
-    city_monthly_trip_times(C_name, 10)
-    city_monthly_trip_times(C_name, 11)
-    city_monthly_trip_times(C_name, 12)
-    
-    spring_m =['March','April','May']
-    summer_m =['June','July','August']
-    fall_m =['September','October','November']
-    winter_m = ['December','January','February']
-    
-    sp = su = fa = wi = 0
-    
-    for k, v in by_month.items():
-        if k in spring_m:
-            sp += v
-        elif k in summer_m:
-            su += v
-        elif k in fall_m:
-            fa += v
-        elif k in winter_m:
-            wi += v
+    # build this city's monthly and seasonal tallies from its single
+    # summarize() pass (a TripStats), rather than calling
+    # city_monthly_trip_times() once per month and resetting globals after
+    results = city_stats[City[C]]
+    by_month = {m: month_stats['total'] for m, month_stats in results['monthly'].items()}
+    by_month_ratio = results['ratios']
+    by_month_ratio_subs = {m: ratio[0] for m, ratio in results['ratios'].items()}
+    by_month_ratio_cust = {m: ratio[1] for m, ratio in results['ratios'].items()}
+    by_season = results['seasonal']
+    my_data = []
+    my_data_m = []
+    for m, month_stats in results['monthly'].items():
+        m_subs_duration, m_cust_duration = month_stats['duration']
+        my_data.extend((m, round(m_subs_duration,2), round(m_cust_duration,2)))
+        my_data_m.extend((m, month_stats['Subscriber'], month_stats['Customer'], month_stats['total']))
     
-    by_season={"Spring":sp,"Summer":su,"Fall":fa,"Winter":wi}
     max_by_season=max(by_season, key=by_season.get)
     max_by_season_value=by_season[max_by_season]
     max_by_month=max(by_month, key=by_month.get)
@@ -958,20 +684,50 @@ for C_name in data_file:
     plt.show()
     
     print("")
-    my_data=[]
-    my_data_m=[]
-    by_month={}
-    by_season={}
-    by_month_ratio={}
-    by_season_ratio={}
-    by_month_ratio={}
-    by_month_ratio_subs={}
-    by_month_ratio_cust={}
 
     C = C+1
  
 
 
+# The statistics functions above loop over every row of the summary files in Python. `bikeshare/vectorized.py` has array-backed versions of `number_of_trips`, `trip_duration`, `trip_times`, `city_trip_times` and `city_monthly_trip_times` that work on the columns of each city, loaded once (memory-mapped from the columnar `*-2016-Summary.cols` copy). The cell below checks that they agree with the loop versions.
+
+# In[16]:
+
+
+## BAM
+import bikeshare.vectorized as vec
+
+# the columnar copy stores durations as float32, so compare to a tolerance
+def close(a, b, tol=1e-4):
+    return abs(a - b) <= tol * max(1, abs(b))
+
+data_file=['./data/NYC-2016-Summary.csv',
+           './data/Washington-2016-Summary.csv',
+           './data/Chicago-2016-Summary.csv']
+
+for C_name in data_file:
+    columns = vec.load_city_columns(C_name)
+    loop_counts = number_of_trips(C_name)
+    vec_counts = vec.number_of_trips(columns)
+    assert loop_counts[:3] == vec_counts[:3]
+    assert all(close(a, b) for a, b in zip(vec_counts[3:], loop_counts[3:]))
+    assert all(close(a, b) for a, b in zip(vec.trip_duration(columns), trip_duration(C_name)))
+
+# the histogram cells above used the Washington file
+columns = vec.load_city_columns('./data/Washington-2016-Summary.csv')
+assert close(vec.trip_times(columns).sum(dtype=float), sum(trip_times('./data/Washington-2016-Summary.csv')))
+for vec_times, loop_times in zip(vec.city_trip_times(columns),
+                                 city_trip_times('./data/Washington-2016-Summary.csv')):
+    assert len(vec_times) == len(loop_times)
+    assert close(vec_times.sum(dtype=float), sum(loop_times))
+monthly_totals = vec.monthly_totals(columns)
+for w_month in range(1, 13):
+    vec_month = vec.city_monthly_trip_times(columns, w_month, monthly_totals)
+    loop_month = city_monthly_trip_times('./data/Washington-2016-Summary.csv', w_month)
+    assert all(close(a, b) for a, b in zip(vec_month, loop_month))
+## End of BAM
+
+
 # <a id='conclusions'></a>
 # ## Conclusions
 # 
@@ -990,19 +746,21 @@ for C_name in data_file:
 # 
 # > Either way, once you've gotten the .html report in your workspace, you can complete your submission by clicking on the "Submit Project" button to the lower-right hand side of the workspace.
 
-# In[16]:
+# In[17]:
 
 # Convert to py file from ipynb file
-from subprocess import call
-call(['python', '-m', 'nbconvert', 'Bike_Share_Analysis.ipynb'])
+if in_notebook:
+    from subprocess import call
+    call(['python', '-m', 'nbconvert', 'Bike_Share_Analysis.ipynb'])
 
 
-# In[17]:
+# In[18]:
 
 
-import os
-file_name = "*.ipynb"
-os.system(f"jupyter nbconvert --to script {file_name}")
+if in_notebook:
+    import os
+    file_name = "*.ipynb"
+    os.system(f"jupyter nbconvert --to script {file_name}")
 
 
 # In[ ]:
@@ -0,0 +1,12 @@
+"""
+Helpers for the 2016 US Bike Share Activity Snapshot.
+
+The notebook script (Shawn_Trieloff_Bike_Share_Analysis.py) walks through the
+analysis cell by cell; the modules in this package hold the pieces of that
+analysis that need to scale past the 2% sample files.
+
+Importing any of them has no side effects: nothing is read, computed or
+plotted until a function is called.  NumPy is only imported by
+bikeshare.vectorized and when columnar files are loaded as arrays, and
+matplotlib only when a histogram is plotted.
+"""
@@ -0,0 +1,5 @@
+import sys
+
+from bikeshare.cli import main
+
+sys.exit(main())
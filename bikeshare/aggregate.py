@@ -0,0 +1,235 @@
+"""
+Single-pass aggregation over the condensed ``*-2016-Summary.csv`` files.
+
+The notebook computes every statistic with its own function, and each of those
+functions opens and parses the summary file again.  ``summarize`` takes the set
+of statistics a caller wants and computes all of them in one streaming pass.
+
+The running totals live in a ``TripStats`` object.  Two TripStats built over
+different rows (shards of one file, chunks handled by different worker
+processes or hosts) combine with ``merge()``, which is associative, so partial
+results can be computed independently and folded together in any grouping.
+"""
+import calendar
+import csv
+
+from bikeshare.histogram import StreamingHistogram
+from bikeshare.profiling import count_rows, instrument
+
+# statistics that summarize() knows how to compute
+STATISTICS = ('counts', 'duration', 'over_30', 'monthly', 'seasonal', 'ratios',
+              'extremes', 'histogram')
+
+USER_TYPES = ('Subscriber', 'Customer')
+
+SEASONS = {'Spring': (3, 4, 5),
+           'Summer': (6, 7, 8),
+           'Fall': (9, 10, 11),
+           'Winter': (12, 1, 2)}
+
+# duration histogram used by the notebook plots: 15 five-minute bins over 0-75
+HIST_BINS = 15
+HIST_RANGE = (0, 75)
+
+
+class TripStats(object):
+    """
+    Running trip statistics, kept per user type ('Subscriber', or
+    'Customer' for every other user type as number_of_trips does):
+
+    - n, duration: trip counts and duration sums per month (index 0 unused)
+    - over_30:     trips longer than 30 minutes
+    - low, high:   shortest and longest trip (None until a trip is seen)
+    - hist:        StreamingHistogram of duration over hist_range in
+                   hist_bins equal bins, with under- and overflow buckets
+    """
+
+    def __init__(self, hist_bins=HIST_BINS, hist_range=HIST_RANGE):
+        self.hist_bins = hist_bins
+        self.hist_range = tuple(hist_range)
+        self.n = {user: [0] * 13 for user in USER_TYPES}
+        self.duration = {user: [0.0] * 13 for user in USER_TYPES}
+        self.over_30 = {user: 0 for user in USER_TYPES}
+        self.low = {user: None for user in USER_TYPES}
+        self.high = {user: None for user in USER_TYPES}
+        self.hist = {user: StreamingHistogram(hist_bins, hist_range) for user in USER_TYPES}
+
+    def add(self, duration, month, user_type):
+        """
+        This function records one trip.
+        """
+        user = 'Subscriber' if user_type == 'Subscriber' else 'Customer'
+        self.n[user][month] += 1
+        self.duration[user][month] += duration
+        if duration > 30:
+            self.over_30[user] += 1
+        if self.low[user] is None or duration < self.low[user]:
+            self.low[user] = duration
+        if self.high[user] is None or duration > self.high[user]:
+            self.high[user] = duration
+        self.hist[user].add(duration)
+
+    def update(self, rows):
+        """
+        This function records condensed trip rows (dictionaries with
+        'duration', 'month' and 'user_type' keys, as csv.DictReader yields
+        from a summary file) and returns self.
+        """
+        add = self.add
+        for row in rows:
+            add(float(row['duration']), int(row['month']), row['user_type'])
+        return self
+
+    def merge(self, other):
+        """
+        This function folds the totals of another TripStats into this one and
+        returns self. Both must use the same histogram bins.
+        """
+        if (self.hist_bins, self.hist_range) != (other.hist_bins, other.hist_range):
+            raise ValueError('Cannot merge TripStats with different histogram bins')
+        for user in USER_TYPES:
+            for m in range(13):
+                self.n[user][m] += other.n[user][m]
+                self.duration[user][m] += other.duration[user][m]
+            self.over_30[user] += other.over_30[user]
+            self.low[user] = _pick(min, self.low[user], other.low[user])
+            self.high[user] = _pick(max, self.high[user], other.high[user])
+            self.hist[user].merge(other.hist[user])
+        return self
+
+    @classmethod
+    def merge_all(cls, parts):
+        """
+        This function merges an iterable of TripStats into a new TripStats.
+        """
+        parts = list(parts)
+        merged = cls(parts[0].hist_bins, parts[0].hist_range) if parts else cls()
+        for part in parts:
+            merged.merge(part)
+        return merged
+
+    def to_dict(self):
+        """
+        This function returns the state as a JSON-serializable dictionary.
+        """
+        return {'hist_bins': self.hist_bins, 'hist_range': list(self.hist_range),
+                'n': self.n, 'duration': self.duration, 'over_30': self.over_30,
+                'low': self.low, 'high': self.high,
+                'hist': {user: self.hist[user].to_dict() for user in USER_TYPES}}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        This function rebuilds a TripStats from to_dict() output.
+        """
+        stats = cls(state['hist_bins'], state['hist_range'])
+        for name in ('n', 'duration', 'over_30', 'low', 'high'):
+            setattr(stats, name, state[name])
+        stats.hist = {user: StreamingHistogram.from_dict(state['hist'][user])
+                      for user in USER_TYPES}
+        return stats
+
+    def results(self, stats=STATISTICS):
+        """
+        This function returns a dictionary of results keyed by statistic name:
+
+        - counts:    {'Subscriber': n, 'Customer': n, 'total': n}
+        - duration:  {'sum': {...}, 'mean': {...}} keyed by user type and 'total'
+        - over_30:   percentage of trips longer than 30 minutes
+        - monthly:   {month name: {'Subscriber': n, 'Customer': n, 'total': n,
+                                   'duration': (subscriber sum, customer sum)}}
+        - seasonal:  {season: total trips}
+        - ratios:    {month name: [subscriber %, customer %]}, rounded to 2 places
+        - extremes:  {user type or 'total': (shortest, longest)}
+        - histogram: {user type or 'total': StreamingHistogram}
+
+        Months without any trips are left out of the monthly and ratio results.
+        """
+        results = {}
+        month_n = self.n
+        month_duration = self.duration
+        n = {user: sum(month_n[user]) for user in USER_TYPES}
+        n_total = n['Subscriber'] + n['Customer']
+
+        if 'counts' in stats:
+            results['counts'] = {'Subscriber': n['Subscriber'],
+                                 'Customer': n['Customer'],
+                                 'total': n_total}
+
+        if 'duration' in stats:
+            sums = {user: sum(month_duration[user]) for user in USER_TYPES}
+            sums['total'] = sums['Subscriber'] + sums['Customer']
+            counts = dict(n, total=n_total)
+            means = {key: (sums[key] / counts[key] if counts[key] else 0.0)
+                     for key in sums}
+            results['duration'] = {'sum': sums, 'mean': means}
+
+        if 'over_30' in stats:
+            over_30 = self.over_30['Subscriber'] + self.over_30['Customer']
+            results['over_30'] = (over_30 / n_total) * 100 if n_total else 0.0
+
+        month_totals = [month_n['Subscriber'][m] + month_n['Customer'][m]
+                        for m in range(13)]
+
+        if 'monthly' in stats:
+            results['monthly'] = {
+                calendar.month_name[m]: {
+                    'Subscriber': month_n['Subscriber'][m],
+                    'Customer': month_n['Customer'][m],
+                    'total': month_totals[m],
+                    'duration': (month_duration['Subscriber'][m],
+                                 month_duration['Customer'][m])}
+                for m in range(1, 13) if month_totals[m]}
+
+        if 'seasonal' in stats:
+            results['seasonal'] = {season: sum(month_totals[m] for m in months)
+                                   for season, months in SEASONS.items()}
+
+        if 'ratios' in stats:
+            results['ratios'] = {
+                calendar.month_name[m]: [
+                    round((month_n['Subscriber'][m] / month_totals[m]) * 100, 2),
+                    round((month_n['Customer'][m] / month_totals[m]) * 100, 2)]
+                for m in range(1, 13) if month_totals[m]}
+
+        if 'extremes' in stats:
+            extremes = {user: (self.low[user], self.high[user]) for user in USER_TYPES}
+            extremes['total'] = (_pick(min, self.low['Subscriber'], self.low['Customer']),
+                                 _pick(max, self.high['Subscriber'], self.high['Customer']))
+            results['extremes'] = extremes
+
+        if 'histogram' in stats:
+            histogram = {user: StreamingHistogram.from_dict(self.hist[user].to_dict())
+                         for user in USER_TYPES}
+            histogram['total'] = StreamingHistogram.from_dict(
+                self.hist['Subscriber'].to_dict()).merge(self.hist['Customer'])
+            results['histogram'] = histogram
+
+        return results
+
+
+def _pick(func, a, b):
+    """
+    This function applies min or max to two values that may be None.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return func(a, b)
+
+
+@instrument
+def summarize(filename, stats=STATISTICS):
+    """
+    This function reads a condensed trip data file once and returns every
+    requested statistic (see TripStats.results() for the shape of each).
+    """
+    unknown = set(stats) - set(STATISTICS)
+    if unknown:
+        raise ValueError('Unknown statistics: {}'.format(', '.join(sorted(unknown))))
+
+    with open(filename, 'r') as f_in:
+        trip_stats = TripStats().update(count_rows(csv.DictReader(f_in)))
+
+    return trip_stats.results(stats)
@@ -0,0 +1,156 @@
+"""
+Per-row statistics over the condensed ``*-2016-Summary.csv`` files.
+
+These are the Question 2, 4, 5 and 6 functions of the notebook, moved here
+so they can be imported (by the notebook, bikeshare.bench and worker
+processes) without running the analysis.  Each one reads its rows as
+csv.DictReader dictionaries; bikeshare.aggregate computes the same numbers
+for all of them in one pass, and bikeshare.vectorized works on columns in
+memory.
+
+The filename given to the statistics functions may also be a city directory
+of a partitioned store (see bikeshare.partition, e.g. 'store/city=NYC').
+city_monthly_trip_times then reads only its month's partition, and
+number_of_trips and trip_duration take the months to read.
+"""
+from pprint import pprint
+
+from bikeshare.mmapscan import first_point
+from bikeshare.partition import open_rows
+from bikeshare.profiling import count_rows, instrument
+
+
+@instrument
+def print_first_point(filename):
+    """
+    This function prints and returns the first data point (second row) from
+    a csv file that includes a header row. The file is memory-mapped, so
+    only its first pages are read.
+    """
+    # print city name for reference
+    city = filename.split('-')[0].split('/')[-1]
+    print('\nCity: {}'.format(city))
+
+    first_trip = first_point(filename)
+    pprint(first_trip)
+
+    # output city name and first trip for later testing
+    return (city, first_trip)
+
+
+@instrument
+def number_of_trips(filename, months=None):
+    """
+    This function reads in a file with trip data and reports the number of
+    trips made by subscribers, customers, and total overall, and the average
+    trip duration of subscribers and customers. If months (month numbers)
+    is given, only trips of those months count.
+    """
+    with open_rows(filename, months) as rows:
+        reader = count_rows(rows)
+
+        n_subscribers = 0
+        n_customers = 0
+        duration_subscriber = 0
+        duration_customer = 0
+
+        # every user type other than 'Subscriber' counts as a customer
+        for row in reader:
+            if row['user_type'] == 'Subscriber':
+                n_subscribers += 1
+                duration_subscriber += float(row['duration'])
+            else:
+                n_customers += 1
+                duration_customer += float(row['duration'])
+
+        n_total = n_subscribers + n_customers
+
+        subscriber_average = duration_subscriber/n_subscribers
+        customer_average = duration_customer/n_customers
+
+        return (n_subscribers, n_customers, n_total, subscriber_average, customer_average)
+
+
+@instrument
+def trip_duration(filename, months=None):
+    """
+    This function reads in a file with trip data and reports average trip length per city
+    and proportion of trips with duration > 30 mins, optionally for the given months only
+    """
+    with open_rows(filename, months) as rows:
+        reader = count_rows(rows)
+
+        trips_total = 0
+        w_trip_average = 0.00
+        w_trip_average_gt30 = 0
+
+        for row in reader:
+            w_trip_average += float(row['duration'])
+            if float(row['duration']) > 30:
+                w_trip_average_gt30 += 1
+            trips_total += 1
+
+        trip_average = w_trip_average/trips_total
+        trip_average_gt30 = (w_trip_average_gt30/trips_total)*100
+
+        return (trip_average, trip_average_gt30)
+
+
+@instrument
+def trip_times(filename):
+    """
+    This function reads in a file with trip data and returns the list of
+    every trip duration.
+    """
+    total_trip_time = []
+    with open_rows(filename) as rows:
+        reader = count_rows(rows)
+        for row in reader:
+            total_trip_time.append(float(row['duration']))
+        return total_trip_time
+
+
+@instrument
+def city_trip_times(filename):
+    """
+    This function reads in a file with trip data and returns the lists of
+    subscriber and customer trip durations separately.
+    """
+    city_sub_times = []
+    city_cust_times = []
+    with open_rows(filename) as rows:
+        reader = count_rows(rows)
+        for row in reader:
+            if row['user_type'] == 'Subscriber':
+                city_sub_times.append(float(row['duration']))
+            elif row['user_type'] == 'Customer':
+                city_cust_times.append(float(row['duration']))
+
+        return (city_sub_times, city_cust_times)
+
+
+@instrument
+def city_monthly_trip_times(filename, w_month):
+    """
+    This function reads in a file with trip data and returns the summed
+    subscriber and customer trip durations for one month (1-12).
+
+    The notebook version also recorded its monthly counts and ratios in
+    global dictionaries; those now come from summarize()'s 'monthly' and
+    'ratios' results. From a partitioned store only the month's partition
+    is read.
+    """
+    if not 1 <= w_month <= 12:
+        raise ValueError('Month out of range: {!r}'.format(w_month))
+    with open_rows(filename, (w_month,)) as rows:
+        reader = count_rows(rows)
+
+        m_subs_duration = m_cust_duration = 0
+
+        for row in reader:
+            if row['user_type'] == 'Subscriber':
+                m_subs_duration += float(row['duration'])
+            elif row['user_type'] == 'Customer':
+                m_cust_duration += float(row['duration'])
+
+        return (m_subs_duration, m_cust_duration)
@@ -0,0 +1,418 @@
+"""
+Benchmark harness for the ingest and analysis pipeline.
+
+``generate_raw_file`` writes synthetic trips in a city's raw schema at any
+size (1e4 to 1e8 rows streams to disk without holding rows in memory).
+``run_benchmarks`` times each pipeline stage on those files in a fresh
+worker process, so every stage reports its own wall time, rows per second
+and peak RSS, and ``save_results``/``compare_results`` keep JSON baselines
+so regressions show up between runs:
+
+    python -m bikeshare.bench --rows 1e6 --save bench.json
+    python -m bikeshare.bench --rows 1e6 --baseline bench.json
+
+The condense_blocks and condense_pipelined stages run the same read,
+condense and write stages (bikeshare.pipeline) one after the other and on
+overlapping threads.  To measure them on network storage, put --work-dir on
+the mount; --slow-io MBPS LATENCY_MS instead slows every read and write
+they make, to compare them on a local disk:
+
+    python -m bikeshare.bench --stages condense_blocks condense_pipelined --slow-io 50 5
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from bikeshare.schema import get_schema
+
+# full raw headers of the Motivate files, so generated files carry the same
+# unused columns the real ones do
+RAW_HEADERS = {
+    'NYC': ['tripduration', 'starttime', 'stoptime', 'start station id',
+            'start station name', 'start station latitude', 'start station longitude',
+            'end station id', 'end station name', 'end station latitude',
+            'end station longitude', 'bikeid', 'usertype', 'birth year', 'gender'],
+    'Chicago': ['trip_id', 'starttime', 'stoptime', 'bikeid', 'tripduration',
+                'from_station_id', 'from_station_name', 'to_station_id', 'to_station_name',
+                'usertype', 'gender', 'birthyear'],
+    'Washington': ['Duration (ms)', 'Start date', 'End date', 'Start station number',
+                   'Start station', 'End station number', 'End station', 'Bike number',
+                   'Member Type']}
+
+# raw user type labels to draw from, per city (others use the schema's map)
+RAW_USER_TYPES = {'Washington': ['Registered', 'Registered', 'Registered', 'Casual']}
+
+# stages timed by run_benchmarks, in order; each reads the output of condense
+STAGES = ('condense', 'condense_mmap', 'condense_blocks', 'condense_pipelined',
+          'condense_parallel', 'loop_stats', 'summarize', 'summarize_parallel', 'histograms',
+          'columnar_convert', 'vectorized_load', 'vectorized_stats')
+
+# stages that write the summary file themselves
+CONDENSE_STAGES = ('condense', 'condense_mmap', 'condense_blocks', 'condense_pipelined',
+                   'condense_parallel')
+
+# stages that read the columnar copy of the summary file, which is made
+# before they are timed if columnar_convert has not made it
+COLUMNAR_STAGES = ('vectorized_load', 'vectorized_stats')
+
+ROWS_PER_WRITE = 10000
+
+
+def _timestamp_writer(time_format):
+    """
+    This function returns a function formatting a datetime in time_format,
+    using plain string formatting for the unpadded m/d/Y layouts (strftime
+    always zero-pads, unlike the raw files).
+    """
+    if time_format == '%m/%d/%Y %H:%M':
+        return lambda t: '{}/{}/{} {:02d}:{:02d}'.format(t.month, t.day, t.year, t.hour, t.minute)
+    if time_format == '%m/%d/%Y %H:%M:%S':
+        return lambda t: '{}/{}/{} {:02d}:{:02d}:{:02d}'.format(
+            t.month, t.day, t.year, t.hour, t.minute, t.second)
+    return lambda t: t.strftime(time_format)
+
+
+def generate_raw_file(filename, city, n_rows, seed=2016):
+    """
+    This function writes n_rows synthetic 2016 trips in city's raw schema to
+    filename. Columns the condensing helpers do not read are filled with
+    plausible values so the file has a realistic width.
+    """
+    import csv
+
+    schema = get_schema(city)
+    header = RAW_HEADERS.get(city) or list(schema.columns) + [
+        schema.end_time or 'stop time', schema.start_station or 'start station id',
+        schema.end_station or 'end station id', 'bike id']
+    if schema.user_type_map is None:
+        user_types = ['Subscriber', 'Subscriber', 'Subscriber', 'Customer']
+    else:
+        user_types = RAW_USER_TYPES.get(city) or sorted(schema.user_type_map)
+    format_time = _timestamp_writer(schema.time_format)
+    rand = random.Random(seed)
+    year_start = datetime(2016, 1, 1)
+    index = {name: i for i, name in enumerate(header)}
+    stop_column = [name for name in header
+                   if name.lower().replace(' ', '') in ('stoptime', 'enddate')]
+
+    with open(filename, 'w', newline='') as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(header)
+        written = 0
+        while written < n_rows:
+            rows = []
+            for _ in range(min(ROWS_PER_WRITE, n_rows - written)):
+                seconds = rand.randint(60, 5400)
+                start = year_start + timedelta(seconds=rand.randrange(366 * 86400))
+                row = [str(rand.randint(1, 600)) for _ in header]
+                row[index[schema.duration]] = str(seconds * schema.duration_divisor // 60)
+                row[index[schema.start_time]] = format_time(start)
+                row[index[schema.user_type]] = rand.choice(user_types)
+                for name in stop_column:
+                    row[index[name]] = format_time(start + timedelta(seconds=seconds))
+                rows.append(row)
+            writer.writerows(rows)
+            written += len(rows)
+    return filename
+
+
+class ThrottledFile(object):
+    """
+    Wraps an open file so that every read() and write() takes latency
+    seconds plus the time to move its bytes at bandwidth bytes per second,
+    like a file on a slow network mount. The waits release the GIL, as
+    real I/O waits do.
+    """
+
+    def __init__(self, f, bandwidth, latency):
+        self.f = f
+        self.bandwidth = bandwidth
+        self.latency = latency
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        time.sleep(self.latency + len(data) / self.bandwidth)
+        return data
+
+    def write(self, data):
+        time.sleep(self.latency + len(data) / self.bandwidth)
+        return self.f.write(data)
+
+    def seek(self, *args):
+        return self.f.seek(*args)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def throttled_opener(megabytes_per_sec, latency_ms):
+    """
+    This function returns an open()-like function whose files are
+    ThrottledFiles with the given bandwidth and per-call latency.
+    """
+    def opener(filename, mode='r'):
+        return ThrottledFile(open(filename, mode), megabytes_per_sec * 1024 * 1024,
+                             latency_ms / 1000)
+    return opener
+
+
+def _run_stage(stage, city, raw_file, summary_file, workers, slow_io=None):
+    """
+    This function runs one stage and returns the number of rows it handled.
+    slow_io, a (MB/s, latency ms) pair, throttles the file I/O of the
+    condense_blocks and condense_pipelined stages.
+    """
+    if stage == 'condense':
+        from bikeshare.condense import condense_data
+        condense_data(raw_file, summary_file, city)
+    elif stage == 'condense_mmap':
+        from bikeshare.mmapscan import condense_mmap
+        condense_mmap(raw_file, summary_file, city)
+    elif stage in ('condense_blocks', 'condense_pipelined'):
+        from bikeshare.pipeline import condense_pipelined
+        condense_pipelined(raw_file, summary_file, city,
+                           threaded=stage == 'condense_pipelined',
+                           opener=throttled_opener(*slow_io) if slow_io else open)
+    elif stage == 'condense_parallel':
+        from bikeshare.parallel import condense_cities
+        condense_cities({city: {'in_file': raw_file, 'out_file': summary_file}},
+                        workers=workers, chunk_size=8 * 1024 * 1024)
+    elif stage == 'loop_stats':
+        from bikeshare import analysis
+        analysis.number_of_trips(summary_file)
+        analysis.trip_duration(summary_file)
+        analysis.city_trip_times(summary_file)
+        for w_month in range(1, 13):
+            analysis.city_monthly_trip_times(summary_file, w_month)
+    elif stage == 'summarize':
+        from bikeshare.aggregate import summarize
+        return summarize(summary_file)['counts']['total']
+    elif stage == 'summarize_parallel':
+        from bikeshare.parallel import summarize_parallel
+        return summarize_parallel(summary_file, workers=workers,
+                                  chunk_size=8 * 1024 * 1024)['counts']['total']
+    elif stage == 'histograms':
+        from bikeshare.histogram import duration_histograms
+        return duration_histograms(summary_file)['total'].total
+    elif stage == 'columnar_convert':
+        from bikeshare.columnar import summary_to_columnar
+        summary_to_columnar(summary_file)
+    elif stage == 'vectorized_load':
+        from bikeshare.columnar import columnar_path
+        from bikeshare.vectorized import load_city_columns
+        return len(load_city_columns(columnar_path(summary_file))['duration'])
+    elif stage == 'vectorized_stats':
+        import bikeshare.vectorized as vec
+        columns = vec.load_city_columns(summary_file)
+        vec.number_of_trips(columns)
+        vec.trip_duration(columns)
+        vec.city_trip_times(columns)
+        totals = vec.monthly_totals(columns)
+        for w_month in range(1, 13):
+            vec.city_monthly_trip_times(columns, w_month, totals)
+        return len(columns['duration'])
+    else:
+        raise ValueError('Unknown stage: {}'.format(stage))
+    return None
+
+
+def _stage_worker(queue, stage, city, raw_file, summary_file, workers, slow_io):
+    started = time.perf_counter()
+    try:
+        rows = _run_stage(stage, city, raw_file, summary_file, workers, slow_io)
+    except Exception as error:
+        queue.put(error)
+        raise
+    seconds = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS; the parallel
+    # stages' pool workers are reaped by then and show up under RUSAGE_CHILDREN
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    queue.put((seconds, rows, peak_mb))
+
+
+def time_stage(stage, city, raw_file, summary_file, n_rows, workers=None, slow_io=None):
+    """
+    This function runs one stage in a freshly spawned process (so its peak
+    RSS is its own) and returns its timing record.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_stage_worker,
+                              args=(queue, stage, city, raw_file, summary_file, workers,
+                                    slow_io))
+    process.start()
+    result = queue.get()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    seconds, rows, peak_mb = result
+    rows = n_rows if rows is None else rows
+    return {'seconds': round(seconds, 4),
+            'rows': rows,
+            'rows_per_sec': round(rows / seconds) if seconds else None,
+            'peak_rss_mb': round(peak_mb, 1)}
+
+
+def run_benchmarks(n_rows, cities=('NYC', 'Chicago', 'Washington'), stages=STAGES,
+                   work_dir=None, workers=None, seed=2016, with_timeparse=True, log=print,
+                   slow_io=None):
+    """
+    This function generates an n_rows raw file per city, times every stage
+    on it and returns the results as a JSON-serializable dictionary. With
+    with_timeparse, timeparse.benchmark's strptime comparison is included;
+    slow_io is passed on to _run_stage.
+    """
+    n_rows = int(n_rows)
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='bikeshare-bench-')
+    results = {'meta': {'rows': n_rows,
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'cpus': os.cpu_count(),
+                        'workers': workers,
+                        'slow_io': list(slow_io) if slow_io else None,
+                        'date': datetime.now().isoformat(timespec='seconds')},
+               'stages': {}}
+    try:
+        for city in cities:
+            raw_file = os.path.join(work_dir, '{}-raw.csv'.format(city))
+            summary_file = os.path.join(work_dir, '{}-Summary.csv'.format(city))
+            if not os.path.exists(raw_file):
+                log('generating {} rows for {}'.format(n_rows, city))
+                generate_raw_file(raw_file, city, n_rows, seed)
+            if stages and stages[0] not in CONDENSE_STAGES and not os.path.exists(summary_file):
+                # the analysis stages read the condensed file
+                from bikeshare.condense import condense_data
+                condense_data(raw_file, summary_file, city)
+            results['stages'][city] = {}
+            for stage in stages:
+                if stage in COLUMNAR_STAGES:
+                    from bikeshare.columnar import columnar_path, summary_to_columnar
+                    if not os.path.isdir(columnar_path(summary_file)):
+                        summary_to_columnar(summary_file)
+                record = time_stage(stage, city, raw_file, summary_file, n_rows, workers,
+                                    slow_io)
+                results['stages'][city][stage] = record
+                log('{:<12} {:<20} {:>9.3f}s {:>12,} rows/s {:>8.1f} MB'.format(
+                    city, stage, record['seconds'], record['rows_per_sec'] or 0,
+                    record['peak_rss_mb']))
+        if with_timeparse:
+            from bikeshare.timeparse import benchmark
+            n_stamps = min(n_rows, 200000)
+            results['timeparse'] = {
+                layout: {'rows': n_stamps, 'strptime_seconds': round(slow, 4),
+                         'fast_seconds': round(fast, 4), 'speedup': round(speedup, 1)}
+                for layout, (slow, fast, speedup) in benchmark(n_stamps).items()}
+            for layout, record in results['timeparse'].items():
+                log('{:<20} strptime {:.3f}s, parse_start_time {:.3f}s ({:.1f}x)'.format(
+                    layout, record['strptime_seconds'], record['fast_seconds'],
+                    record['speedup']))
+    finally:
+        if own_dir:
+            import shutil
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def save_results(results, filename):
+    """
+    This function writes benchmark results to a JSON baseline file.
+    """
+    with open(filename, 'w') as f_out:
+        json.dump(results, f_out, indent=2)
+
+
+def load_results(filename):
+    """
+    This function reads a JSON baseline file.
+    """
+    with open(filename, 'r') as f_in:
+        return json.load(f_in)
+
+
+def compare_results(baseline, current, tolerance=0.10):
+    """
+    This function compares two benchmark results stage by stage and returns
+    a list of (city, stage, baseline seconds, current seconds, change)
+    for every stage that got slower by more than tolerance (a fraction).
+    Runs with a different row count are not comparable and raise ValueError.
+    """
+    if baseline['meta']['rows'] != current['meta']['rows']:
+        raise ValueError('Baseline has {} rows, current run has {}'.format(
+            baseline['meta']['rows'], current['meta']['rows']))
+    regressions = []
+    for city, stages in current['stages'].items():
+        for stage, record in stages.items():
+            before = baseline['stages'].get(city, {}).get(stage)
+            if not before or not before['seconds']:
+                continue
+            change = record['seconds'] / before['seconds'] - 1
+            if change > tolerance:
+                regressions.append((city, stage, before['seconds'], record['seconds'], change))
+    return regressions
+
+
+def add_arguments(parser):
+    """
+    This function adds the benchmark options to an argparse parser.
+    """
+    parser.add_argument('--rows', type=float, default=1e5,
+                        help='rows per synthetic raw file (default 1e5)')
+    parser.add_argument('--cities', nargs='+', default=['NYC', 'Chicago', 'Washington'])
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes for the parallel stages')
+    parser.add_argument('--no-timeparse', action='store_true',
+                        help='skip the start-time parser comparison')
+    parser.add_argument('--work-dir', default=None,
+                        help='keep generated files here and reuse them between runs')
+    parser.add_argument('--slow-io', type=float, nargs=2, default=None,
+                        metavar=('MBPS', 'LATENCY_MS'),
+                        help='throttle the I/O of the condense_blocks/condense_pipelined stages')
+    parser.add_argument('--save', default=None, help='write results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='compare against this JSON file and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed slowdown before a stage counts as a regression')
+
+
+def main(args):
+    """
+    This function runs the benchmarks for parsed command-line arguments and
+    returns the process exit code.
+    """
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+    results = run_benchmarks(args.rows, args.cities, args.stages, args.work_dir, args.workers,
+                             with_timeparse=not args.no_timeparse, slow_io=args.slow_io)
+    if args.save:
+        save_results(results, args.save)
+    if args.baseline:
+        regressions = compare_results(load_results(args.baseline), results, args.tolerance)
+        for city, stage, before, after, change in regressions:
+            print('REGRESSION {} {}: {:.3f}s -> {:.3f}s (+{:.0%})'.format(
+                city, stage, before, after, change))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    sys.exit(main(parser.parse_args()))
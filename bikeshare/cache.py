@@ -0,0 +1,270 @@
+"""
+Persistent on-disk cache for condensed outputs and computed statistics.
+
+Every cache entry is keyed by a fingerprint of its input file (size, mtime
+and optionally a content hash) and by a version hash of the helper modules
+that produced it, so an entry is served only while both the input and the
+code are unchanged.  Entries live under ``.bikeshare-cache/``:
+
+- results/<key>.pickle   computed values (tuples, dictionaries, arrays)
+- outputs/<key>/         copies of condensed output files and directories
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+DEFAULT_CACHE_DIR = '.bikeshare-cache'
+
+# bump to invalidate every existing entry after a cache format change
+CACHE_VERSION = 1
+
+# modules whose source determines the condensed data and the statistics
+HELPER_MODULES = ('bikeshare.aggregate', 'bikeshare.analysis', 'bikeshare.columnar',
+                  'bikeshare.compression', 'bikeshare.condense', 'bikeshare.cube',
+                  'bikeshare.histogram', 'bikeshare.mmapscan', 'bikeshare.parallel',
+                  'bikeshare.partition', 'bikeshare.pipeline', 'bikeshare.reader',
+                  'bikeshare.sampling', 'bikeshare.schema', 'bikeshare.sketch',
+                  'bikeshare.stations', 'bikeshare.timeparse', 'bikeshare.vectorized')
+
+_helper_version = None
+
+_module_versions = {}
+
+
+def helper_version():
+    """
+    This function returns a hash of the source of the helper modules, so
+    that cached entries are invalidated when the helper functions change.
+    """
+    global _helper_version
+    if _helper_version is None:
+        import importlib.util
+
+        digest = hashlib.sha256(str(CACHE_VERSION).encode())
+        for name in HELPER_MODULES:
+            # read the source without importing the module (vectorized
+            # would pull in numpy)
+            with open(importlib.util.find_spec(name).origin, 'rb') as f_in:
+                digest.update(f_in.read())
+        _helper_version = digest.hexdigest()[:16]
+    return _helper_version
+
+
+def module_version(name):
+    """
+    This function returns a hash of the source of one module (e.g. that of
+    a function given to ResultCache.call, which may live outside
+    HELPER_MODULES), or '' if it has no source file.
+    """
+    if name not in _module_versions:
+        import importlib.util
+
+        try:
+            with open(importlib.util.find_spec(name).origin, 'rb') as f_in:
+                _module_versions[name] = hashlib.sha256(f_in.read()).hexdigest()[:16]
+        except (AttributeError, ImportError, OSError, TypeError, ValueError):
+            # __main__ and built-in modules have no spec or no source file
+            _module_versions[name] = ''
+    return _module_versions[name]
+
+
+def content_hash(path, block_size=1024 * 1024):
+    """
+    This function returns the sha256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(path, with_content=False):
+    """
+    This function returns a dictionary identifying the current state of a
+    file: its absolute path, size and modification time, and (if
+    with_content is set) a hash of its contents.
+    """
+    stat = os.stat(path)
+    result = {'path': os.path.abspath(path),
+              'size': stat.st_size,
+              'mtime_ns': stat.st_mtime_ns}
+    if with_content:
+        result['sha256'] = content_hash(path)
+    return result
+
+
+def output_fingerprint(path):
+    """
+    This function fingerprints an output file, or every file in an output
+    directory.
+    """
+    if os.path.isdir(path):
+        return sorted((name, fingerprint(os.path.join(path, name)))
+                      for name in os.listdir(path))
+    return fingerprint(path)
+
+
+def _copy(src, dst):
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        # keep the modification time, which the sidecar files' fingerprints record
+        shutil.copy2(src, dst)
+
+
+class ResultCache(object):
+    """
+    On-disk cache keyed by input file fingerprint and helper version.
+    Set with_content to also hash file contents, which catches files that
+    were rewritten with the same size and mtime at the cost of reading them.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, with_content=False):
+        self.cache_dir = cache_dir
+        self.with_content = with_content
+        os.makedirs(os.path.join(cache_dir, 'results'), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, 'outputs'), exist_ok=True)
+
+    def key(self, name, filename, *args, **kwargs):
+        """
+        This function returns the cache key for computing name (e.g. a
+        function name) over filename with the given extra arguments.
+        """
+        parts = {'name': name,
+                 'input': fingerprint(filename, self.with_content),
+                 'args': repr(args),
+                 'kwargs': repr(sorted(kwargs.items())),
+                 'version': helper_version()}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _result_file(self, key):
+        return os.path.join(self.cache_dir, 'results', key + '.pickle')
+
+    def get(self, key, default=None):
+        """
+        This function returns the value stored under key, or default.
+        """
+        try:
+            with open(self._result_file(key), 'rb') as f_in:
+                return pickle.load(f_in)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+    def put(self, key, value):
+        """
+        This function stores value under key. The entry is written to a
+        temporary file first so a crash never leaves a partial entry behind.
+        """
+        result_file = self._result_file(key)
+        with open(result_file + '.tmp', 'wb') as f_out:
+            pickle.dump(value, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(result_file + '.tmp', result_file)
+
+    def call_key(self, func, filename, *args, **kwargs):
+        """
+        This function returns the key call() stores func(filename, *args,
+        **kwargs) under.
+        """
+        return self.key('{}.{}@{}'.format(func.__module__, func.__qualname__,
+                                          module_version(func.__module__)),
+                        filename, *args, **kwargs)
+
+    def call(self, func, filename, *args, **kwargs):
+        """
+        This function returns func(filename, *args, **kwargs), computing and
+        storing it only if there is no entry for the current state of filename.
+        """
+        key = self.call_key(func, filename, *args, **kwargs)
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = func(filename, *args, **kwargs)
+            self.put(key, value)
+        return value
+
+    def restore_outputs(self, key, outputs):
+        """
+        This function copies the cached copies of outputs (file or directory
+        paths) back into place. Returns False if the entry is incomplete.
+        Outputs that still match the fingerprint recorded when they were
+        cached are left alone.
+        """
+        entry = os.path.join(self.cache_dir, 'outputs', key)
+        recorded = self.get(key)
+        if recorded is None:
+            return False
+        for i, output in enumerate(outputs):
+            if not os.path.exists(os.path.join(entry, str(i))):
+                return False
+        for i, output in enumerate(outputs):
+            if os.path.exists(output) and output_fingerprint(output) == recorded.get(output):
+                continue
+            _copy(os.path.join(entry, str(i)), output)
+            recorded[output] = output_fingerprint(output)
+        self.put(key, recorded)
+        return True
+
+    def store_outputs(self, key, outputs):
+        """
+        This function keeps copies of outputs (file or directory paths) under key.
+        """
+        entry = os.path.join(self.cache_dir, 'outputs', key)
+        os.makedirs(entry, exist_ok=True)
+        for i, output in enumerate(outputs):
+            _copy(output, os.path.join(entry, str(i)))
+        self.put(key, {output: output_fingerprint(output) for output in outputs})
+
+
+def cached_condense_cities(cache, city_info, columnar=False, sample_rate=None, sketches=False,
+                           stations=False, partition_root=None, **kwargs):
+    """
+    This function condenses only the cities in city_info whose raw input
+    (or the helper code, or the outputs asked for) changed since the last
+    run, and restores the cached condensed outputs for the rest, along
+    with their columnar copy, sample, sketches and station counts when
+    asked for. With a partition_root, every city's partitions of the store
+    there are rewritten too: by condensing, or from the restored summary
+    file. Extra keyword arguments (which do not change the outputs) are
+    passed to bikeshare.parallel.condense_cities.
+    """
+    from bikeshare.columnar import columnar_path
+    from bikeshare.parallel import condense_cities
+    from bikeshare.partition import partition_summary
+    from bikeshare.sampling import sample_path
+    from bikeshare.sketch import sketch_path
+    from bikeshare.stations import station_path
+
+    stale = {}
+    keys = {}
+    for city, filenames in city_info.items():
+        out_file = filenames['out_file']
+        outputs = [out_file]
+        if columnar:
+            outputs.append(columnar_path(out_file))
+        if sample_rate:
+            outputs.append(sample_path(out_file))
+        if sketches:
+            outputs.append(sketch_path(out_file))
+        if stations:
+            outputs.append(station_path(out_file))
+        keys[city] = (cache.key('condense', filenames['in_file'], city, columnar,
+                                sample_rate or None, sketches, stations), outputs)
+        if not cache.restore_outputs(*keys[city]):
+            stale[city] = filenames
+
+    if stale:
+        condense_cities(stale, columnar=columnar, sample_rate=sample_rate, sketches=sketches,
+                        stations=stations, partition_root=partition_root, **kwargs)
+        for city in stale:
+            cache.store_outputs(*keys[city])
+    if partition_root is not None:
+        # the store is outside the cache, so restored cities are split again
+        for city, filenames in city_info.items():
+            if city not in stale:
+                partition_summary(filenames['out_file'], partition_root, city)
+    return sorted(stale)
@@ -0,0 +1,541 @@
+"""
+Command-line entry point for batch runs, without the notebook.
+
+    python -m bikeshare condense --cities NYC Chicago --workers 8
+    python -m bikeshare condense --cities NYC --incremental
+    python -m bikeshare stats --format json
+    python -m bikeshare stats --approx --sample-rate 0.01
+    python -m bikeshare monthly --cities Washington --format csv -o monthly.csv
+    python -m bikeshare hist --cities Washington --bins 15 --range 0 75
+    python -m bikeshare cube --by hour --where month=6,7,8
+    python -m bikeshare quantiles --by user_type --q 0.5 0.9 0.99 --over 30 60
+    python -m bikeshare stations --rank routes --top 20
+    python -m bikeshare rebalance --cities NYC --resolution 15 --series
+    python -m bikeshare figures --image-format svg --figure-dir report
+    python -m bikeshare bench --rows 1e6 --save bench.json
+
+Each subcommand runs only its own stage: nothing is plotted (unless hist is
+given --plot, or by figures) and IPython and nbconvert are never imported.  Files are found
+in --data-dir under the notebook's names (raw files may also be compressed,
+with a .gz, .bz2, .xz or .zst suffix), or given explicitly with --input
+and --summary when a single city is selected.
+"""
+import argparse
+import calendar
+import csv
+import json
+import os
+import sys
+
+from bikeshare.aggregate import USER_TYPES
+from bikeshare.compression import find_raw_file
+from bikeshare.sampling import CONFIDENCE, SAMPLE_RATE
+from bikeshare.schema import get_schema
+
+DEFAULT_CITIES = ['NYC', 'Chicago', 'Washington']
+
+DEFAULT_DATA_DIR = './data'
+
+# raw file names of the notebook's cities; others default to '<city>-2016.csv'
+RAW_FILES = {'NYC': 'NYC-CitiBike-2016.csv',
+             'Chicago': 'Chicago-Divvy-2016.csv',
+             'Washington': 'Washington-CapitalBikeshare-2016.csv'}
+
+FORMATS = ('text', 'json', 'csv')
+
+
+def city_files(args):
+    """
+    This function returns {city: {'in_file': ..., 'out_file': ...}} for the
+    selected cities, the same shape as the notebook's city_info.
+    """
+    if (args.input or args.summary) and len(args.cities) != 1:
+        raise SystemExit('--input and --summary need exactly one city')
+    city_info = {}
+    for city in args.cities:
+        get_schema(city)
+        raw_name = RAW_FILES.get(city, '{}-2016.csv'.format(city))
+        summary_name = '{}-2016-Summary.csv'.format(city)
+        # the raw file may be kept compressed, as e.g. NYC-CitiBike-2016.csv.gz
+        raw_file = find_raw_file(os.path.join(args.data_dir, raw_name))
+        city_info[city] = {'in_file': args.input or raw_file,
+                           'out_file': args.summary or os.path.join(args.data_dir, summary_name)}
+    return city_info
+
+
+def write_rows(rows, fields, args):
+    """
+    This function writes a list of dictionaries in the selected format to
+    the output file (stdout by default).
+    """
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'json':
+            json.dump(rows, out, indent=2)
+            out.write('\n')
+        elif args.format == 'csv':
+            writer = csv.DictWriter(out, fields, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            table = [fields] + [[_text(row[field]) for field in fields] for row in rows]
+            widths = [max(len(line[i]) for line in table) for i in range(len(fields))]
+            for line in table:
+                out.write('  '.join(value.rjust(width) if i else value.ljust(width)
+                                    for i, (value, width) in enumerate(zip(line, widths)))
+                          .rstrip() + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def _text(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
+
+
+def _summaries(args):
+    """
+    This function returns {city: summarize() results} for the selected
+    cities, using the result cache unless --no-cache is given.
+    """
+    from bikeshare.aggregate import summarize
+    from bikeshare.parallel import summarize_parallel
+
+    results = {}
+    cache = None
+    if not args.no_cache:
+        from bikeshare.cache import ResultCache
+        cache = ResultCache(args.cache_dir)
+    for city, filenames in city_files(args).items():
+        if args.workers and args.workers > 1:
+            results[city] = summarize_parallel(filenames['out_file'], workers=args.workers)
+        elif cache is not None:
+            results[city] = cache.call(summarize, filenames['out_file'])
+        else:
+            results[city] = summarize(filenames['out_file'])
+    return results
+
+
+def cmd_condense(args):
+    city_info = city_files(args)
+    sample_rate = args.sample_rate if args.sample else None
+    if args.incremental:
+        extras = [option for option, value in (('--columnar', args.columnar),
+                                               ('--sample', args.sample),
+                                               ('--sketches', args.sketches),
+                                               ('--stations', args.stations),
+                                               ('--pipelined', args.pipelined)) if value]
+        if extras:
+            raise SystemExit('--incremental cannot be combined with {}'.format(
+                ' '.join(extras)))
+        from bikeshare.incremental import condense_incremental
+        cache = None
+        if not args.no_cache:
+            from bikeshare.cache import ResultCache
+            cache = ResultCache(args.cache_dir)
+        for city, filenames in city_info.items():
+            condense_incremental(filenames['in_file'], filenames['out_file'], city, cache)
+        if args.partition_root:
+            from bikeshare.partition import partition_summary
+            for city, filenames in city_info.items():
+                partition_summary(filenames['out_file'], args.partition_root, city)
+        stale = sorted(city_info)
+    elif args.no_cache:
+        from bikeshare.parallel import condense_cities
+        condense_cities(city_info, workers=args.workers, columnar=args.columnar,
+                        sample_rate=sample_rate, sketches=args.sketches,
+                        pipelined=args.pipelined, stations=args.stations,
+                        partition_root=args.partition_root)
+        stale = sorted(city_info)
+    else:
+        from bikeshare.cache import ResultCache, cached_condense_cities
+        stale = cached_condense_cities(ResultCache(args.cache_dir), city_info,
+                                       columnar=args.columnar, workers=args.workers,
+                                       sample_rate=sample_rate, sketches=args.sketches,
+                                       pipelined=args.pipelined, stations=args.stations,
+                                       partition_root=args.partition_root)
+    rows = [{'city': city, 'in_file': filenames['in_file'], 'out_file': filenames['out_file'],
+             'status': ('updated' if args.incremental else
+                        'condensed' if city in stale else 'cached')}
+            for city, filenames in city_info.items()]
+    write_rows(rows, ['city', 'status', 'in_file', 'out_file'], args)
+
+
+def _with_bounds(row, name, estimate):
+    """
+    This function adds an Estimate to a result row as name, name_low and
+    name_high.
+    """
+    row[name], row[name + '_low'], row[name + '_high'] = estimate
+
+
+def cmd_stats(args):
+    if args.approx:
+        return _approx_stats(args)
+    rows = []
+    for city, results in _summaries(args).items():
+        counts = results['counts']
+        means = results['duration']['mean']
+        total = counts['total']
+        rows.append({'city': city,
+                     'trips': total,
+                     'subscribers': counts['Subscriber'],
+                     'customers': counts['Customer'],
+                     'subscriber_pct': counts['Subscriber'] / total * 100 if total else 0.0,
+                     'customer_pct': counts['Customer'] / total * 100 if total else 0.0,
+                     'mean_duration': means['total'],
+                     'subscriber_mean': means['Subscriber'],
+                     'customer_mean': means['Customer'],
+                     'over_30_pct': results['over_30']})
+    write_rows(rows, list(rows[0]) if rows else ['city'], args)
+
+
+def _approx_stats(args):
+    from bikeshare.sampling import approx_number_of_trips, approx_trip_duration
+
+    rows = []
+    for city, filenames in city_files(args).items():
+        summary_file = filenames['out_file']
+        n_subscribers, n_customers, n_total, subscriber_mean, customer_mean = \
+            approx_number_of_trips(summary_file, args.sample_rate, args.confidence)
+        mean, over_30 = approx_trip_duration(summary_file, args.sample_rate, args.confidence)
+        row = {'city': city,
+               'trips': n_total.value,
+               'subscribers': n_subscribers.value,
+               'customers': n_customers.value}
+        _with_bounds(row, 'mean_duration', mean)
+        _with_bounds(row, 'subscriber_mean', subscriber_mean)
+        _with_bounds(row, 'customer_mean', customer_mean)
+        _with_bounds(row, 'over_30_pct', over_30)
+        rows.append(row)
+    write_rows(rows, list(rows[0]) if rows else ['city'], args)
+
+
+def cmd_monthly(args):
+    if args.approx:
+        return _approx_monthly(args)
+    rows = []
+    for city, results in _summaries(args).items():
+        for month, month_stats in results['monthly'].items():
+            subscriber_pct, customer_pct = results['ratios'][month]
+            rows.append({'city': city,
+                         'month': month,
+                         'subscribers': month_stats['Subscriber'],
+                         'customers': month_stats['Customer'],
+                         'total': month_stats['total'],
+                         'subscriber_pct': subscriber_pct,
+                         'customer_pct': customer_pct,
+                         'subscriber_duration': month_stats['duration'][0],
+                         'customer_duration': month_stats['duration'][1]})
+    write_rows(rows, list(rows[0]) if rows else ['city', 'month'], args)
+
+
+def _approx_monthly(args):
+    from bikeshare.sampling import Estimate, approx_monthly_ratios, city_sample
+
+    rows = []
+    for city, filenames in city_files(args).items():
+        sample = city_sample(filenames['out_file'], args.sample_rate)
+        ratios = approx_monthly_ratios(filenames['out_file'], args.sample_rate)
+        for m in range(1, 13):
+            month = calendar.month_name[m]
+            if month not in ratios:
+                continue
+            subscriber_pct, customer_pct = ratios[month]
+            row = {'city': city,
+                   'month': month,
+                   'subscribers': sample.count((m,), ('Subscriber',)),
+                   'customers': sample.count((m,), ('Customer',)),
+                   'total': sample.count((m,)),
+                   'subscriber_pct': subscriber_pct.value,
+                   'customer_pct': customer_pct.value}
+            # the duration columns are sums: scale the mean estimates by the trip counts
+            for user_type, name in (('Subscriber', 'subscriber_duration'),
+                                    ('Customer', 'customer_duration')):
+                mean = sample.estimate(months=(m,), user_types=(user_type,),
+                                       confidence=args.confidence)
+                n_trips = sample.count((m,), (user_type,))
+                _with_bounds(row, name, Estimate(*(n_trips * value for value in mean)))
+            rows.append(row)
+    write_rows(rows, list(rows[0]) if rows else ['city', 'month'], args)
+
+
+def cmd_hist(args):
+    from bikeshare.histogram import duration_histograms
+
+    rows = []
+    histograms = {}
+    for city, filenames in city_files(args).items():
+        histograms[city] = duration_histograms(filenames['out_file'], args.bins, args.range)
+        for user_type in ('Subscriber', 'Customer', 'total'):
+            histogram = histograms[city][user_type]
+            edges = histogram.edges
+            bins = ([(float('-inf'), edges[0], histogram.underflow)]
+                    + [(edges[i], edges[i + 1], histogram.counts[i])
+                       for i in range(histogram.bins)]
+                    + [(edges[-1], float('inf'), histogram.overflow)])
+            for low, high, count in bins:
+                rows.append({'city': city, 'user_type': user_type,
+                             'low': low, 'high': high, 'count': count})
+    write_rows(rows, ['city', 'user_type', 'low', 'high', 'count'], args)
+
+    if args.plot:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        fig, axes = plt.subplots(len(histograms), 2, squeeze=False,
+                                 figsize=(10, 3 * len(histograms)))
+        for row, (city, city_histograms) in enumerate(histograms.items()):
+            for ax, user_type in zip(axes[row], ('Subscriber', 'Customer')):
+                city_histograms[user_type].plot(ax=ax, rwidth=.9)
+                ax.set_title('Distribution of {} {} Trip Durations'.format(city, user_type))
+                ax.set_xlabel('Duration (m)')
+        fig.tight_layout()
+        fig.savefig(args.plot)
+        plt.close(fig)
+
+
+def cmd_cube(args):
+    from bikeshare.cube import DIMENSIONS, city_cube
+
+    where = {}
+    for condition in args.where:
+        name, _, values = condition.partition('=')
+        if name not in DIMENSIONS or not values:
+            raise ValueError('Bad --where condition: {!r}'.format(condition))
+        where[name] = [int(value) if name in ('month', 'hour') else value
+                       for value in values.split(',')]
+    rows = []
+    for city, filenames in city_files(args).items():
+        result = city_cube(filenames['out_file']).rollup(args.by, where, args.measure)
+        if not args.by:
+            result = {(): result}
+        for key, value in sorted(result.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            row = {'city': city}
+            row.update(zip(args.by, key))
+            row[args.measure] = value
+            rows.append(row)
+    write_rows(rows, ['city'] + list(args.by) + [args.measure], args)
+
+
+def cmd_quantiles(args):
+    from bikeshare.sketch import city_sketches
+
+    groups = {'none': [((), range(1, 13), USER_TYPES)],
+              'user_type': [((user,), range(1, 13), (user,)) for user in USER_TYPES],
+              'month': [((calendar.month_name[m],), (m,), USER_TYPES) for m in range(1, 13)]}
+    by = [] if args.by == 'none' else [args.by]
+    quantile_fields = ['p{:g}'.format(q * 100) for q in args.q]
+    over_fields = ['over_{:g}_pct'.format(threshold) for threshold in args.over]
+    rows = []
+    for city, filenames in city_files(args).items():
+        sketches = city_sketches(filenames['out_file'])
+        for key, months, user_types in groups[args.by]:
+            sketch = sketches.sketch(months, user_types)
+            if not sketch.n:
+                continue
+            row = {'city': city}
+            row.update(zip(by, key))
+            row['trips'] = sketch.n
+            row.update(zip(quantile_fields, sketch.quantiles(args.q)))
+            row.update((field, (1 - sketch.rank(threshold)) * 100)
+                       for field, threshold in zip(over_fields, args.over))
+            rows.append(row)
+    write_rows(rows, ['city'] + by + ['trips'] + quantile_fields + over_fields, args)
+
+
+def cmd_stations(args):
+    from bikeshare.stations import city_stations
+
+    if args.rank == 'routes':
+        fields = ['city', 'rank', 'origin', 'destination', 'trips', 'error']
+    else:
+        fields = ['city', 'rank', 'station', 'trips', 'error']
+    rows = []
+    for city, filenames in city_files(args).items():
+        traffic = city_stations(filenames['in_file'], filenames['out_file'], city)
+        if args.rank == 'routes':
+            error = traffic.routes.error_bound
+            for rank, (origin, destination, trips) in enumerate(traffic.top_routes(args.top), 1):
+                rows.append({'city': city, 'rank': rank, 'origin': origin,
+                             'destination': destination, 'trips': trips, 'error': error})
+        else:
+            error = getattr(traffic, args.rank).error_bound
+            for rank, (station, trips) in enumerate(traffic.top_stations(args.top, args.rank), 1):
+                rows.append({'city': city, 'rank': rank, 'station': station, 'trips': trips,
+                             'error': error})
+    write_rows(rows, fields, args)
+
+
+def cmd_rebalance(args):
+    from bikeshare.rebalance import city_drift, rebalance_path
+
+    fields = ['city', 'station', 'departures', 'arrivals', 'net_flow', 'min_drift', 'min_at',
+              'max_drift', 'max_at']
+    rows = []
+    for city, filenames in city_files(args).items():
+        series_file = rebalance_path(filenames['out_file']) if args.series else None
+        drifts = city_drift(filenames['in_file'], city, series_file,
+                            resolution=int(args.resolution * 60), work_dir=args.work_dir)
+        # stations whose stock swings most need the most docks or rebalancing
+        drifts.sort(key=lambda drift: drift.max_drift - drift.min_drift, reverse=True)
+        rows.extend(dict(drift._asdict(), city=city) for drift in drifts[:args.top])
+    write_rows(rows, fields, args)
+
+
+def cmd_figures(args):
+    from bikeshare.render import city_figures, render_figures
+
+    specs = []
+    for city, results in _summaries(args).items():
+        specs.extend(city_figures(city, results))
+    rows = [{'figure': spec.name, 'status': status, 'file': filename}
+            for spec, filename, status in render_figures(specs, args.figure_dir,
+                                                         args.image_format, args.workers)]
+    write_rows(rows, ['figure', 'status', 'file'], args)
+
+
+def cmd_bench(args):
+    from bikeshare import bench
+    return bench.main(args)
+
+
+def build_parser():
+    """
+    This function returns the argparse parser with every subcommand.
+    """
+    from bikeshare import bench
+
+    parser = argparse.ArgumentParser(prog='python -m bikeshare',
+                                     description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--cities', nargs='+', default=DEFAULT_CITIES,
+                        help='cities to process (default: NYC Chicago Washington)')
+    common.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='directory holding the raw and summary files (default ./data)')
+    common.add_argument('--input', default=None, help='raw trip file (one city only)')
+    common.add_argument('--summary', default=None, help='condensed summary file (one city only)')
+    common.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU; 1 runs serially)')
+    common.add_argument('--format', choices=FORMATS, default='text')
+    common.add_argument('-o', '--output', default=None, help='write to this file, not stdout')
+    common.add_argument('--no-cache', action='store_true',
+                        help='recompute instead of reusing cached results')
+    common.add_argument('--cache-dir', default='.bikeshare-cache')
+    common.add_argument('--sample-rate', type=float, default=SAMPLE_RATE,
+                        help='fraction of trips kept in the sample files (default 0.01)')
+
+    approx = argparse.ArgumentParser(add_help=False)
+    approx.add_argument('--approx', action='store_true',
+                        help='answer from the stratified sample, with confidence intervals')
+    approx.add_argument('--confidence', type=float, default=CONFIDENCE,
+                        help='confidence level of the intervals (default 0.95)')
+
+    condense = commands.add_parser('condense', parents=[common],
+                                   help='condense raw trip files into summary files')
+    condense.add_argument('--columnar', action='store_true',
+                          help='also write the columnar copy used by bikeshare.vectorized')
+    condense.add_argument('--sample', dest='sample', action='store_true',
+                          help='also save the stratified sample used by --approx')
+    condense.add_argument('--sketches', action='store_true',
+                          help='also save the duration quantile sketches used by quantiles')
+    condense.add_argument('--pipelined', action='store_true',
+                          help='overlap reading, condensing and writing on threads, one city '
+                               'at a time (for slow or network storage)')
+    condense.add_argument('--incremental', action='store_true',
+                          help='condense only the rows appended to each raw file since the '
+                               'last --incremental run')
+    condense.add_argument('--stations', action='store_true',
+                          help='also count the station traffic used by stations')
+    condense.add_argument('--partition-root', metavar='DIR',
+                          help='also split each summary file into the store in DIR, by city '
+                               'and month')
+    condense.set_defaults(func=cmd_condense)
+
+    stats = commands.add_parser('stats', parents=[common, approx],
+                                help='trip counts, user type shares and durations per city')
+    stats.set_defaults(func=cmd_stats)
+
+    monthly = commands.add_parser('monthly', parents=[common, approx],
+                                  help='trips, ratios and durations per city and month')
+    monthly.set_defaults(func=cmd_monthly)
+
+    hist = commands.add_parser('hist', parents=[common],
+                               help='trip duration histogram bins per city and user type')
+    hist.add_argument('--bins', type=int, default=15)
+    hist.add_argument('--range', type=float, nargs=2, default=(0, 75), metavar=('LOW', 'HIGH'))
+    hist.add_argument('--plot', default=None,
+                      help='also save the subscriber/customer plots to this image file')
+    hist.set_defaults(func=cmd_hist)
+
+    cube = commands.add_parser('cube', parents=[common],
+                               help='roll up the month x hour x weekday x user type cube')
+    cube.add_argument('--by', nargs='*', default=['hour'],
+                      choices=['month', 'hour', 'day_of_week', 'user_type'],
+                      help='dimensions to keep (default: hour)')
+    cube.add_argument('--where', nargs='*', default=[], metavar='DIM=V1,V2',
+                      help='only count these values, e.g. month=6,7,8 day_of_week=Saturday,Sunday')
+    cube.add_argument('--measure', choices=['count', 'duration', 'mean'], default='count')
+    cube.set_defaults(func=cmd_cube)
+
+    quantiles = commands.add_parser('quantiles', parents=[common],
+                                    help='approximate trip duration quantiles from sketches')
+    quantiles.add_argument('--by', choices=['none', 'user_type', 'month'], default='none')
+    quantiles.add_argument('--q', type=float, nargs='+', default=[0.5, 0.9, 0.99],
+                           help='quantiles to report (default: 0.5 0.9 0.99)')
+    quantiles.add_argument('--over', type=float, nargs='*', default=[30],
+                           help='also report the share of trips longer than these minutes')
+    quantiles.set_defaults(func=cmd_quantiles)
+
+    stations = commands.add_parser('stations', parents=[common],
+                                   help='busiest stations or routes from the raw files')
+    stations.add_argument('--rank', choices=['traffic', 'departures', 'arrivals', 'routes'],
+                          default='traffic',
+                          help='rank stations by trips starting and ending there, or routes')
+    stations.add_argument('--top', type=int, default=10, help='rows per city (default: 10)')
+    stations.set_defaults(func=cmd_stations)
+
+    rebalance = commands.add_parser('rebalance', parents=[common],
+                                    help='station inventory drift from trip start and end '
+                                         'events')
+    rebalance.add_argument('--top', type=int, default=10,
+                           help='stations per city with the widest drift (default: 10)')
+    rebalance.add_argument('--resolution', type=float, default=60, metavar='MINUTES',
+                           help='time series interval (default: 60)')
+    rebalance.add_argument('--series', action='store_true',
+                           help='also write each station\'s net flow and drift per interval '
+                                'to *-Summary.rebalance.csv')
+    rebalance.add_argument('--work-dir', help='directory for the sorted event runs')
+    rebalance.set_defaults(func=cmd_rebalance)
+
+    figures = commands.add_parser('figures', parents=[common],
+                                  help='render the notebook\'s figures to image files, headless')
+    figures.add_argument('--figure-dir', default='./figures',
+                         help='directory for the images (default ./figures)')
+    figures.add_argument('--image-format', choices=['png', 'svg'], default='png')
+    figures.set_defaults(func=cmd_figures)
+
+    bench_parser = commands.add_parser('bench', help='benchmark the pipeline on synthetic data')
+    bench.add_arguments(bench_parser)
+    bench_parser.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    This function runs the command line and returns the exit code.
+    """
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args) or 0
+    except (OSError, ValueError) as error:
+        print('error: {}'.format(error), file=sys.stderr)
+        return 1
@@ -0,0 +1,235 @@
+"""
+Compact columnar storage for the condensed trip data.
+
+Next to each ``*-2016-Summary.csv`` the condensing step can write a directory
+(``*-2016-Summary.cols``) holding one raw binary file per column plus a small
+``meta.json`` header:
+
+- duration:    float32 minutes
+- month, hour: uint8
+- day_of_week: uint8, 0 = Monday ... 6 = Sunday
+- user_type:   uint8, dictionary-encoded (the dictionary is in meta.json)
+
+Writing only needs the standard library.  ``load_columns`` memory-maps each
+column as a read-only NumPy array, so the analysis functions read the data in
+place without parsing or copying it.
+"""
+from array import array
+import calendar
+import csv
+import json
+import os
+import shutil
+import sys
+
+FORMAT_VERSION = 1
+
+META_FILE = 'meta.json'
+
+# column name -> (array typecode, NumPy dtype without byte order)
+COLUMNS = {'duration': ('f', 'f4'),
+           'month': ('B', 'u1'),
+           'hour': ('B', 'u1'),
+           'day_of_week': ('B', 'u1'),
+           'user_type': ('B', 'u1')}
+
+DAY_NAMES = list(calendar.day_name)
+
+# rows buffered in memory before they are appended to the column files
+FLUSH_ROWS = 65536
+
+
+def columnar_path(summary_file):
+    """
+    This function returns the columnar directory that goes alongside a
+    summary csv file, e.g. NYC-2016-Summary.csv -> NYC-2016-Summary.cols
+    """
+    return os.path.splitext(summary_file)[0] + '.cols'
+
+
+def _column_file(out_dir, name):
+    return os.path.join(out_dir, name + '.' + COLUMNS[name][1])
+
+
+class ColumnarWriter(object):
+    """
+    Writes condensed trip points to a columnar directory. It has the same
+    writerow()/writerows() methods as the csv.writer used by condense_data,
+    so it can take its place (or sit beside it, see TeeWriter).
+    """
+
+    def __init__(self, out_dir, user_types=('Subscriber', 'Customer')):
+        self.out_dir = out_dir
+        self.user_types = list(user_types)
+        self._user_codes = {user: i for i, user in enumerate(self.user_types)}
+        self._day_codes = {day: i for i, day in enumerate(DAY_NAMES)}
+        self._buffers = {name: array(typecode) for name, (typecode, _) in COLUMNS.items()}
+        self.rows = 0
+
+        os.makedirs(out_dir, exist_ok=True)
+        # start every column file empty
+        for name in COLUMNS:
+            open(_column_file(out_dir, name), 'wb').close()
+
+    def writerow(self, point):
+        """
+        This function buffers one condensed trip point, a sequence of
+        (duration, month, hour, day_of_week, user_type) as in a summary row.
+        """
+        duration, month, hour, day_of_week, user_type = point
+        if user_type not in self._user_codes:
+            self._user_codes[user_type] = len(self.user_types)
+            self.user_types.append(user_type)
+
+        buffers = self._buffers
+        buffers['duration'].append(float(duration))
+        buffers['month'].append(int(month))
+        buffers['hour'].append(int(hour))
+        buffers['day_of_week'].append(self._day_codes[day_of_week])
+        buffers['user_type'].append(self._user_codes[user_type])
+        self.rows += 1
+        if len(buffers['month']) >= FLUSH_ROWS:
+            self.flush()
+
+    def writerows(self, points):
+        """
+        This function buffers every condensed trip point of an iterable.
+        """
+        for point in points:
+            self.writerow(point)
+
+    def flush(self):
+        """
+        This function appends the buffered rows to the column files.
+        """
+        for name, buffer in self._buffers.items():
+            with open(_column_file(self.out_dir, name), 'ab') as f_out:
+                buffer.tofile(f_out)
+            del buffer[:]
+
+    def close(self):
+        """
+        This function flushes the remaining rows and writes meta.json.
+        """
+        self.flush()
+        write_meta(self.out_dir, self.rows, self.user_types)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TeeWriter(object):
+    """
+    Passes each writerow()/writerows() call on to several writers, e.g. the
+    summary csv.writer and a ColumnarWriter.
+    """
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def writerow(self, point):
+        for writer in self.writers:
+            writer.writerow(point)
+
+    def writerows(self, points):
+        # the points may be a one-shot iterator, so hold them for every writer
+        points = list(points)
+        for writer in self.writers:
+            writer.writerows(points)
+
+
+def write_meta(out_dir, rows, user_types):
+    """
+    This function writes the meta.json header for a columnar directory.
+    """
+    byte_order = '<' if sys.byteorder == 'little' else '>'
+    meta = {'version': FORMAT_VERSION,
+            'rows': rows,
+            'columns': {name: {'file': os.path.basename(_column_file(out_dir, name)),
+                               'dtype': byte_order + dtype}
+                        for name, (_, dtype) in COLUMNS.items()},
+            'dictionaries': {'user_type': list(user_types),
+                             'day_of_week': DAY_NAMES}}
+    with open(os.path.join(out_dir, META_FILE), 'w') as f_out:
+        json.dump(meta, f_out, indent=2)
+
+
+def read_meta(path):
+    """
+    This function reads and checks the meta.json header of a columnar directory.
+    """
+    with open(os.path.join(path, META_FILE), 'r') as f_in:
+        meta = json.load(f_in)
+    if meta.get('version') != FORMAT_VERSION:
+        raise ValueError('Unsupported columnar format version {!r} in {}'.format(
+            meta.get('version'), path))
+    return meta
+
+
+def concat_columnar(out_dir, part_dirs):
+    """
+    This function joins columnar directories written for consecutive chunks
+    of one file into out_dir, removing the parts. Parts that met extra user
+    types (e.g. Chicago's 'Dependent') in a different order have their
+    user_type codes remapped onto the combined dictionary.
+    """
+    metas = [read_meta(part_dir) for part_dir in part_dirs]
+    user_types = ['Subscriber', 'Customer']
+    for meta in metas:
+        for user_type in meta['dictionaries']['user_type']:
+            if user_type not in user_types:
+                user_types.append(user_type)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in COLUMNS:
+        with open(_column_file(out_dir, name), 'wb') as f_out:
+            for meta, part_dir in zip(metas, part_dirs):
+                with open(_column_file(part_dir, name), 'rb') as f_part:
+                    part_types = meta['dictionaries']['user_type']
+                    if name == 'user_type' and part_types != user_types[:len(part_types)]:
+                        table = bytearray(range(256))
+                        for code, user_type in enumerate(part_types):
+                            table[code] = user_types.index(user_type)
+                        f_out.write(f_part.read().translate(table))
+                    else:
+                        shutil.copyfileobj(f_part, f_out)
+    write_meta(out_dir, sum(meta['rows'] for meta in metas), user_types)
+
+    for part_dir in part_dirs:
+        shutil.rmtree(part_dir)
+
+
+def summary_to_columnar(summary_file, out_dir=None):
+    """
+    This function converts an existing condensed summary csv file into the
+    columnar format and returns the directory it was written to.
+    """
+    out_dir = out_dir or columnar_path(summary_file)
+    with open(summary_file, 'r') as f_in, ColumnarWriter(out_dir) as writer:
+        reader = csv.reader(f_in)
+        if next(reader, None) is not None:
+            writer.writerows(reader)
+    return out_dir
+
+
+def load_columns(path):
+    """
+    This function memory-maps the columns of a columnar directory and returns
+    a dictionary of read-only NumPy arrays keyed by column name, plus a
+    'meta' entry with the header (including the user_type dictionary).
+    """
+    import numpy as np
+
+    meta = read_meta(path)
+    columns = {'meta': meta}
+    for name, info in meta['columns'].items():
+        if meta['rows'] == 0:
+            # np.memmap cannot map an empty file
+            columns[name] = np.empty(0, dtype=info['dtype'])
+        else:
+            columns[name] = np.memmap(os.path.join(path, info['file']), mode='r',
+                                      dtype=info['dtype'], shape=(meta['rows'],))
+    return columns
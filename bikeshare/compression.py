@@ -0,0 +1,315 @@
+"""
+Transparent reading of compressed raw trip files.
+
+The raw feeds are kept gzip-, bzip2-, xz- or zstd-compressed.  ``open_raw``
+opens any of them by their magic bytes (whatever the file is called) and
+decompresses while reading, so no decompressed copy is written to disk;
+plain files are opened as usual.  zstd needs the optional ``zstandard``
+package, imported only when a zstd file is read.
+
+Files made of many independently compressed pieces can be decompressed in
+parallel.  ``iter_decompressed`` finds the pieces without decompressing
+anything:
+
+- BGZF gzip files (as written by bgzip), whose members record their size
+  in a 'BC' header field,
+- zstd files of several frames, read from the seek table of the seekable
+  format when there is one and by walking the frame and block headers
+  otherwise.
+
+Groups of pieces are decompressed on a thread pool (zlib and zstd release
+the GIL while they work) and handed on in file order, so a caller such as
+bikeshare.pipeline sees one stream of bytes.  Other files are decompressed
+as a single stream.
+"""
+import bz2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import io
+import lzma
+import os
+import struct
+import zlib
+
+# leading bytes of each supported format
+MAGIC = ((b'\x1f\x8b', 'gzip'),
+         (b'BZh', 'bz2'),
+         (b'\xfd7zXZ\x00', 'xz'),
+         (b'\x28\xb5\x2f\xfd', 'zstd'))
+
+# file name suffixes of the formats, used to find compressed raw files
+SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+
+# decompressed bytes read at a time when streaming
+READ_BYTES = 4 * 1024 * 1024
+
+# compressed bytes handed to a decompression thread at a time
+GROUP_BYTES = 4 * 1024 * 1024
+
+# zstd skippable frames have magic numbers 0x184D2A50 to 0x184D2A5F
+_SKIPPABLE_MASK = 0xFFFFFFF0
+_SKIPPABLE_MAGIC = 0x184D2A50
+_ZSTD_MAGIC = 0xFD2FB528
+_SEEKABLE_MAGIC = 0x8F92EAB1
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Reading zstd files needs the zstandard package '
+                          '(pip install zstandard)')
+    return zstandard
+
+
+def detect_compression(filename):
+    """
+    This function returns the compression format of a file ('gzip',
+    'bz2', 'xz' or 'zstd') from its first bytes, or None for anything
+    else.
+    """
+    with open(filename, 'rb') as f_in:
+        head = f_in.read(6)
+    for magic, name in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def find_raw_file(filename):
+    """
+    This function returns filename if it exists, or else the first
+    existing compressed variant of it (filename + '.gz', '.bz2', ...), or
+    filename unchanged if there is none.
+    """
+    if os.path.exists(filename):
+        return filename
+    for suffix in SUFFIXES:
+        if os.path.exists(filename + suffix):
+            return filename + suffix
+    return filename
+
+
+def open_raw(filename, mode='r', opener=open):
+    """
+    This function opens a raw file for reading in mode 'r' (text, as
+    open(filename, 'r') would) or 'rb', decompressing it while reading if
+    it is compressed. opener opens the file itself.
+    """
+    if mode not in ('r', 'rb'):
+        raise ValueError('open_raw only reads: {!r}'.format(mode))
+    kind = detect_compression(filename)
+    if kind is None:
+        return opener(filename, mode)
+    f_raw = opener(filename, 'rb')
+    if kind == 'gzip':
+        f_in = gzip.GzipFile(fileobj=f_raw)
+    elif kind == 'bz2':
+        f_in = bz2.BZ2File(f_raw)
+    elif kind == 'xz':
+        f_in = lzma.LZMAFile(f_raw)
+    else:
+        f_in = io.BufferedReader(
+            _zstandard().ZstdDecompressor().stream_reader(f_raw, read_across_frames=True))
+    if kind != 'zstd':
+        # the decompressors leave a file object they were handed open
+        f_in = _Closing(f_in, f_raw)
+    return io.TextIOWrapper(f_in) if mode == 'r' else f_in
+
+
+class _Closing(io.BufferedIOBase):
+    """
+    A decompressing file that also closes the compressed file under it.
+    """
+
+    def __init__(self, f_in, f_raw):
+        self.f_in = f_in
+        self.f_raw = f_raw
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.f_in.read(size)
+
+    def read1(self, size=-1):
+        return self.f_in.read1(size)
+
+    def readinto(self, buf):
+        return self.f_in.readinto(buf)
+
+    def close(self):
+        if not self.closed:
+            self.f_in.close()
+            self.f_raw.close()
+        super(_Closing, self).close()
+
+
+def bgzf_members(f_in):
+    """
+    This function returns the (offset, size) of every member of a BGZF
+    file, from the 'BC' field of each member's header, or None if some
+    member lacks it (an ordinary gzip file).
+    """
+    members = []
+    offset = 0
+    while True:
+        f_in.seek(offset)
+        header = f_in.read(12)
+        if not header:
+            return members
+        if len(header) < 12 or header[:3] != b'\x1f\x8b\x08' or not header[3] & 4:
+            return None
+        extra = f_in.read(struct.unpack('<H', header[10:12])[0])
+        pos = 0
+        size = None
+        while pos + 4 <= len(extra):
+            subfield, length = extra[pos:pos + 2], struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+            if subfield == b'BC' and length == 2:
+                size = struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+                break
+            pos += 4 + length
+        if size is None:
+            return None
+        members.append((offset, size))
+        offset += size
+
+
+def zstd_frames(f_in):
+    """
+    This function returns the (offset, size) of every data frame of a zstd
+    file, skipping skippable frames. The seek table of the seekable format
+    is used when present; otherwise the frame and block headers are walked
+    (a few bytes per block).
+    """
+    frames = _seek_table(f_in)
+    if frames is not None:
+        return frames
+    frames = []
+    end = f_in.seek(0, os.SEEK_END)
+    offset = 0
+    while offset < end:
+        f_in.seek(offset)
+        magic, = struct.unpack('<I', f_in.read(4))
+        if magic & _SKIPPABLE_MASK == _SKIPPABLE_MAGIC:
+            offset += 8 + struct.unpack('<I', f_in.read(4))[0]
+            continue
+        if magic != _ZSTD_MAGIC:
+            raise ValueError('Not a zstd frame at byte {}'.format(offset))
+        descriptor = f_in.read(1)[0]
+        single_segment = descriptor >> 5 & 1
+        header = (1 + (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 3]
+                  + (single_segment, 2, 4, 8)[descriptor >> 6])
+        pos = offset + 4 + header
+        while True:
+            f_in.seek(pos)
+            block, = struct.unpack('<I', f_in.read(3) + b'\x00')
+            # an RLE block (type 1) stores its byte once, whatever its size
+            pos += 3 + (1 if block >> 1 & 3 == 1 else block >> 3)
+            if block & 1:
+                break
+        if descriptor >> 2 & 1:
+            pos += 4
+        frames.append((offset, pos - offset))
+        offset = pos
+    return frames
+
+
+def _seek_table(f_in):
+    """
+    This function returns the frames listed in the seek table of a
+    seekable-format zstd file, or None if it has none.
+    """
+    end = f_in.seek(0, os.SEEK_END)
+    if end < 17:
+        return None
+    f_in.seek(end - 9)
+    n_frames, flags, magic = struct.unpack('<IBI', f_in.read(9))
+    if magic != _SEEKABLE_MAGIC:
+        return None
+    entry_size = 12 if flags & 0x80 else 8
+    table_size = n_frames * entry_size
+    f_in.seek(end - 9 - table_size)
+    table = f_in.read(table_size)
+    frames = []
+    offset = 0
+    for i in range(n_frames):
+        size, = struct.unpack('<I', table[i * entry_size:i * entry_size + 4])
+        frames.append((offset, size))
+        offset += size
+    return frames
+
+
+def _decompress_group(kind, data, sizes):
+    """
+    This function decompresses consecutive pieces of the given sizes held
+    in data.
+    """
+    if kind == 'zstd':
+        return _zstandard().ZstdDecompressor().stream_reader(
+            data, read_across_frames=True).read()
+    view = memoryview(data)
+    out = []
+    offset = 0
+    for size in sizes:
+        # each member on its own: gzip.decompress would copy the rest of data per member
+        out.append(zlib.decompress(view[offset:offset + size], 31))
+        offset += size
+    return b''.join(out)
+
+
+def _groups(pieces, group_bytes):
+    """
+    This function joins consecutive (offset, size) pieces into (offset,
+    sizes of the pieces) groups of at least group_bytes, apart from the
+    last.
+    """
+    groups = []
+    start = end = None
+    for offset, size in pieces:
+        if start is not None and offset != end:
+            # a gap (e.g. a skippable frame) ends the group
+            groups.append((start, sizes))
+            start = None
+        if start is None:
+            start, end, sizes = offset, offset, []
+        sizes.append(size)
+        end += size
+        if end - start >= group_bytes:
+            groups.append((start, sizes))
+            start = None
+    if start is not None:
+        groups.append((start, sizes))
+    return groups
+
+
+def iter_decompressed(filename, workers=None, group_bytes=GROUP_BYTES, opener=open):
+    """
+    This function yields the decompressed contents of a raw file in order,
+    in blocks of varying size. BGZF and multi-frame zstd files are
+    decompressed in groups of about group_bytes on a pool of workers
+    threads (default os.cpu_count(); 1 streams them instead), with at most
+    twice as many groups in flight; other files stream through open_raw.
+    """
+    kind = detect_compression(filename)
+    pieces = None
+    if kind in ('gzip', 'zstd') and workers != 1:
+        with opener(filename, 'rb') as f_in:
+            pieces = bgzf_members(f_in) if kind == 'gzip' else zstd_frames(f_in)
+    if not pieces or len(pieces) < 2:
+        with open_raw(filename, 'rb', opener) as f_in:
+            for data in iter(lambda: f_in.read(READ_BYTES), b''):
+                yield data
+        return
+
+    workers = workers or os.cpu_count()
+    with opener(filename, 'rb') as f_in, ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for offset, sizes in _groups(pieces, group_bytes):
+            f_in.seek(offset)
+            pending.append(pool.submit(_decompress_group, kind, f_in.read(sum(sizes)), sizes))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,146 @@
+"""
+Helpers that clean and trim the raw city trip files into the condensed
+``*-2016-Summary.csv`` format (duration, month, hour, day_of_week, user_type).
+
+These started out as the Question 3 cells of the notebook; they live here so
+that worker processes (see bikeshare.parallel) can import them.  How each
+city's raw file is read is described in bikeshare.schema.
+"""
+import csv
+
+from bikeshare.columnar import ColumnarWriter, TeeWriter
+from bikeshare.compression import open_raw
+from bikeshare.profiling import instrument
+from bikeshare.reader import iter_batches
+from bikeshare.sampling import SAMPLE_RATE, StratifiedSample, save_sample
+from bikeshare.schema import compile_transform, get_schema, time_parser
+from bikeshare.sketch import DurationSketches, save_sketches
+
+# column names of the condensed summary files
+OUT_COLNAMES = ['duration', 'month', 'hour', 'day_of_week', 'user_type']
+
+
+def duration_in_mins(datum, city):
+    """
+    Takes as input a dictionary containing info about a single trip (datum) and
+    its origin city (city) and returns the trip duration in units of minutes.
+
+    Remember that Washington is in terms of milliseconds while Chicago and NYC
+    are in terms of seconds.
+    """
+    schema = get_schema(city)
+    return float(datum[schema.duration])/schema.duration_divisor
+
+
+def time_of_trip(datum, city):
+    """
+    Takes as input a dictionary containing info about a single trip (datum) and
+    its origin city (city) and returns the month, hour, and day of the week in
+    which the trip was made.
+
+    Remember that NYC includes seconds, while Washington and Chicago do not.
+    All three cities use the fixed '%m/%d/%Y %H:%M[:%S]' layout, so the fields
+    are read directly by parse_start_time instead of going through strptime.
+    """
+    schema = get_schema(city)
+    return time_parser(schema.time_format)(datum[schema.start_time])
+
+
+def type_of_user(datum, city):
+    """
+    Takes as input a dictionary containing info about a single trip (datum) and
+    its origin city (city) and returns the type of system user that made the
+    trip.
+
+    Remember that Washington has different category names compared to Chicago
+    and NYC.
+    """
+    schema = get_schema(city)
+    user_type = str(datum[schema.user_type])
+    if schema.user_type_map is None:
+        return user_type
+    return schema.user_type_map.get(user_type, schema.default_user_type)
+
+
+def condense_file(f_in, trip_writer, city, fieldnames=None, max_memory=None, stations=None):
+    """
+    This function reads the raw trips of an open city file in batches of
+    just the needed columns, runs them through the city's compiled row
+    transform and writes the condensed points to trip_writer (anything with
+    a csv.writer-style writerows()). The header row is read from f_in unless
+    fieldnames is given. If stations (a bikeshare.stations.StationTraffic)
+    is given, the start and end stations are read too and counted there.
+    """
+    transform = compile_transform(city)
+    schema = get_schema(city)
+    if stations is None:
+        for batch in iter_batches(f_in, schema.columns, fieldnames=fieldnames,
+                                  max_memory=max_memory):
+            trip_writer.writerows(map(transform, batch))
+        return
+    n_columns = len(schema.columns)
+    for batch in iter_batches(f_in, schema.columns + schema.station_columns,
+                              fieldnames=fieldnames, max_memory=max_memory):
+        trip_writer.writerows(transform(values[:n_columns]) for values in batch)
+        stations.add_trips(values[n_columns:] for values in batch)
+
+
+@instrument
+def condense_data(in_file, out_file, city, columnar_dir=None, sample_file=None,
+                  sample_rate=SAMPLE_RATE, sketch_file=None, partition_root=None,
+                  station_file=None):
+    """
+    This function takes full data from the specified input file
+    and writes the condensed data to a specified output file. The city
+    argument determines how the input file will be parsed. A compressed
+    input file is decompressed as it is read (see bikeshare.compression).
+
+    If columnar_dir is given, the same data is also written there in the
+    binary columnar format (see bikeshare.columnar). If sample_file is
+    given, a StratifiedSample keeping about sample_rate of the trips is
+    saved there (see bikeshare.sampling), and if sketch_file is given, the
+    DurationSketches of the trips (see bikeshare.sketch). If partition_root
+    is given, the city's partitions of the store there are rewritten too
+    (see bikeshare.partition), and if station_file is given, the
+    StationTraffic of the raw trips is saved there (see bikeshare.stations).
+    """
+    # look the city up first so an unknown city fails before out_file is touched
+    get_schema(city)
+    sample = None if sample_file is None else StratifiedSample(sample_rate)
+    sketches = None if sketch_file is None else DurationSketches()
+    stations = None
+    if station_file is not None:
+        from bikeshare.stations import StationTraffic
+        stations = StationTraffic()
+    partitions = None
+    if partition_root is not None:
+        from bikeshare.partition import PartitionWriter
+        partitions = PartitionWriter(partition_root, city)
+    try:
+        with open(out_file, 'w') as f_out, open_raw(in_file) as f_in:
+            trip_writer = csv.writer(f_out)
+            trip_writer.writerow(OUT_COLNAMES)
+            extra_writers = [writer for writer in (sample, sketches, partitions)
+                             if writer is not None]
+            if extra_writers:
+                trip_writer = TeeWriter(trip_writer, *extra_writers)
+
+            if columnar_dir is None:
+                condense_file(f_in, trip_writer, city, stations=stations)
+            else:
+                with ColumnarWriter(columnar_dir) as columnar_writer:
+                    condense_file(f_in, TeeWriter(trip_writer, columnar_writer), city,
+                                  stations=stations)
+    except BaseException:
+        if partitions is not None:
+            partitions.abort()
+        raise
+    if partitions is not None:
+        partitions.close()
+    if sample is not None:
+        save_sample(sample, sample_file, out_file)
+    if sketches is not None:
+        save_sketches(sketches, sketch_file, out_file)
+    if stations is not None:
+        from bikeshare.cache import fingerprint
+        stations.save(station_file, fingerprint(in_file))
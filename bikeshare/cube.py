@@ -0,0 +1,281 @@
+"""
+Dense trip aggregate cube over month x hour x day of week x user type.
+
+The condensed files carry hour and day_of_week for every trip, but the
+statistics functions only ever group by month.  A ``TripCube`` holds the
+trip count and duration sum for every one of the 12 * 24 * 7 * 2 = 4032
+combinations, built in one pass over a summary file.  Any roll-up (trips
+per hour in summer, weekend share per month, mean duration by weekday) is
+then a sum over at most 4032 cells instead of another scan of the file.
+
+``city_cube`` persists the cube next to the summary file (as
+``*-2016-Summary.cube.json``) and rebuilds it only when the summary file
+changes.
+"""
+import calendar
+import csv
+import json
+import os
+
+from bikeshare.aggregate import SEASONS, USER_TYPES
+from bikeshare.columnar import DAY_NAMES
+
+# dimension name -> the values along it, in cube order
+DIMENSIONS = {'month': list(range(1, 13)),
+              'hour': list(range(24)),
+              'day_of_week': DAY_NAMES,
+              'user_type': list(USER_TYPES)}
+
+DIMENSION_NAMES = ('month', 'hour', 'day_of_week', 'user_type')
+
+WEEKEND = ('Saturday', 'Sunday')
+
+CUBE_VERSION = 1
+
+_SIZES = [len(DIMENSIONS[name]) for name in DIMENSION_NAMES]
+_CELLS = _SIZES[0] * _SIZES[1] * _SIZES[2] * _SIZES[3]
+
+
+def _cell(month, hour, day, user):
+    """
+    This function returns the flat index of a cell from its month (1-12),
+    hour (0-23), day (0 = Monday) and user (0 = Subscriber) indexes.
+    """
+    return (((month - 1) * 24 + hour) * 7 + day) * 2 + user
+
+
+class TripCube(object):
+    """
+    Trip counts and duration sums for every month, hour, day of week and
+    user type ('Subscriber', or 'Customer' for every other user type), kept
+    as two flat lists in month-major order.
+    """
+
+    def __init__(self):
+        self.count = [0] * _CELLS
+        self.duration = [0.0] * _CELLS
+
+    def add(self, duration, month, hour, day_of_week, user_type):
+        """
+        This function records one trip; day_of_week is a day name.
+        """
+        cell = _cell(month, hour, _DAY_CODES[day_of_week], 0 if user_type == 'Subscriber' else 1)
+        self.count[cell] += 1
+        self.duration[cell] += duration
+
+    def update(self, rows):
+        """
+        This function records condensed trip rows as csv.reader yields them
+        from a summary file (duration, month, hour, day_of_week, user_type)
+        and returns self.
+        """
+        count = self.count
+        total = self.duration
+        day_codes = _DAY_CODES
+        for duration, month, hour, day_of_week, user_type in rows:
+            cell = _cell(int(month), int(hour), day_codes[day_of_week],
+                         0 if user_type == 'Subscriber' else 1)
+            count[cell] += 1
+            total[cell] += float(duration)
+        return self
+
+    def merge(self, other):
+        """
+        This function adds the cells of another TripCube to this one and
+        returns self.
+        """
+        for cell in range(_CELLS):
+            self.count[cell] += other.count[cell]
+            self.duration[cell] += other.duration[cell]
+        return self
+
+    @property
+    def total(self):
+        return sum(self.count)
+
+    def cells(self, where=None):
+        """
+        This function yields (month, hour, day_of_week, user_type, count,
+        duration) for every cell matching where, a dictionary of dimension
+        name -> value or collection of values (e.g. {'month': (6, 7, 8)}).
+        """
+        selected = _select(where)
+        count = self.count
+        duration = self.duration
+        for m in selected['month']:
+            for h in selected['hour']:
+                for d in selected['day_of_week']:
+                    for u in selected['user_type']:
+                        cell = _cell(m + 1, h, d, u)
+                        yield (m + 1, h, DAY_NAMES[d], USER_TYPES[u],
+                               count[cell], duration[cell])
+
+    def rollup(self, by=(), where=None, measure='count'):
+        """
+        This function sums the cube over every dimension not in by, keeping
+        only cells matching where (see cells()). It returns a dictionary
+        keyed by the value of the by dimension (or a tuple of values when
+        by names more than one), or a single number when by is empty.
+
+        measure is 'count', 'duration' (the duration sum in minutes) or
+        'mean' (duration / count, 0.0 for empty groups).
+        """
+        if isinstance(by, str):
+            by = (by,)
+        unknown = [name for name in by if name not in DIMENSIONS]
+        if unknown or measure not in ('count', 'duration', 'mean'):
+            raise ValueError('Unknown dimension or measure: {}'.format(
+                ', '.join(unknown) or measure))
+        positions = [DIMENSION_NAMES.index(name) for name in by]
+
+        counts = {}
+        durations = {}
+        for values in self.cells(where):
+            key = tuple(values[i] for i in positions)
+            counts[key] = counts.get(key, 0) + values[4]
+            durations[key] = durations.get(key, 0.0) + values[5]
+
+        if measure == 'count':
+            result = counts
+        elif measure == 'duration':
+            result = durations
+        else:
+            result = {key: (durations[key] / counts[key] if counts[key] else 0.0)
+                      for key in counts}
+        if not by:
+            return result.get((), 0)
+        if len(by) == 1:
+            return {key[0]: value for key, value in result.items()}
+        return result
+
+    def peak_hour_by_season(self, user_type=None):
+        """
+        This function returns {season: (busiest start hour, trips in that
+        hour)}, optionally for one user type only.
+        """
+        peaks = {}
+        for season, months in SEASONS.items():
+            where = {'month': months}
+            if user_type is not None:
+                where['user_type'] = user_type
+            by_hour = self.rollup('hour', where)
+            hour = max(by_hour, key=by_hour.get)
+            peaks[season] = (hour, by_hour[hour])
+        return peaks
+
+    def weekend_share_by_month(self, user_type=None):
+        """
+        This function returns {month name: percentage of the month's trips
+        started on a Saturday or Sunday}, leaving out months without trips.
+        """
+        where = {} if user_type is None else {'user_type': user_type}
+        totals = self.rollup('month', where)
+        weekend = self.rollup('month', dict(where, day_of_week=WEEKEND))
+        return {calendar.month_name[m]: weekend[m] / totals[m] * 100
+                for m in DIMENSIONS['month'] if totals[m]}
+
+    def to_dict(self):
+        """
+        This function returns the cube as a JSON-serializable dictionary.
+        """
+        return {'version': CUBE_VERSION,
+                'dimensions': {name: DIMENSIONS[name] for name in DIMENSION_NAMES},
+                'count': self.count, 'duration': self.duration}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        This function rebuilds a TripCube from to_dict() output.
+        """
+        if state.get('version') != CUBE_VERSION:
+            raise ValueError('Unsupported cube version: {!r}'.format(state.get('version')))
+        cube = cls()
+        cube.count = list(state['count'])
+        cube.duration = list(state['duration'])
+        return cube
+
+    def save(self, filename, source=None):
+        """
+        This function writes the cube to a JSON file. source, if given, is
+        stored alongside to record what the cube was built from.
+        """
+        state = self.to_dict()
+        state['source'] = source
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w') as f_out:
+            json.dump(state, f_out)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as f_in:
+            return cls.from_dict(json.load(f_in))
+
+
+_DAY_CODES = {day: i for i, day in enumerate(DAY_NAMES)}
+
+
+def _select(where):
+    """
+    This function turns a where dictionary into the list of indexes to
+    visit along each dimension.
+    """
+    where = where or {}
+    unknown = set(where) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError('Unknown dimensions: {}'.format(', '.join(sorted(unknown))))
+    selected = {}
+    for name in DIMENSION_NAMES:
+        values = DIMENSIONS[name]
+        if name not in where:
+            selected[name] = range(len(values))
+            continue
+        wanted = where[name]
+        if isinstance(wanted, (str, int)):
+            wanted = (wanted,)
+        try:
+            selected[name] = sorted(set(values.index(value) for value in wanted))
+        except ValueError:
+            raise ValueError('Unknown {} in {!r}'.format(name, wanted))
+    return selected
+
+
+def build_cube(filename):
+    """
+    This function reads a condensed trip data file once and returns its
+    TripCube.
+    """
+    with open(filename, 'r') as f_in:
+        reader = csv.reader(f_in)
+        next(reader)
+        return TripCube().update(reader)
+
+
+def cube_path(summary_file):
+    """
+    This function returns the cube file that belongs to a summary file.
+    """
+    root, ext = os.path.splitext(summary_file)
+    return (root if ext == '.csv' else summary_file) + '.cube.json'
+
+
+def city_cube(summary_file):
+    """
+    This function returns the TripCube of a summary file, loading it from
+    cube_path(summary_file) when it was built from the file as it is now,
+    and building and saving it otherwise.
+    """
+    from bikeshare.cache import fingerprint
+
+    source = fingerprint(summary_file)
+    path = cube_path(summary_file)
+    try:
+        with open(path, 'r') as f_in:
+            state = json.load(f_in)
+        if state.get('source') == source:
+            return TripCube.from_dict(state)
+    except (OSError, ValueError):
+        pass
+    cube = build_cube(summary_file)
+    cube.save(path, source)
+    return cube
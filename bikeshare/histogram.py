@@ -0,0 +1,135 @@
+"""
+Fixed-memory streaming histograms of trip durations.
+
+The notebook's histogram cells collect every duration into a Python list and
+pass it to plt.hist.  A ``StreamingHistogram`` keeps only the bin counts (plus
+underflow and overflow buckets), so it uses the same memory for a thousand
+trips as for a hundred million, and ``plot`` draws the bars from those counts.
+The defaults match the notebook plots: 15 five-minute bins over 0-75 minutes.
+"""
+import csv
+
+from bikeshare.profiling import count_rows, instrument
+
+DEFAULT_BINS = 15
+DEFAULT_RANGE = (0, 75)
+
+
+class StreamingHistogram(object):
+    """
+    Counts of values in bins equal-width bins over hist_range. As in
+    plt.hist, each bin includes its lower edge and the last bin also
+    includes the upper edge; values outside the range go to the underflow
+    and overflow buckets.
+    """
+
+    def __init__(self, bins=DEFAULT_BINS, hist_range=DEFAULT_RANGE):
+        lo, hi = hist_range
+        if bins < 1 or not hi > lo:
+            raise ValueError('Need at least one bin and a non-empty range')
+        self.bins = bins
+        self.hist_range = (lo, hi)
+        self.counts = [0] * bins
+        self.underflow = 0
+        self.overflow = 0
+        self._scale = bins / (hi - lo)
+
+    def add(self, value):
+        """
+        This function counts one value.
+        """
+        lo, hi = self.hist_range
+        if value < lo:
+            self.underflow += 1
+        elif value > hi:
+            self.overflow += 1
+        else:
+            self.counts[min(int((value - lo) * self._scale), self.bins - 1)] += 1
+
+    def update(self, values):
+        """
+        This function counts every value of an iterable and returns self.
+        """
+        add = self.add
+        for value in values:
+            add(value)
+        return self
+
+    @property
+    def edges(self):
+        """
+        The bins + 1 bin edges.
+        """
+        lo, hi = self.hist_range
+        width = (hi - lo) / self.bins
+        return [lo + i * width for i in range(self.bins)] + [hi]
+
+    @property
+    def total(self):
+        """
+        The number of values counted, including under- and overflow.
+        """
+        return sum(self.counts) + self.underflow + self.overflow
+
+    def merge(self, other):
+        """
+        This function adds the counts of another histogram with the same
+        bins to this one and returns self.
+        """
+        if (self.bins, self.hist_range) != (other.bins, other.hist_range):
+            raise ValueError('Cannot merge histograms with different bins')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def to_dict(self):
+        """
+        This function returns the histogram as a JSON-serializable dictionary.
+        """
+        return {'bins': self.bins, 'range': list(self.hist_range),
+                'counts': list(self.counts),
+                'underflow': self.underflow, 'overflow': self.overflow}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        This function rebuilds a histogram from to_dict() output.
+        """
+        histogram = cls(state['bins'], state['range'])
+        histogram.counts = list(state['counts'])
+        histogram.underflow = state['underflow']
+        histogram.overflow = state['overflow']
+        return histogram
+
+    @instrument
+    def plot(self, ax=None, **kwargs):
+        """
+        This function draws the histogram bars from the precomputed counts on
+        ax (the current pyplot axes by default). Keyword arguments such as
+        rwidth are passed on to hist().
+        """
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
+        edges = self.edges
+        return ax.hist(edges[:-1], bins=edges, weights=self.counts, **kwargs)
+
+
+@instrument
+def duration_histograms(filename, bins=DEFAULT_BINS, hist_range=DEFAULT_RANGE):
+    """
+    This function reads a condensed trip data file once and returns
+    streaming histograms of trip duration for all trips, subscribers, and
+    customers, as a dictionary keyed by 'total', 'Subscriber' and 'Customer'.
+    """
+    histograms = {key: StreamingHistogram(bins, hist_range)
+                  for key in ('total', 'Subscriber', 'Customer')}
+    total = histograms['total']
+    with open(filename, 'r') as f_in:
+        for row in count_rows(csv.DictReader(f_in)):
+            duration = float(row['duration'])
+            total.add(duration)
+            if row['user_type'] in histograms:
+                histograms[row['user_type']].add(duration)
+    return histograms
@@ -0,0 +1,143 @@
+"""
+Incremental, append-only condensing for trip feeds that grow over time.
+
+NYC publishes monthly, Washington quarterly and Chicago twice a year, and a
+new release only appends rows to the raw file.  ``condense_incremental``
+records a high-water mark for each raw file (the byte offset just past the
+last complete row condensed) and, on the next run, condenses only the bytes
+after it, streaming them, and appends them to the summary file.
+The running TripStats for the summary is kept with the mark and merged with
+the statistics of the new rows alone, so the statistics never need a full recompute either.
+
+If the raw file was rewritten rather than appended to (it shrank, its
+header changed, or the bytes just before the mark differ), everything is
+condensed again from scratch.
+"""
+import csv
+import hashlib
+import json
+import os
+import shutil
+
+from bikeshare.aggregate import TripStats, summarize
+from bikeshare.compression import detect_compression
+from bikeshare.condense import OUT_COLNAMES
+from bikeshare.parallel import condense_chunk, stitch_parts
+
+STATE_VERSION = 3
+
+# bytes before the high-water mark hashed to detect a rewritten raw file
+CHECK_BYTES = 4096
+
+
+def state_path(out_file):
+    """
+    This function returns the high-water mark file kept next to a summary file.
+    """
+    return out_file + '.state.json'
+
+
+def _check_hash(in_file, offset):
+    with open(in_file, 'rb') as f_in:
+        f_in.seek(max(0, offset - CHECK_BYTES))
+        return hashlib.sha256(f_in.read(min(offset, CHECK_BYTES))).hexdigest()
+
+
+def _complete_end(in_file):
+    """
+    This function returns the offset just past the last newline of in_file,
+    so that a row still being written is left for the next run.
+    """
+    size = os.path.getsize(in_file)
+    with open(in_file, 'rb') as f_in:
+        position = size
+        while position > 0:
+            start = max(0, position - 65536)
+            f_in.seek(start)
+            block = f_in.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def load_state(out_file):
+    """
+    This function reads the high-water mark state of a summary file, or
+    returns None if there is none.
+    """
+    try:
+        with open(state_path(out_file), 'r') as f_in:
+            state = json.load(f_in)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('version') == STATE_VERSION else None
+
+
+def _is_appended(in_file, out_file, state, header):
+    """
+    This function checks that in_file only grew since the state was saved.
+    """
+    return (state is not None
+            and os.path.exists(out_file)
+            and os.path.getsize(out_file) == state['out_size']
+            and state['header'] == header.decode()
+            and os.path.getsize(in_file) >= state['offset']
+            and _check_hash(in_file, state['offset']) == state['check'])
+
+
+def condense_incremental(in_file, out_file, city, cache=None):
+    """
+    This function brings out_file up to date with in_file, condensing only
+    the rows appended since the last run, and returns the summarize()
+    results for the whole summary file (computed from the saved state plus
+    the new rows).
+
+    If a bikeshare.cache.ResultCache is given, the merged results are stored
+    as its summarize() entry for the updated out_file, so a following
+    cache.call(summarize, out_file) does not rescan it.
+    """
+    if detect_compression(in_file):
+        raise ValueError('Incremental condensing needs an uncompressed raw file: {}'.format(
+            in_file))
+    with open(in_file, 'rb') as f_in:
+        header = f_in.readline()
+        header_end = f_in.tell()
+    end = max(_complete_end(in_file), header_end)
+
+    state = load_state(out_file)
+    if _is_appended(in_file, out_file, state, header):
+        start = state['offset']
+        aggregates = TripStats.from_dict(state['aggregates'])
+    else:
+        start = header_end
+        aggregates = TripStats()
+        # start the summary over with just its header row
+        stitch_parts(out_file, [])
+
+    if end > start:
+        part_file = out_file + '.new'
+        condense_chunk(in_file, start, end, header, part_file, city)
+        with open(part_file, 'r') as f_in:
+            aggregates.merge(TripStats().update(csv.DictReader(f_in, fieldnames = OUT_COLNAMES)))
+        with open(out_file, 'ab') as f_out, open(part_file, 'rb') as f_part:
+            shutil.copyfileobj(f_part, f_out)
+        os.remove(part_file)
+
+    state = {'version': STATE_VERSION,
+             'in_file': os.path.abspath(in_file),
+             'city': city,
+             'header': header.decode(),
+             'offset': end,
+             'check': _check_hash(in_file, end),
+             'out_size': os.path.getsize(out_file),
+             'aggregates': aggregates.to_dict()}
+    with open(state_path(out_file) + '.tmp', 'w') as f_out:
+        json.dump(state, f_out)
+    os.replace(state_path(out_file) + '.tmp', state_path(out_file))
+
+    results = aggregates.results()
+    if cache is not None:
+        cache.put(cache.call_key(summarize, out_file), results)
+    return results
@@ -0,0 +1,321 @@
+"""
+Byte-level scanner for the raw city trip files.
+
+csv.reader decodes the whole file to str and builds a string for every field
+of every row, although condensing reads only three fields.  ``scan_city``
+memory-maps the raw file instead and works on its bytes: lines are found
+and split with the bytes methods (in C), each only up to the last column
+condensing needs, and the duration, start time and user type are converted
+from bytes without decoding the row.  User types and the date and hour
+of the start time repeat (a year has 8784 hours), so their conversions are
+cached by their raw bytes.
+
+Blocks holding a double quote are walked record by record, and quoted
+records are split by ``split_quoted``, which follows the csv quoting rules
+(commas and line breaks inside quotes, doubled quotes), so ``condense_mmap``
+writes the same bytes as condense_data.
+"""
+import calendar
+import csv
+from datetime import date
+import mmap
+import os
+
+from bikeshare.compression import detect_compression, open_raw
+from bikeshare.profiling import instrument
+from bikeshare.sampling import SAMPLE_RATE, StratifiedSample, save_sample
+from bikeshare.schema import FAST_TIME_FORMATS, get_schema, time_parser
+from bikeshare.sketch import DurationSketches, save_sketches
+
+# condensed points handed to the writer at a time
+BATCH_ROWS = 10000
+
+# bytes scanned per block; a block without quotes is matched in one sweep
+BLOCK_BYTES = 4 * 1024 * 1024
+
+QUOTE = ord('"')
+CARRIAGE_RETURN = ord('\r')
+
+_weekdays = {}
+
+
+def _day_name(year, month, day):
+    """
+    This function returns the weekday name of a date, cached per date (a
+    year of trips only has 366 of them).
+    """
+    key = (year, month, day)
+    name = _weekdays.get(key)
+    if name is None:
+        name = _weekdays[key] = calendar.day_name[date(year, month, day).weekday()]
+    return name
+
+
+def open_map(filename):
+    """
+    This function memory-maps a file read-only. Empty files cannot be
+    mapped, so they come back as an empty bytes object.
+    """
+    with open(filename, 'rb') as f_in:
+        if os.fstat(f_in.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def record_end(buf, start, end):
+    """
+    This function returns (end of the record starting at start, start of
+    the next record). A record ends at a line break outside quotes; the
+    line break and a carriage return before it are not part of it.
+    """
+    newline = buf.find(b'\n', start, end)
+    if newline < 0:
+        newline = end
+    if buf.find(b'"', start, newline) >= 0:
+        # an odd number of quotes means the line break is inside a quoted field
+        while buf[start:newline].count(b'"') % 2 and newline < end:
+            following = buf.find(b'\n', newline + 1, end)
+            newline = end if following < 0 else following
+    stop = newline
+    if stop > start and buf[stop - 1] == CARRIAGE_RETURN:
+        stop -= 1
+    return stop, newline + 1
+
+
+def split_quoted(buf, start, stop):
+    """
+    This function splits the record buf[start:stop] into a list of field
+    values (bytes), following the csv quoting rules.
+    """
+    fields = []
+    pos = start
+    while True:
+        if pos < stop and buf[pos] == QUOTE:
+            value = bytearray()
+            pos += 1
+            while True:
+                quote = buf.find(b'"', pos, stop)
+                if quote < 0:
+                    value += buf[pos:stop]
+                    pos = stop
+                    break
+                value += buf[pos:quote]
+                if quote + 1 < stop and buf[quote + 1] == QUOTE:
+                    value += b'"'
+                    pos = quote + 2
+                else:
+                    pos = quote + 1
+                    break
+            # text between the closing quote and the comma belongs to the field
+            comma = buf.find(b',', pos, stop)
+            value += buf[pos:stop if comma < 0 else comma]
+            fields.append(bytes(value))
+        else:
+            comma = buf.find(b',', pos, stop)
+            fields.append(bytes(buf[pos:stop if comma < 0 else comma]))
+        if comma < 0:
+            return fields
+        pos = comma + 1
+
+
+def read_header(buf):
+    """
+    This function returns the column names of the first record of buf and
+    the offset of the second record.
+    """
+    start = 3 if buf[:3] == b'\xef\xbb\xbf' else 0
+    stop, following = record_end(buf, start, len(buf))
+    return [field.decode() for field in split_quoted(buf, start, stop)], following
+
+
+def first_point(filename):
+    """
+    This function returns the first data row of a csv file as a dictionary
+    of column name -> value, as csv.DictReader would, touching only the
+    pages that hold the first two records. Compressed files are read
+    through open_raw instead.
+    """
+    if detect_compression(filename):
+        with open_raw(filename) as f_in:
+            return next(csv.DictReader(f_in))
+    buf = open_map(filename)
+    try:
+        fieldnames, start = read_header(buf)
+        stop, _ = record_end(buf, start, len(buf))
+        values = [value.decode() for value in split_quoted(buf, start, stop)]
+        return dict(zip(fieldnames, values))
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+def scan_city(buf, city, start=None, end=None, fieldnames=None, batch_size=BATCH_ROWS):
+    """
+    This function yields batches of condensed points (duration in minutes,
+    month, hour, day_of_week, user_type) for the raw records of city in
+    buf[start:end], a memory map or bytes. The header is read from the
+    start of buf unless fieldnames is given; start defaults to the first
+    record after the header and must fall on a record boundary.
+
+    The map is read in blocks of about BLOCK_BYTES. A block without a
+    double quote is split into lines, and each line into fields only up to
+    the last column condensing needs, all in C; a block holding quotes is
+    walked record by record, and quoted records go through split_quoted.
+    """
+    schema = get_schema(city)
+    if fieldnames is None:
+        fieldnames, header_end = read_header(buf)
+        if start is None:
+            start = header_end
+    fieldnames = list(fieldnames)
+    missing = [column for column in schema.columns if column not in fieldnames]
+    if missing:
+        raise KeyError('Columns not in file: {}'.format(', '.join(missing)))
+    duration_at, time_at, user_at = [fieldnames.index(column) for column in schema.columns]
+    n_fields = max(duration_at, time_at, user_at) + 1
+    fast_time = schema.time_format in FAST_TIME_FORMATS
+    parse_text = time_parser(schema.time_format)
+    divisor = schema.duration_divisor
+    user_type_map = schema.user_type_map
+    default_user_type = schema.default_user_type
+    # conversions of repeating values, keyed by their raw bytes
+    user_types = {}
+    hours = {}
+
+    end = len(buf) if end is None else end
+    pos = start or 0
+    find = buf.find
+    batch = []
+    append = batch.append
+    while pos < end:
+        block_end = find(b'\n', min(pos + BLOCK_BYTES, end), end) + 1 or end
+        # lines are split into fields one at a time: holding a block's worth
+        # of field lists at once keeps the cyclic garbage collector busy
+        if find(b'"', pos, block_end) < 0:
+            lines = buf[pos:block_end].splitlines()
+            pos = block_end
+        else:
+            lines = []
+            while pos < block_end:
+                stop, following = record_end(buf, pos, end)
+                if find(b'"', pos, stop) < 0:
+                    lines.extend(buf[pos:stop].splitlines())
+                else:
+                    # already split, as a list
+                    lines.append(split_quoted(buf, pos, stop))
+                pos = following
+
+        for line in lines:
+            fields = line.split(b',', n_fields) if line.__class__ is bytes else line
+            if len(fields) < n_fields:
+                if fields == [b'']:
+                    # blank line
+                    continue
+                raise ValueError('Record has {} fields, {} needed: {!r}'.format(
+                    len(fields), n_fields, b','.join(fields)[:200]))
+            raw_user = fields[user_at]
+            user_type = user_types.get(raw_user)
+            if user_type is None:
+                user_type = user_types[raw_user] = _user_label(raw_user, user_type_map,
+                                                               default_user_type)
+            if fast_time:
+                # 'm/d/Y H' is all that matters, and a year has only 8784 of them
+                raw_time = fields[time_at]
+                raw_hour = raw_time[:raw_time.find(b':')]
+                time_fields = hours.get(raw_hour)
+                if time_fields is None:
+                    time_fields = hours[raw_hour] = _hour_fields(raw_hour)
+                month, hour, day_of_week = time_fields
+            else:
+                month, hour, day_of_week = parse_text(fields[time_at].decode())
+            append((float(fields[duration_at])/divisor, month, hour, day_of_week, user_type))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+            append = batch.append
+    if batch:
+        yield batch
+
+
+def _user_label(raw_user, user_type_map, default_user_type):
+    user_type = raw_user.decode()
+    if user_type_map is None:
+        return user_type
+    return user_type_map.get(user_type, default_user_type)
+
+
+def _hour_fields(raw_hour):
+    """
+    This function returns (month, hour, day of week name) of the 'm/d/Y H'
+    start of a timestamp.
+    """
+    raw_date, _, hour = raw_hour.partition(b' ')
+    parts = raw_date.split(b'/')
+    if len(parts) != 3 or not hour:
+        raise ValueError('Bad start time: {!r}'.format(raw_hour))
+    month, day, year = (int(part) for part in parts)
+    hour = int(hour)
+    if not 1 <= month <= 12 or not 0 <= hour <= 23:
+        raise ValueError('Bad start time: {!r}'.format(raw_hour))
+    return month, hour, _day_name(year, month, day)
+
+
+@instrument
+def condense_mmap(in_file, out_file, city, columnar_dir=None, sample_file=None,
+                  sample_rate=SAMPLE_RATE, sketch_file=None, partition_root=None,
+                  station_file=None):
+    """
+    This function does what condense_data does, with the same arguments,
+    reading the raw file through a memory map with scan_city instead of
+    csv.reader. The output is the same byte for byte. Compressed files
+    cannot be mapped and are condensed with bikeshare.pipeline instead.
+    scan_city reads no station columns, so station counts are left to
+    condense_data.
+    """
+    from bikeshare.columnar import ColumnarWriter, TeeWriter
+    from bikeshare.condense import OUT_COLNAMES, condense_data
+
+    get_schema(city)
+    if station_file is not None:
+        return condense_data(in_file, out_file, city, columnar_dir, sample_file, sample_rate,
+                             sketch_file, partition_root, station_file)
+    if detect_compression(in_file):
+        from bikeshare.pipeline import condense_pipelined
+        return condense_pipelined(in_file, out_file, city, columnar_dir, sample_file,
+                                  sample_rate, sketch_file, partition_root)
+    sample = None if sample_file is None else StratifiedSample(sample_rate)
+    sketches = None if sketch_file is None else DurationSketches()
+    partitions = None
+    if partition_root is not None:
+        from bikeshare.partition import PartitionWriter
+        partitions = PartitionWriter(partition_root, city)
+    buf = open_map(in_file)
+    try:
+        with open(out_file, 'w') as f_out:
+            trip_writer = csv.writer(f_out)
+            trip_writer.writerow(OUT_COLNAMES)
+            extra_writers = [writer for writer in (sample, sketches, partitions)
+                             if writer is not None]
+            if extra_writers:
+                trip_writer = TeeWriter(trip_writer, *extra_writers)
+            if buf and columnar_dir is None:
+                for batch in scan_city(buf, city):
+                    trip_writer.writerows(batch)
+            elif buf:
+                with ColumnarWriter(columnar_dir) as columnar_writer:
+                    writer = TeeWriter(trip_writer, columnar_writer)
+                    for batch in scan_city(buf, city):
+                        writer.writerows(batch)
+    except BaseException:
+        if partitions is not None:
+            partitions.abort()
+        raise
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+    if partitions is not None:
+        partitions.close()
+    if sample is not None:
+        save_sample(sample, sample_file, out_file)
+    if sketches is not None:
+        save_sketches(sketches, sketch_file, out_file)
@@ -0,0 +1,312 @@
+"""
+Process-pool condensing of the raw city trip files.
+
+``condense_cities`` runs the cities concurrently, and also splits each large
+raw file into byte-range chunks that start and end on line boundaries.  Each
+chunk is condensed by a worker into a part file, and the parts are stitched
+back together in order behind a single header.  The result is byte-identical
+to running condense_data serially.
+
+Chunks are split on newline bytes, so this assumes that no quoted field in
+the raw file contains an embedded newline (true of the Motivate trip feeds).
+Compressed raw files cannot be split by byte offset; they are condensed
+with bikeshare.pipeline, which decompresses them on threads.
+"""
+import csv
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import shutil
+
+from bikeshare.aggregate import STATISTICS, TripStats
+from bikeshare.columnar import ColumnarWriter, TeeWriter, columnar_path, concat_columnar
+from bikeshare.compression import detect_compression
+from bikeshare.condense import OUT_COLNAMES, condense_data, condense_file
+from bikeshare.mmapscan import condense_mmap
+from bikeshare.partition import partition_summary
+from bikeshare.pipeline import condense_pipelined
+from bikeshare.sampling import (SAMPLE_RATE, StratifiedSample, sample_path,
+                                save_sample)
+from bikeshare.sketch import DurationSketches, save_sketches, sketch_path
+from bikeshare.stations import StationTraffic, station_path
+
+# default size of the byte ranges handed to each worker
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# the serial condensers, which all take condense_data's arguments
+BACKENDS = {'csv': condense_data, 'mmap': condense_mmap, 'pipelined': condense_pipelined}
+
+
+def line_aligned_chunks(filename, chunk_size=CHUNK_SIZE):
+    """
+    This function splits a csv file into (start, end) byte ranges of roughly
+    chunk_size bytes. The first range starts after the header row, and every
+    range ends just after a newline, so no row is split between two chunks.
+    Returns the header line (bytes) and the list of ranges.
+    """
+    file_size = os.path.getsize(filename)
+    chunks = []
+    with open(filename, 'rb') as f_in:
+        header = f_in.readline()
+        start = f_in.tell()
+        while start < file_size:
+            end = min(start + chunk_size, file_size)
+            if end < file_size:
+                f_in.seek(end)
+                # move the boundary to just past the next newline
+                f_in.readline()
+                end = f_in.tell()
+            chunks.append((start, end))
+            start = end
+    return header, chunks
+
+
+class ByteRange(io.RawIOBase):
+    """
+    Read-only stream of bytes [start, end) of an open binary file, so a
+    chunk is read in buffer-sized pieces rather than all at once.
+    """
+
+    def __init__(self, f_in, start, end):
+        self._file = f_in
+        self._remaining = end - start
+        f_in.seek(start)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        read = self._file.readinto(memoryview(buffer)[:size])
+        self._remaining -= read
+        return read
+
+
+def condense_chunk(in_file, start, end, header, part_file, city, columnar_part=None,
+                   sample_part=None, sample_rate=SAMPLE_RATE, sketch_part=None,
+                   station_part=None):
+    """
+    This function condenses the rows in bytes [start, end) of in_file into
+    part_file (without a header row). header is the raw header line, used to
+    name the columns of the chunk. If columnar_part is given, the chunk is
+    also written there in the columnar format. If sample_part or
+    sketch_part is given, a StratifiedSample or the DurationSketches of the
+    chunk is saved there, and if station_part is given, its exact
+    StationTraffic (to be merged with merge_station_parts).
+    """
+    # decode the same way condense_data's open(in_file, 'r') does
+    fieldnames = next(csv.reader(io.TextIOWrapper(io.BytesIO(header))))
+    with open(in_file, 'rb') as f_raw, open(part_file, 'w') as f_out, \
+            io.TextIOWrapper(io.BufferedReader(ByteRange(f_raw, start, end))) as f_in:
+        trip_writer = csv.writer(f_out)
+        # chunks draw from different seeds so their samples are independent
+        sample = None if sample_part is None else StratifiedSample(sample_rate, seed=start)
+        sketches = None if sketch_part is None else DurationSketches()
+        # a chunk's counts stay exact so the chunks can be renumbered and merged
+        stations = None if station_part is None else StationTraffic(max_exact=None)
+        extra_writers = [writer for writer in (sample, sketches) if writer is not None]
+        if extra_writers:
+            trip_writer = TeeWriter(trip_writer, *extra_writers)
+        if columnar_part is None:
+            condense_file(f_in, trip_writer, city, fieldnames, stations=stations)
+        else:
+            with ColumnarWriter(columnar_part) as columnar_writer:
+                condense_file(f_in, TeeWriter(trip_writer, columnar_writer), city, fieldnames,
+                              stations=stations)
+    if sample is not None:
+        sample.save(sample_part)
+    if sketches is not None:
+        sketches.save(sketch_part)
+    if stations is not None:
+        stations.save(station_part)
+    return part_file
+
+
+def _write_header(out_file):
+    """
+    This function writes the summary header row exactly as condense_data does.
+    """
+    with open(out_file, 'w') as f_out:
+        csv.writer(f_out).writerow(OUT_COLNAMES)
+
+
+def stitch_parts(out_file, part_files):
+    """
+    This function writes the summary header to out_file followed by the
+    contents of part_files in order, removing each part once it is copied.
+    """
+    _write_header(out_file)
+    with open(out_file, 'ab') as f_out:
+        for part_file in part_files:
+            with open(part_file, 'rb') as f_part:
+                shutil.copyfileobj(f_part, f_out)
+            os.remove(part_file)
+
+
+def condense_city(in_file, out_file, city, backend='mmap', columnar=False, sample_rate=None,
+                  sketches=False, partition_root=None, stations=False, **kwargs):
+    """
+    This function condenses one city serially with one of the BACKENDS
+    ('csv' for condense_data, 'mmap' or 'pipelined'), writing the outputs
+    condense_cities names after out_file. Extra keyword arguments go to
+    the backend (e.g. workers, for condense_pipelined).
+    """
+    return BACKENDS[backend](in_file, out_file, city,
+                             columnar_dir=columnar_path(out_file) if columnar else None,
+                             sample_file=sample_path(out_file) if sample_rate else None,
+                             sample_rate=sample_rate or SAMPLE_RATE,
+                             sketch_file=sketch_path(out_file) if sketches else None,
+                             partition_root=partition_root,
+                             station_file=station_path(out_file) if stations else None,
+                             **kwargs)
+
+
+def condense_cities(city_info, workers=None, chunk_size=CHUNK_SIZE, columnar=False,
+                    sample_rate=None, sketches=False, pipelined=False, stations=False,
+                    partition_root=None):
+    """
+    This function condenses every city in city_info ({city: {'in_file': ...,
+    'out_file': ...}}) using a pool of worker processes. Each raw file is cut
+    into line-aligned chunks of about chunk_size bytes; the chunks of all
+    cities are condensed concurrently and then stitched back into each
+    city's out_file in their original order.
+
+    workers defaults to os.cpu_count(); workers=1 condenses each city
+    serially with condense_city's 'mmap' backend.
+    With columnar=True each city is also written in the columnar format, to
+    columnar_path(out_file). With a sample_rate a StratifiedSample of each
+    city is saved to sample_path(out_file), and with sketches=True its
+    DurationSketches to sketch_path(out_file). pipelined=True condenses the
+    cities one at a time with bikeshare.pipeline, overlapping each file's
+    reads and writes with its parsing, for storage too slow to keep even
+    one process busy. With stations=True the station traffic of each raw
+    file is counted in the same pass, saved to station_path(out_file). With
+    a partition_root each city's partitions of the store there are
+    rewritten too (see bikeshare.partition).
+    """
+    options = {'columnar': columnar, 'sample_rate': sample_rate, 'sketches': sketches,
+               'partition_root': partition_root, 'stations': stations}
+    if workers == 1 or pipelined:
+        for city, filenames in city_info.items():
+            condense_city(filenames['in_file'], filenames['out_file'], city,
+                          'pipelined' if pipelined else 'mmap', **options)
+        return
+
+    # compressed files cannot be cut into byte ranges; they are condensed
+    # below, decompressing on threads, while the pool works on the others
+    compressed = [city for city, filenames in city_info.items()
+                  if detect_compression(filenames['in_file'])]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for city, filenames in city_info.items():
+            if city in compressed:
+                continue
+            in_file, out_file = filenames['in_file'], filenames['out_file']
+            header, chunks = line_aligned_chunks(in_file, chunk_size)
+            pending[city] = [
+                pool.submit(condense_chunk, in_file, start, end, header,
+                            '{}.part{:05d}'.format(out_file, i), city,
+                            '{}.part{:05d}'.format(columnar_path(out_file), i) if columnar else None,
+                            ('{}.part{:05d}'.format(sample_path(out_file), i)
+                             if sample_rate else None),
+                            sample_rate or SAMPLE_RATE,
+                            '{}.part{:05d}'.format(sketch_path(out_file), i) if sketches else None,
+                            ('{}.part{:05d}'.format(station_path(out_file), i)
+                             if stations else None))
+                for i, (start, end) in enumerate(chunks)]
+
+        for city in compressed:
+            condense_city(city_info[city]['in_file'], city_info[city]['out_file'], city,
+                          'pipelined', workers=workers, **options)
+
+        for city, futures in pending.items():
+            in_file, out_file = city_info[city]['in_file'], city_info[city]['out_file']
+            part_files = [future.result() for future in futures]
+            if columnar:
+                columnar_dir = columnar_path(out_file)
+                concat_columnar(columnar_dir, ['{}.part{:05d}'.format(columnar_dir, i)
+                                               for i in range(len(part_files))])
+            stitch_parts(out_file, part_files)
+            if sample_rate:
+                merge_sample_parts(out_file, ['{}.part{:05d}'.format(sample_path(out_file), i)
+                                              for i in range(len(part_files))], sample_rate)
+            if sketches:
+                merge_sketch_parts(out_file, ['{}.part{:05d}'.format(sketch_path(out_file), i)
+                                              for i in range(len(part_files))])
+            if stations:
+                merge_station_parts(in_file, out_file,
+                                    ['{}.part{:05d}'.format(station_path(out_file), i)
+                                     for i in range(len(part_files))])
+            if partition_root is not None:
+                # chunks do not end on month boundaries, so the store is split afterwards
+                partition_summary(out_file, partition_root, city)
+
+
+def merge_sample_parts(out_file, sample_parts, sample_rate=SAMPLE_RATE):
+    """
+    This function merges the chunk samples of a condensed file into
+    sample_path(out_file), removing each part once it is read.
+    """
+    sample = None
+    for sample_part in sample_parts:
+        part = StratifiedSample.load(sample_part)
+        sample = part if sample is None else sample.merge(part)
+        os.remove(sample_part)
+    if sample is None:
+        sample = StratifiedSample(sample_rate)
+    save_sample(sample, sample_path(out_file), out_file)
+
+
+def merge_sketch_parts(out_file, sketch_parts):
+    """
+    This function merges the chunk sketches of a condensed file into
+    sketch_path(out_file), removing each part once it is read.
+    """
+    sketches = DurationSketches()
+    for sketch_part in sketch_parts:
+        sketches.merge(DurationSketches.load(sketch_part))
+        os.remove(sketch_part)
+    save_sketches(sketches, sketch_path(out_file), out_file)
+
+
+def merge_station_parts(in_file, out_file, station_parts):
+    """
+    This function merges the chunk station counts of a condensed file, in
+    chunk order, into station_path(out_file), recording in_file as their
+    source and removing each part once it is read.
+    """
+    from bikeshare.cache import fingerprint
+
+    stations = StationTraffic()
+    for station_part in station_parts:
+        stations.merge(StationTraffic.load(station_part))
+        os.remove(station_part)
+    stations.save(station_path(out_file), fingerprint(in_file))
+
+
+def chunk_stats(filename, start, end, header):
+    """
+    This function returns the TripStats of the summary rows in bytes
+    [start, end) of filename.
+    """
+    with open(filename, 'rb') as f_in:
+        f_in.seek(start)
+        data = f_in.read(end - start)
+    fieldnames = next(csv.reader(io.TextIOWrapper(io.BytesIO(header))))
+    with io.TextIOWrapper(io.BytesIO(data)) as f_in:
+        return TripStats().update(csv.DictReader(f_in, fieldnames = fieldnames))
+
+
+def summarize_parallel(filename, stats=STATISTICS, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    This function computes the same results as bikeshare.aggregate.summarize,
+    with the line-aligned chunks of the summary file tallied by a pool of
+    worker processes and their TripStats merged.
+    """
+    header, chunks = line_aligned_chunks(filename, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = [pool.submit(chunk_stats, filename, start, end, header)
+                 for start, end in chunks]
+        return TripStats.merge_all(part.result() for part in parts).results(stats)
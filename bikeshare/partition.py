@@ -0,0 +1,265 @@
+"""
+Summary data partitioned on disk by city and month.
+
+Every statistics function reads a whole summary file, even
+city_monthly_trip_times, which keeps one month of it and is called once per
+month.  A partitioned store keeps the condensed rows of each city and month
+in their own file:
+
+    <root>/_catalog.json
+    <root>/city=NYC/month=01/part-00000.csv
+    <root>/city=NYC/month=02/part-00000.csv
+    ...
+
+Each part file is a summary file in its own right (same header and
+formatting), holding that month's rows in their original order.  The catalog
+lists every partition with its row and byte counts, and ``open_rows`` uses
+it to open only the partitions a query needs: one month reads 1/12 of a
+city's data, a season 1/4.
+
+``PartitionWriter`` is a writer, so condense_data can fill a store in the
+same pass as the summary file; ``partition_summary`` splits an existing
+summary file.  A city's partitions are written to a staging directory and
+swapped in when complete, so readers never see half of them.
+"""
+from contextlib import contextmanager
+import csv
+import json
+import os
+import shutil
+
+from bikeshare.condense import OUT_COLNAMES
+
+CATALOG_FILE = '_catalog.json'
+
+CATALOG_VERSION = 1
+
+PART_FILE = 'part-00000.csv'
+
+
+def city_dir(root, city):
+    return os.path.join(root, 'city={}'.format(city))
+
+
+def partition_path(root, city, month):
+    """
+    This function returns the directory of one city and month partition.
+    """
+    return os.path.join(city_dir(root, city), 'month={:02d}'.format(month))
+
+
+class Catalog(object):
+    """
+    The partitions of a store, as {(city, month): {'path': ..., 'rows':
+    ..., 'bytes': ...}} with paths relative to the store root.
+    """
+
+    def __init__(self, root, partitions=None):
+        self.root = root
+        self.partitions = partitions or {}
+
+    @classmethod
+    def load(cls, root):
+        """
+        This function reads the catalog of a store, or returns an empty one
+        if the store has none yet.
+        """
+        try:
+            with open(os.path.join(root, CATALOG_FILE), 'r') as f_in:
+                state = json.load(f_in)
+        except FileNotFoundError:
+            return cls(root)
+        if state.get('version') != CATALOG_VERSION:
+            raise ValueError('Unsupported catalog version: {!r}'.format(state.get('version')))
+        return cls(root, {(entry['city'], entry['month']): entry
+                          for entry in state['partitions']})
+
+    def save(self):
+        """
+        This function writes the catalog to the store root.
+        """
+        state = {'version': CATALOG_VERSION,
+                 'partitions': [self.partitions[key] for key in sorted(self.partitions)]}
+        path = os.path.join(self.root, CATALOG_FILE)
+        with open(path + '.tmp', 'w') as f_out:
+            json.dump(state, f_out, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def replace_city(self, city, entries):
+        """
+        This function replaces every partition of city with entries.
+        """
+        self.partitions = {key: entry for key, entry in self.partitions.items()
+                           if key[0] != city}
+        for entry in entries:
+            self.partitions[(city, entry['month'])] = entry
+
+    @property
+    def cities(self):
+        return sorted(set(city for city, _ in self.partitions))
+
+    def select(self, cities=None, months=None):
+        """
+        This function returns the catalog entries of the given cities and
+        months (all of them by default), in city and month order.
+        """
+        return [self.partitions[key] for key in sorted(self.partitions)
+                if (cities is None or key[0] in cities)
+                and (months is None or key[1] in months)]
+
+    def files(self, cities=None, months=None):
+        """
+        This function returns the part files of the given cities and
+        months, in city and month order.
+        """
+        return [os.path.join(self.root, entry['path'])
+                for entry in self.select(cities, months)]
+
+    def rows(self, cities=None, months=None):
+        """
+        This function returns the number of trips in the given cities and
+        months, from the catalog alone.
+        """
+        return sum(entry['rows'] for entry in self.select(cities, months))
+
+
+class PartitionWriter(object):
+    """
+    Writes condensed trip points of one city into a partitioned store, one
+    part file per month. It has the writerow()/writerows() methods of the
+    csv.writer used by condense_data; close() (or leaving a with block)
+    publishes the partitions and updates the catalog.
+    """
+
+    def __init__(self, root, city):
+        self.root = root
+        self.city = city
+        self._staging = city_dir(root, city) + '.tmp'
+        shutil.rmtree(self._staging, ignore_errors=True)
+        os.makedirs(self._staging)
+        self._files = {}
+        self._writers = {}
+        self._rows = {}
+
+    def _writer(self, month):
+        """
+        This function opens the part file of a month the first time a trip
+        of that month arrives.
+        """
+        month_dir = os.path.join(self._staging, 'month={:02d}'.format(month))
+        os.makedirs(month_dir)
+        f_out = self._files[month] = open(os.path.join(month_dir, PART_FILE), 'w')
+        writer = self._writers[month] = csv.writer(f_out)
+        writer.writerow(OUT_COLNAMES)
+        self._rows[month] = 0
+        return writer
+
+    def writerow(self, point):
+        self.writerows((point,))
+
+    def writerows(self, points):
+        """
+        This function appends condensed points to the part files of their
+        months.
+        """
+        writers = self._writers
+        rows = self._rows
+        for point in points:
+            month = int(point[1])
+            writer = writers.get(month) or self._writer(month)
+            writer.writerow(point)
+            rows[month] += 1
+
+    def close(self):
+        """
+        This function closes the part files, swaps them in for the city's
+        old partitions and records them in the catalog.
+        """
+        for f_out in self._files.values():
+            f_out.close()
+        entries = []
+        for month in sorted(self._rows):
+            path = os.path.join(os.path.basename(city_dir(self.root, self.city)),
+                                'month={:02d}'.format(month), PART_FILE)
+            entries.append({'city': self.city, 'month': month, 'path': path,
+                            'rows': self._rows[month],
+                            'bytes': os.path.getsize(self._files[month].name)})
+        target = city_dir(self.root, self.city)
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(self._staging, target)
+        catalog = Catalog.load(self.root)
+        catalog.replace_city(self.city, entries)
+        catalog.save()
+
+    def abort(self):
+        """
+        This function drops the partitions written so far, leaving the
+        store as it was.
+        """
+        for f_out in self._files.values():
+            f_out.close()
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def partition_summary(summary_file, root, city):
+    """
+    This function splits an existing summary file into city's partitions
+    of the store at root.
+    """
+    with open(summary_file, 'r') as f_in, PartitionWriter(root, city) as writer:
+        reader = csv.reader(f_in)
+        if next(reader, None) is not None:
+            writer.writerows(reader)
+
+
+def is_partitioned(source):
+    """
+    This function tells whether source names a city directory of a
+    partitioned store (e.g. 'store/city=NYC') rather than a summary file.
+    """
+    return (os.path.isdir(source)
+            and os.path.basename(os.path.normpath(source)).startswith('city='))
+
+
+def _read_parts(files):
+    for filename in files:
+        with open(filename, 'r') as f_in:
+            for row in csv.DictReader(f_in):
+                yield row
+
+
+@contextmanager
+def open_rows(source, months=None):
+    """
+    This function opens the condensed trips of a summary file or of a city
+    directory of a partitioned store, and gives the rows as
+    csv.DictReader dictionaries. If months (a collection of month numbers)
+    is given, only trips of those months are read: from a store, only
+    those partitions are opened; from a file, the other rows are skipped.
+    A store gives the rows month by month, so sums over them may differ
+    from the file's in the last digits.
+    """
+    if is_partitioned(source):
+        root, name = os.path.split(os.path.normpath(source))
+        city = name[len('city='):]
+        rows = _read_parts(Catalog.load(root).files([city], months))
+        try:
+            yield rows
+        finally:
+            rows.close()
+        return
+    with open(source, 'r') as f_in:
+        rows = csv.DictReader(f_in)
+        if months is not None:
+            months = set(months)
+            rows = (row for row in rows if int(row['month']) in months)
+        yield rows
@@ -0,0 +1,267 @@
+"""
+Pipelined condensing: reading, parsing and writing overlap on three threads.
+
+condense_data and condense_mmap do their reading, parsing and writing one
+after the other on one thread, so on slow (e.g. network-mounted) storage the
+CPU waits for every read and the disk waits for every parse.
+``condense_pipelined`` splits the work into stages joined by bounded queues:
+
+- a reader thread reads the raw file in large blocks cut at record
+  boundaries, decompressing it if it is compressed,
+- a transform thread condenses each block with mmapscan.scan_city and
+  formats it as csv text,
+- the calling thread gathers the text into large writes.
+
+File reads and writes release the GIL, so I/O on one stage overlaps parsing
+on another.  A full queue blocks the stage feeding it, which keeps at most
+``depth`` blocks in flight between any two stages however slow the reader or
+writer is.  The output is byte-identical to condense_data.
+"""
+import csv
+import io
+import queue
+import threading
+
+from bikeshare.columnar import ColumnarWriter, TeeWriter
+from bikeshare.compression import detect_compression, iter_decompressed
+from bikeshare.condense import OUT_COLNAMES
+from bikeshare.mmapscan import read_header, scan_city
+from bikeshare.profiling import instrument
+from bikeshare.sampling import SAMPLE_RATE, StratifiedSample, save_sample
+from bikeshare.schema import get_schema
+from bikeshare.sketch import DurationSketches, save_sketches
+
+# bytes read from the raw file at a time
+READ_BYTES = 4 * 1024 * 1024
+
+# condensed text gathered before each write to the summary file
+WRITE_BYTES = 4 * 1024 * 1024
+
+# blocks allowed to wait between two stages
+QUEUE_DEPTH = 4
+
+# seconds a blocked stage waits before checking whether another one failed
+POLL_SECONDS = 0.1
+
+# marks the end of a stage's output
+_DONE = object()
+
+
+def last_record_end(buf):
+    """
+    This function returns the offset just past the last complete record in
+    buf, which starts on a record boundary: the last line break that is
+    not inside a quoted field. It returns 0 if buf holds no complete record.
+    """
+    cut = buf.rfind(b'\n') + 1
+    if buf.find(b'"', 0, cut) >= 0:
+        # an odd number of quotes before a line break means it is inside quotes
+        while cut and buf.count(b'"', 0, cut) % 2:
+            cut = buf.rfind(b'\n', 0, cut - 1) + 1
+    return cut
+
+
+def read_chunks(filename, size=READ_BYTES, opener=open):
+    """
+    This function yields the contents of a file in pieces of size bytes.
+    """
+    with opener(filename, 'rb') as f_in:
+        for data in iter(lambda: f_in.read(size), b''):
+            yield data
+
+
+def record_blocks(chunks):
+    """
+    This function re-cuts consecutive pieces of a file (bytes) into blocks
+    that each end on a record boundary (the last block ends where the file
+    does).
+    """
+    carry = b''
+    for data in chunks:
+        buf = carry + data if carry else data
+        cut = last_record_end(buf)
+        if cut:
+            yield buf[:cut]
+            carry = buf[cut:]
+        else:
+            carry = buf
+    if carry:
+        yield carry
+
+
+def condense_blocks(blocks, city, extra_writers=()):
+    """
+    This function condenses raw blocks (the first one starting with the
+    header) and yields each block's condensed rows as csv text, formatted
+    as condense_data's csv.writer formats them. The condensed points are
+    also handed to every writer in extra_writers.
+    """
+    fieldnames = None
+    for block in blocks:
+        start = 0
+        if fieldnames is None:
+            fieldnames, start = read_header(block)
+        text = io.StringIO()
+        trip_writer = csv.writer(text)
+        if extra_writers:
+            trip_writer = TeeWriter(trip_writer, *extra_writers)
+        for batch in scan_city(block, city, start, fieldnames=fieldnames):
+            trip_writer.writerows(batch)
+        yield text.getvalue()
+
+
+def write_blocks(texts, f_out, write_size=WRITE_BYTES):
+    """
+    This function writes the strings of texts to f_out, gathering them into
+    writes of at least write_size characters.
+    """
+    pending = []
+    pending_size = 0
+    for text in texts:
+        pending.append(text)
+        pending_size += len(text)
+        if pending_size >= write_size:
+            f_out.write(''.join(pending))
+            pending = []
+            pending_size = 0
+    if pending:
+        f_out.write(''.join(pending))
+
+
+def _put(out_queue, item, stop):
+    """
+    This function puts item on out_queue, waiting while it is full, and
+    returns False without putting it if stop is set meanwhile.
+    """
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _pump(items, out_queue, stop, errors):
+    """
+    This function runs a stage on its own thread: it puts every item of
+    the iterable on out_queue and then _DONE. An exception is recorded in
+    errors and stops the other stages.
+    """
+    try:
+        for item in items:
+            if not _put(out_queue, item, stop):
+                return
+    except BaseException as error:
+        errors.append(error)
+        stop.set()
+    finally:
+        _put(out_queue, _DONE, stop)
+
+
+def _drain(in_queue, stop):
+    """
+    This function yields the items a _pump thread puts on in_queue until
+    _DONE, or until stop is set.
+    """
+    while not stop.is_set():
+        try:
+            item = in_queue.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def run_pipeline(in_file, out_file, city, extra_writers=(), read_size=READ_BYTES,
+                 write_size=WRITE_BYTES, depth=QUEUE_DEPTH, threaded=True, opener=open,
+                 workers=None):
+    """
+    This function condenses in_file into out_file through the read,
+    transform and write stages, on three threads joined by queues of depth
+    blocks, or one after the other on the calling thread if threaded is
+    False. opener opens the files (e.g. bench.throttled_opener to simulate
+    slow storage).
+
+    A compressed in_file is decompressed by the read stage, on up to
+    workers threads when it is made of independent pieces (see
+    bikeshare.compression).
+    """
+    get_schema(city)
+    if detect_compression(in_file):
+        chunks = iter_decompressed(in_file, workers, opener=opener)
+    else:
+        chunks = read_chunks(in_file, read_size, opener)
+    with opener(out_file, 'w') as f_out:
+        header = io.StringIO()
+        csv.writer(header).writerow(OUT_COLNAMES)
+        f_out.write(header.getvalue())
+        if not threaded:
+            write_blocks(condense_blocks(record_blocks(chunks), city, extra_writers),
+                         f_out, write_size)
+            return
+
+        stop = threading.Event()
+        errors = []
+        raw_blocks = queue.Queue(depth)
+        text_blocks = queue.Queue(depth)
+        stages = [threading.Thread(target=_pump, name='bikeshare-read', daemon=True,
+                                   args=(record_blocks(chunks), raw_blocks, stop, errors)),
+                  threading.Thread(target=_pump, name='bikeshare-transform', daemon=True,
+                                   args=(condense_blocks(_drain(raw_blocks, stop), city,
+                                                         extra_writers),
+                                         text_blocks, stop, errors))]
+        for stage in stages:
+            stage.start()
+        try:
+            write_blocks(_drain(text_blocks, stop), f_out, write_size)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            for stage in stages:
+                stage.join()
+        if errors:
+            raise errors[0]
+
+
+@instrument
+def condense_pipelined(in_file, out_file, city, columnar_dir=None, sample_file=None,
+                       sample_rate=SAMPLE_RATE, sketch_file=None, partition_root=None,
+                       station_file=None, **kwargs):
+    """
+    This function does what condense_data does, with the same arguments,
+    reading, condensing and writing on separate threads (see run_pipeline,
+    which takes the extra keyword arguments). The output is the same byte
+    for byte. scan_city reads no station columns, so station counts are
+    left to condense_data.
+    """
+    if station_file is not None:
+        from bikeshare.condense import condense_data
+        return condense_data(in_file, out_file, city, columnar_dir, sample_file, sample_rate,
+                             sketch_file, partition_root, station_file)
+    sample = None if sample_file is None else StratifiedSample(sample_rate)
+    sketches = None if sketch_file is None else DurationSketches()
+    partitions = None
+    if partition_root is not None:
+        from bikeshare.partition import PartitionWriter
+        partitions = PartitionWriter(partition_root, city)
+    extra_writers = [writer for writer in (sample, sketches, partitions) if writer is not None]
+    try:
+        if columnar_dir is None:
+            run_pipeline(in_file, out_file, city, extra_writers, **kwargs)
+        else:
+            with ColumnarWriter(columnar_dir) as columnar_writer:
+                run_pipeline(in_file, out_file, city, extra_writers + [columnar_writer],
+                             **kwargs)
+    except BaseException:
+        if partitions is not None:
+            partitions.abort()
+        raise
+    if partitions is not None:
+        partitions.close()
+    if sample is not None:
+        save_sample(sample, sample_file, out_file)
+    if sketches is not None:
+        save_sketches(sketches, sketch_file, out_file)
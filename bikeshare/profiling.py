@@ -0,0 +1,309 @@
+"""
+Opt-in instrumentation for the analysis functions.
+
+Functions wrapped with ``@instrument`` cost one global lookup per call until
+profiling is switched on, either with ``enable()`` or by setting
+``BIKESHARE_PROFILE=1`` before the first import.  Once enabled, every call
+records:
+
+- wall time
+- rows processed (iterables wrapped with ``count_rows``)
+- bytes read (``rchar`` from /proc/self/io, where available)
+- net and peak allocations traced by tracemalloc
+
+and a cProfile run over the whole session gives cumulative time per
+function underneath (csv parsing, strptime, matplotlib drawing).  With a
+sampling interval set, a SIGPROF-driven sampler also collects call stacks,
+written by ``write_folded`` in the folded one-line-per-stack format that
+flamegraph.pl and speedscope read.
+
+``finish()`` stops everything and writes the JSON timing report; when
+enabled from the environment it runs at exit, writing to
+``BIKESHARE_PROFILE_REPORT`` (default ``bikeshare-profile.json``) and, if
+``BIKESHARE_FLAMEGRAPH`` names a file, the folded stacks there.
+"""
+import atexit
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import json
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+
+# cProfile rows kept in the report, by cumulative time
+TOP_FUNCTIONS = 40
+
+# seconds between stack samples when BIKESHARE_FLAMEGRAPH is set
+SAMPLE_INTERVAL = 0.005
+
+_profiler = None
+
+
+class CallRecord(object):
+    """
+    Totals for one instrumented function over all of its calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes_read = 0
+        self.alloc_net = 0
+        self.alloc_peak = 0
+
+    def to_dict(self):
+        return {'calls': self.calls, 'seconds': round(self.seconds, 6), 'rows': self.rows,
+                'rows_per_sec': round(self.rows / self.seconds) if self.seconds else None,
+                'bytes_read': self.bytes_read,
+                'alloc_net_bytes': self.alloc_net, 'alloc_peak_bytes': self.alloc_peak}
+
+
+class _Span(object):
+    """
+    One call in progress. peak carries the highest traced memory seen by
+    nested calls, since each call resets tracemalloc's peak when it starts.
+    """
+    __slots__ = ('name', 'started', 'rows', 'read_start', 'mem_start', 'peak')
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.peak = 0
+
+
+def _bytes_read():
+    """
+    This function returns the bytes this process has read so far (the
+    rchar counter, which includes reads served from the page cache), or
+    None where /proc/self/io does not exist.
+    """
+    try:
+        with open('/proc/self/io', 'rb') as f_in:
+            for line in f_in:
+                if line.startswith(b'rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class Profiler(object):
+    """
+    Collects the per-function records, the cProfile run and the stack
+    samples for one profiling session.
+    """
+
+    def __init__(self, trace_memory=True, cprofile=True, sample_interval=None):
+        self.records = {}
+        self.stack = []
+        self.trace_memory = trace_memory
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.sample_interval = sample_interval
+        self.samples = Counter()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self._has_io = _bytes_read() is not None
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        if self.sample_interval:
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.sample_interval, self.sample_interval)
+
+    def stop(self):
+        if self.sample_interval:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.seconds = time.perf_counter() - self.started
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                             code.co_firstlineno))
+            frame = frame.f_back
+        self.samples[';'.join(reversed(names))] += 1
+
+    def enter(self, name):
+        span = _Span(name)
+        if self._has_io:
+            span.read_start = _bytes_read()
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            span.mem_start = current
+        self.stack.append(span)
+        span.started = time.perf_counter()
+        return span
+
+    def exit(self, span):
+        seconds = time.perf_counter() - span.started
+        self.stack.pop()
+        record = self.records.get(span.name)
+        if record is None:
+            record = self.records[span.name] = CallRecord()
+        record.calls += 1
+        record.seconds += seconds
+        record.rows += span.rows
+        if self._has_io:
+            record.bytes_read += _bytes_read() - span.read_start
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, span.peak)
+            record.alloc_net += current - span.mem_start
+            record.alloc_peak = max(record.alloc_peak, peak - span.mem_start)
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+
+    def report(self, top=TOP_FUNCTIONS):
+        """
+        This function returns the timing report as a JSON-serializable
+        dictionary.
+        """
+        report = {'seconds': round(self.seconds if self.seconds is not None
+                                   else time.perf_counter() - self.started, 6),
+                  'functions': {name: record.to_dict()
+                                for name, record in self.records.items()}}
+        if self.cprofile is not None:
+            stats = pstats.Stats(self.cprofile)
+            rows = []
+            for (filename, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+                rows.append({'function': '{}:{}({})'.format(filename, line, func),
+                             'calls': nc, 'tottime': round(tt, 6), 'cumtime': round(ct, 6)})
+            rows.sort(key=lambda row: row['cumtime'], reverse=True)
+            report['cprofile'] = rows[:top]
+        if self.sample_interval:
+            report['samples'] = sum(self.samples.values())
+        return report
+
+    def write_folded(self, filename):
+        """
+        This function writes the stack samples as folded stacks
+        ('frame;frame;frame count' per line).
+        """
+        with open(filename, 'w') as f_out:
+            for stack, count in sorted(self.samples.items()):
+                f_out.write('{} {}\n'.format(stack, count))
+
+
+def enable(trace_memory=True, cprofile=True, sample_interval=None):
+    """
+    This function starts a profiling session and returns its Profiler.
+    sample_interval (seconds) turns on the stack sampler; it relies on
+    SIGPROF, so it is only available on Unix and in the main thread.
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = Profiler(trace_memory, cprofile, sample_interval)
+    _profiler.start()
+    return _profiler
+
+
+def finish(report_file=None, folded_file=None):
+    """
+    This function ends the profiling session, writes the JSON timing report
+    and folded stacks when file names are given, and returns the report
+    (None if profiling was never enabled).
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    profiler.stop()
+    report = profiler.report()
+    if report_file:
+        with open(report_file, 'w') as f_out:
+            json.dump(report, f_out, indent=2)
+    if folded_file:
+        profiler.write_folded(folded_file)
+    return report
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def instrument(func=None, name=None):
+    """
+    This function is a decorator recording the calls of func in the active
+    profiling session, under name (default module.qualname). With no
+    session active it calls func directly.
+    """
+    if func is None:
+        return lambda func: instrument(func, name)
+    label = name or '{}.{}'.format(func.__module__, func.__qualname__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return func(*args, **kwargs)
+        span = profiler.enter(label)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.exit(span)
+    return wrapper
+
+
+@contextmanager
+def span(name):
+    """
+    This function is a context manager recording a block of code (a plot
+    being drawn, say) in the active profiling session as if it were a call
+    of an instrumented function called name.
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    current = profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit(current)
+
+
+def count_rows(rows):
+    """
+    This function passes rows through unchanged, counting them against the
+    innermost instrumented call when profiling is enabled.
+    """
+    profiler = _profiler
+    if profiler is None or not profiler.stack:
+        return rows
+    return _counted(rows, profiler.stack[-1])
+
+
+def _counted(rows, span):
+    for row in rows:
+        span.rows += 1
+        yield row
+
+
+def _enable_from_environment():
+    if os.environ.get('BIKESHARE_PROFILE', '') in ('', '0'):
+        return
+    folded_file = os.environ.get('BIKESHARE_FLAMEGRAPH')
+    enable(sample_interval=SAMPLE_INTERVAL if folded_file else None)
+    atexit.register(finish, os.environ.get('BIKESHARE_PROFILE_REPORT', 'bikeshare-profile.json'),
+                    folded_file)
+
+
+_enable_from_environment()
@@ -0,0 +1,95 @@
+"""
+Streaming reader for the raw city trip files.
+
+csv.DictReader builds a dictionary holding every raw column for every row,
+although condensing only needs three of them per city.  ``read_batches``
+yields fixed-size batches of tuples holding just the requested columns, and
+can size its batches to stay under a memory ceiling.
+"""
+import csv
+from operator import itemgetter
+import sys
+
+from bikeshare.compression import open_raw
+from bikeshare.profiling import count_rows
+from bikeshare.schema import get_schema
+
+# default number of rows per batch
+BATCH_ROWS = 10000
+
+# rows sampled to estimate the memory held by one projected row
+SAMPLE_ROWS = 100
+
+
+def projector(fieldnames, columns):
+    """
+    This function returns a function that picks the named columns out of a
+    csv row (a list of strings), as a tuple in the order of columns.
+    """
+    missing = [column for column in columns if column not in fieldnames]
+    if missing:
+        raise KeyError('Columns not in file: {}'.format(', '.join(missing)))
+    indexes = [fieldnames.index(column) for column in columns]
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    return itemgetter(*indexes)
+
+
+def row_size(row):
+    """
+    This function estimates the bytes of memory held by one projected row.
+    """
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+def iter_batches(f_in, columns, batch_size=BATCH_ROWS, max_memory=None, fieldnames=None):
+    """
+    This function reads csv rows from the open text file f_in and yields
+    lists of at most batch_size tuples holding only the requested columns.
+    The header row is read from the file unless fieldnames is given. Blank
+    lines are skipped.
+
+    If max_memory (bytes) is set, the batch size is lowered so that one
+    batch stays under it, based on the size of the first rows read.
+    """
+    reader = csv.reader(f_in)
+    if fieldnames is None:
+        fieldnames = next(reader)
+    project = projector(list(fieldnames), columns)
+
+    batch = []
+    limit = batch_size
+    for row in count_rows(reader):
+        if not row:
+            # csv.DictReader skips blank lines, and so does condense_mmap
+            continue
+        batch.append(project(row))
+        if max_memory is not None and len(batch) == SAMPLE_ROWS and limit == batch_size:
+            per_row = sum(row_size(point) for point in batch) / len(batch)
+            # the reader's own list for the current row counts against the ceiling too
+            limit = max(1, min(batch_size, int(max_memory // per_row) - 1))
+        if len(batch) >= limit:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_batches(filename, columns, batch_size=BATCH_ROWS, max_memory=None):
+    """
+    This function opens a raw trip file, decompressing it if it is
+    compressed (see bikeshare.compression), and yields batches of tuples
+    holding only the requested columns (see iter_batches).
+    """
+    with open_raw(filename) as f_in:
+        for batch in iter_batches(f_in, columns, batch_size, max_memory):
+            yield batch
+
+
+def read_city_batches(filename, city, batch_size=BATCH_ROWS, max_memory=None):
+    """
+    This function yields batches of the columns the condensing helpers need
+    for city, as (duration, start time, user type) tuples.
+    """
+    return read_batches(filename, get_schema(city).columns, batch_size, max_memory)
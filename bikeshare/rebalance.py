@@ -0,0 +1,234 @@
+"""
+Dock inventory drift per station, from a sweep over trip start and end events.
+
+Whether a station has enough bikes at peak times, and how far it drifts from
+its starting stock without rebalancing, follows from its trips in time
+order: every trip takes a bike from its start station (-1) and returns one
+to its end station (+1).  Summed from the first trip, these events give each
+station's inventory drift; its lowest point is the number of bikes it must
+start with to never run empty, and its highest point less its lowest is the
+number of docks it needs.
+
+A full year of one system is tens of millions of events, so they are never
+held in memory together:
+
+- ``write_runs`` reads the raw file's start and end times and stations in
+  batches, encodes each event as one integer (time, station, kind) that
+  sorts by time, and writes sorted runs of run_events events to temporary
+  files (the raw files are mostly in start time order, so each run sorts
+  quickly),
+- ``merge_runs`` merges the runs with heapq.merge, reading each in blocks,
+- ``sweep`` walks the merged events once, tracking every station's drift
+  and its extremes at event resolution, and can write the net flow and
+  drift of each station per interval of resolution seconds.
+
+Within one second a station's departures sort before its arrivals, so its
+lowest drift is never understated.
+"""
+from array import array
+from collections import namedtuple
+import csv
+from datetime import datetime, timedelta
+import heapq
+import os
+import tempfile
+
+from bikeshare.compression import open_raw
+from bikeshare.reader import iter_batches
+from bikeshare.schema import get_schema, timestamp_parser
+
+# events sorted in memory before a run is written out
+RUN_EVENTS = 2000000
+
+# events read from a run file at a time while merging
+BLOCK_EVENTS = 65536
+
+# default length of a time series interval, in seconds
+RESOLUTION = 3600
+
+# an event is time << EVENT_SHIFT | station << 1 | kind (0 departure, 1 arrival)
+EVENT_SHIFT = 21
+STATION_MASK = (1 << (EVENT_SHIFT - 1)) - 1
+
+# column names of the time series files
+SERIES_COLNAMES = ['interval_start', 'station', 'departures', 'arrivals', 'net_flow', 'drift']
+
+_EPOCH = datetime(1970, 1, 1)
+
+StationDrift = namedtuple('StationDrift', ['station', 'departures', 'arrivals', 'net_flow',
+                                           'min_drift', 'min_at', 'max_drift', 'max_at'])
+
+
+def format_seconds(seconds):
+    """
+    This function formats seconds from 1970-01-01 as 'YYYY-MM-DD HH:MM:SS'.
+    """
+    return (_EPOCH + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _write_run(events, run_dir, number):
+    """
+    This function sorts a list of events and writes it to a run file as
+    8-byte integers, returning the file name.
+    """
+    events.sort()
+    path = os.path.join(run_dir, 'run-{:05d}.bin'.format(number))
+    with open(path, 'wb') as f_out:
+        array('q', events).tofile(f_out)
+    return path
+
+
+def write_runs(in_file, city, run_dir, run_events=RUN_EVENTS):
+    """
+    This function turns every trip of a raw city file into a departure and
+    an arrival event and writes them to sorted run files in run_dir. It
+    returns the station ids (an event's station is its index here), the
+    run files in order, and the number of trips skipped for lacking a
+    station.
+    """
+    schema = get_schema(city)
+    parse = timestamp_parser(schema.time_format)
+    index = {}
+    stations = []
+    events = []
+    run_files = []
+    skipped = 0
+    with open_raw(in_file) as f_in:
+        for batch in iter_batches(f_in, schema.event_columns):
+            for start_time, end_time, start, end in batch:
+                if not start or not end:
+                    skipped += 1
+                    continue
+                origin = index.get(start)
+                if origin is None:
+                    origin = index[start] = len(stations)
+                    stations.append(start)
+                destination = index.get(end)
+                if destination is None:
+                    destination = index[end] = len(stations)
+                    stations.append(end)
+                events.append(parse(start_time) << EVENT_SHIFT | origin << 1)
+                events.append(parse(end_time) << EVENT_SHIFT | destination << 1 | 1)
+            if len(stations) > STATION_MASK:
+                raise ValueError('More than {} stations'.format(STATION_MASK))
+            if len(events) >= run_events:
+                run_files.append(_write_run(events, run_dir, len(run_files)))
+                events = []
+    if events:
+        run_files.append(_write_run(events, run_dir, len(run_files)))
+    return stations, run_files, skipped
+
+
+def read_run(filename, block_events=BLOCK_EVENTS):
+    """
+    This function yields the events of a run file, reading block_events
+    of them at a time.
+    """
+    with open(filename, 'rb') as f_in:
+        while True:
+            block = array('q')
+            try:
+                block.fromfile(f_in, block_events)
+            except EOFError:
+                # the events before the end of the file are still read
+                pass
+            if not block:
+                return
+            yield from block
+
+
+def merge_runs(run_files, block_events=BLOCK_EVENTS):
+    """
+    This function yields the events of sorted run files in one sorted
+    stream.
+    """
+    if len(run_files) == 1:
+        return read_run(run_files[0], block_events)
+    return heapq.merge(*[read_run(filename, block_events) for filename in run_files])
+
+
+def sweep(events, stations, resolution=RESOLUTION, series_writer=None):
+    """
+    This function walks events in time order and returns a StationDrift
+    for every station. If series_writer (a csv.writer) is given, a
+    SERIES_COLNAMES row is written for every station with trips in each
+    interval of resolution seconds, its drift taken at the interval's end.
+    """
+    n_stations = len(stations)
+    departures = [0] * n_stations
+    arrivals = [0] * n_stations
+    drift = [0] * n_stations
+    low = [0] * n_stations
+    high = [0] * n_stations
+    low_at = [None] * n_stations
+    high_at = [None] * n_stations
+    interval = {}
+    interval_start = interval_end = None
+
+    def flush():
+        label = format_seconds(interval_start)
+        series_writer.writerows(
+            (label, stations[station], out, back, back - out, drift[station])
+            for station, (out, back) in sorted(interval.items()))
+        interval.clear()
+
+    for event in events:
+        seconds = event >> EVENT_SHIFT
+        if series_writer is not None and (interval_end is None or seconds >= interval_end):
+            if interval:
+                flush()
+            interval_start = seconds - seconds % resolution
+            interval_end = interval_start + resolution
+        station = event >> 1 & STATION_MASK
+        if event & 1:
+            arrivals[station] += 1
+            level = drift[station] = drift[station] + 1
+            if level > high[station]:
+                high[station] = level
+                high_at[station] = seconds
+        else:
+            departures[station] += 1
+            level = drift[station] = drift[station] - 1
+            if level < low[station]:
+                low[station] = level
+                low_at[station] = seconds
+        if series_writer is not None:
+            counts = interval.get(station)
+            if counts is None:
+                counts = interval[station] = [0, 0]
+            counts[event & 1] += 1
+    if interval:
+        flush()
+
+    return [StationDrift(stations[i], departures[i], arrivals[i], arrivals[i] - departures[i],
+                         low[i], None if low_at[i] is None else format_seconds(low_at[i]),
+                         high[i], None if high_at[i] is None else format_seconds(high_at[i]))
+            for i in range(n_stations)]
+
+
+def rebalance_path(summary_file):
+    """
+    This function returns the drift time series file that belongs to a
+    summary file.
+    """
+    root, ext = os.path.splitext(summary_file)
+    return (root if ext == '.csv' else summary_file) + '.rebalance.csv'
+
+
+def city_drift(in_file, city, series_file=None, resolution=RESOLUTION, run_events=RUN_EVENTS,
+               work_dir=None):
+    """
+    This function returns the StationDrift of every station of a raw city
+    file, sorting its events through run files in a temporary directory
+    (under work_dir if given). If series_file is given, the per-station
+    time series at resolution seconds is written there.
+    """
+    with tempfile.TemporaryDirectory(prefix='bikeshare-events-', dir=work_dir) as run_dir:
+        stations, run_files, _ = write_runs(in_file, city, run_dir, run_events)
+        events = merge_runs(run_files)
+        if series_file is None:
+            return sweep(events, stations, resolution)
+        with open(series_file, 'w') as f_out:
+            series_writer = csv.writer(f_out)
+            series_writer.writerow(SERIES_COLNAMES)
+            return sweep(events, stations, resolution, series_writer)
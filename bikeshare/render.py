@@ -0,0 +1,199 @@
+"""
+Headless rendering of the notebook's figures to image files.
+
+The notebook draws its duration histograms and the monthly subscriber and
+customer bar charts one after another with plt.show(), which needs a display
+and redraws every chart on every run.  For batch reports, ``city_figures``
+describes each city's figures as a ``FigureSpec`` holding just the
+aggregates it plots (histogram counts, monthly ratios) taken from
+summarize() results, and ``render_figures`` draws them:
+
+- on the Agg backend, with no display, straight to PNG or SVG files,
+- on a pool of worker processes, one figure per task,
+- only when they changed: each file is recorded in ``_figures.json`` in the
+  output directory under a hash of its aggregates, format and the drawing
+  code, and a figure whose hash is unchanged is not redrawn.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+
+from bikeshare import histogram
+from bikeshare.histogram import StreamingHistogram
+
+FORMATS = ('png', 'svg')
+
+MANIFEST_FILE = '_figures.json'
+
+# a name for the file, the drawing function to use, its title and what it plots
+FigureSpec = namedtuple('FigureSpec', ['name', 'kind', 'title', 'data'])
+
+_drawing_version = None
+
+
+def use_agg():
+    """
+    This function switches matplotlib to the non-interactive Agg backend
+    (the worker process initializer; render_figure itself needs no backend).
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def drawing_version():
+    """
+    This function returns a hash of the source of this module and of
+    bikeshare.histogram (which plots the histograms), so figures are
+    redrawn when the drawing code changes.
+    """
+    global _drawing_version
+    if _drawing_version is None:
+        digest = hashlib.sha256()
+        for filename in (__file__, histogram.__file__):
+            with open(filename, 'rb') as f_in:
+                digest.update(f_in.read())
+        _drawing_version = digest.hexdigest()[:16]
+    return _drawing_version
+
+
+def figure_key(spec, fmt):
+    """
+    This function returns the hash identifying a figure's rendering: its
+    kind, title and data, the image format and the drawing code.
+    """
+    state = [drawing_version(), fmt, spec.kind, spec.title, spec.data]
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+
+def city_figures(city, results):
+    """
+    This function returns the FigureSpecs of a city's figures from its
+    summarize() results: the trip duration histograms of all trips,
+    subscribers and customers, and the monthly subscriber and customer
+    ratios.
+    """
+    prefix = city.replace(' ', '_')
+    histograms = results['histogram']
+    specs = [FigureSpec(prefix + '-durations', 'histogram',
+                        'Distribution of {} Trip Durations'.format(city),
+                        histograms['total'].to_dict())]
+    for user_type in ('Subscriber', 'Customer'):
+        specs.append(FigureSpec('{}-{}-durations'.format(prefix, user_type.lower()), 'histogram',
+                                'Distribution of {} {} Trip Durations'.format(city, user_type),
+                                histograms[user_type].to_dict()))
+    specs.append(FigureSpec(prefix + '-monthly-ratios', 'ratios',
+                            'Proporation of Subscribers to Customers for {}'.format(city),
+                            [[month, subs, cust]
+                             for month, (subs, cust) in results['ratios'].items()]))
+    return specs
+
+
+def draw_histogram(fig, spec):
+    """
+    This function draws a duration histogram from its counts, as the
+    notebook's Question 5 cells do.
+    """
+    ax = fig.subplots()
+    StreamingHistogram.from_dict(spec.data).plot(ax=ax, rwidth=.9)
+    ax.set_title(spec.title)
+    ax.set_xlabel('Duration (m)')
+    ax.grid(True)
+
+
+def draw_ratios(fig, spec):
+    """
+    This function draws the monthly subscriber and customer ratio bar
+    chart of the notebook's own analysis, labels included.
+    """
+    months = [month for month, _, _ in spec.data]
+    rows = range(len(months))
+    width = 0.8
+    ax = fig.subplots()
+    for column, color, label in ((1, 'b', 'Subscribers'), (2, 'r', 'Customers')):
+        heights = [row[column] for row in spec.data]
+        ax.bar(rows, heights, width, color=color, label=label)
+        # the notebook's autolabel: inside the bar, turned upright when it fits
+        for x, height in zip(rows, heights):
+            if height >= 20:
+                ax.text(x, height - 20, '%.2f%%' % height, ha='center', va='bottom',
+                        color='white', rotation=90, fontweight='bold')
+            else:
+                ax.text(x, 1, '%.2f%%' % height, ha='center', va='bottom', color='white',
+                        fontweight='bold')
+    ax.set_ylim(0, 115)
+    ax.set_ylabel('Ridership/Trip Ratio')
+    ax.set_xlabel('Months')
+    ax.set_title(spec.title)
+    ax.set_xticks([x + width / 50 for x in rows])
+    ax.set_xticklabels(months)
+    ax.legend()
+
+
+DRAWERS = {'histogram': (draw_histogram, (6.4, 4.8)),
+           'ratios': (draw_ratios, (12, 5))}
+
+
+def render_figure(spec, filename, fmt='png'):
+    """
+    This function draws one figure and saves it to filename, returning
+    filename. It uses a bare matplotlib Figure, so no pyplot state or
+    display is involved.
+    """
+    from matplotlib.figure import Figure
+
+    draw, figsize = DRAWERS[spec.kind]
+    fig = Figure(figsize=figsize)
+    draw(fig, spec)
+    tmp_file = filename + '.tmp'
+    fig.savefig(tmp_file, format=fmt)
+    os.replace(tmp_file, filename)
+    return filename
+
+
+def render_figures(specs, out_dir, fmt='png', workers=None):
+    """
+    This function renders every FigureSpec to out_dir/<name>.<fmt> whose
+    file is missing or was drawn from other data, on a pool of workers
+    processes (default os.cpu_count(); 1 renders in this process). It
+    returns (spec, filename, 'rendered' or 'cached') for each spec.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Unsupported image format: {!r}'.format(fmt))
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_file = os.path.join(out_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_file, 'r') as f_in:
+            manifest = json.load(f_in)
+    except (OSError, ValueError):
+        manifest = {}
+
+    results = []
+    stale = []
+    for spec in specs:
+        filename = os.path.join(out_dir, '{}.{}'.format(spec.name, fmt))
+        key = figure_key(spec, fmt)
+        if manifest.get(os.path.basename(filename)) == key and os.path.exists(filename):
+            results.append((spec, filename, 'cached'))
+        else:
+            stale.append((spec, filename, key))
+            results.append((spec, filename, 'rendered'))
+
+    if workers == 1 or len(stale) < 2:
+        # bare Figures draw without a backend, so the caller's pyplot is left alone
+        for spec, filename, _ in stale:
+            render_figure(spec, filename, fmt)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=use_agg) as pool:
+            jobs = [pool.submit(render_figure, spec, filename, fmt)
+                    for spec, filename, _ in stale]
+            for job in jobs:
+                job.result()
+
+    if stale:
+        manifest.update((os.path.basename(filename), key) for _, filename, key in stale)
+        with open(manifest_file + '.tmp', 'w') as f_out:
+            json.dump(manifest, f_out, indent=1, sort_keys=True)
+        os.replace(manifest_file + '.tmp', manifest_file)
+    return results
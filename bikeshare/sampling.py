@@ -0,0 +1,368 @@
+"""
+Stratified trip samples for approximate statistics with error bounds.
+
+The statistics functions read every row of a summary file, which is fine for
+the notebook's 2% extracts but not for full-population files of hundreds of
+millions of trips.  A ``StratifiedSample`` keeps, for each month and user
+type, the exact number of trips and the durations of a random subset of
+about ``rate`` of them.  It can be filled while condensing (it is a writer,
+so condense_data hands it the same points as the summary file) and saved
+next to the summary file as ``*-2016-Summary.sample.json``.
+
+Because the stratum sizes are counted exactly, trip counts and monthly user
+type ratios come out exact; mean durations and the share of trips over 30
+minutes are stratified estimates with normal-approximation confidence
+intervals.  Each stratum is a Bernoulli sample of its trips, with a small
+reservoir sample as the fallback for strata too small to yield ``min_rows``
+trips at the chosen rate, so every month and user type that has trips is
+represented.
+"""
+import calendar
+from collections import namedtuple
+import csv
+import json
+import math
+import os
+import random
+from statistics import NormalDist
+
+from bikeshare.aggregate import USER_TYPES
+
+# fraction of the trips kept by default
+SAMPLE_RATE = 0.01
+
+# strata with fewer sampled trips than this use their reservoir instead
+MIN_ROWS = 30
+
+CONFIDENCE = 0.95
+
+SAMPLE_VERSION = 1
+
+# an estimate and the bounds of its confidence interval
+Estimate = namedtuple('Estimate', ['value', 'low', 'high'])
+
+# strata are numbered user * 13 + month (month 0 unused), as TripStats keeps them
+_STRATA = 2 * 13
+
+
+def _stratum(month, user_type):
+    return (0 if user_type == 'Subscriber' else 13) + month
+
+
+class StratifiedSample(object):
+    """
+    Trip durations sampled per month and user type ('Subscriber', or
+    'Customer' for every other user type), with the exact number of trips
+    seen in each:
+
+    - seen:      trips per stratum
+    - kept:      durations of a Bernoulli sample of each stratum at rate
+    - reservoir: durations of a uniform sample of min_rows trips of each
+                 stratum, dropped once kept holds min_rows of them
+    """
+
+    def __init__(self, rate=SAMPLE_RATE, min_rows=MIN_ROWS, seed=2016):
+        if not 0 < rate <= 1:
+            raise ValueError('Sample rate must be in (0, 1]: {!r}'.format(rate))
+        self.rate = rate
+        self.min_rows = min_rows
+        self.random = random.Random(seed)
+        self.seen = [0] * _STRATA
+        self.kept = [[] for _ in range(_STRATA)]
+        self.reservoir = [[] for _ in range(_STRATA)]
+        # trips left until each stratum's next Bernoulli pick
+        self.skip = [self._gap() for _ in range(_STRATA)]
+
+    def _gap(self):
+        """
+        This function returns the number of trips up to and including the
+        next one a Bernoulli sample at self.rate keeps (a geometric draw),
+        so rows in between cost no random numbers.
+        """
+        if self.rate >= 1:
+            return 1
+        return 1 + int(math.log(1.0 - self.random.random()) / math.log(1.0 - self.rate))
+
+    def add(self, duration, month, user_type):
+        """
+        This function records one trip.
+        """
+        self.writerow((duration, month, None, None, user_type))
+
+    def writerow(self, point):
+        self.writerows((point,))
+
+    def writerows(self, points):
+        """
+        This function records condensed points (duration, month, hour,
+        day_of_week, user_type), as numbers or as the strings csv.reader
+        yields from a summary file.
+        """
+        seen = self.seen
+        kept = self.kept
+        reservoir = self.reservoir
+        skip = self.skip
+        min_rows = self.min_rows
+        for duration, month, _, _, user_type in points:
+            i = (0 if user_type == 'Subscriber' else 13) + int(month)
+            seen[i] += 1
+            if reservoir[i] is not None:
+                if seen[i] <= min_rows:
+                    reservoir[i].append(float(duration))
+                else:
+                    j = self.random.randrange(seen[i])
+                    if j < min_rows:
+                        reservoir[i][j] = float(duration)
+            skip[i] -= 1
+            if not skip[i]:
+                kept[i].append(float(duration))
+                skip[i] = self._gap()
+                if len(kept[i]) >= min_rows:
+                    reservoir[i] = None
+
+    def update(self, rows):
+        """
+        This function records condensed trip rows as csv.reader yields them
+        from a summary file and returns self.
+        """
+        self.writerows(rows)
+        return self
+
+    def merge(self, other):
+        """
+        This function adds the trips of another StratifiedSample with the
+        same rate and min_rows (e.g. one per chunk of a raw file) to this
+        one and returns self. The result is distributed as if one sample
+        had seen all of the trips.
+        """
+        if (other.rate, other.min_rows) != (self.rate, self.min_rows):
+            raise ValueError('Cannot merge samples with different rates or sizes')
+        for i in range(_STRATA):
+            kept = self.kept[i] + other.kept[i]
+            if len(kept) >= self.min_rows:
+                reservoir = None
+            else:
+                # both reservoirs are still there, since neither side kept enough
+                reservoir = self._merge_reservoirs(self.reservoir[i], self.seen[i],
+                                                   other.reservoir[i], other.seen[i])
+            self.seen[i] += other.seen[i]
+            self.kept[i] = kept
+            self.reservoir[i] = reservoir
+        return self
+
+    def _merge_reservoirs(self, first, n_first, second, n_second):
+        """
+        This function returns a uniform sample of min_rows of the
+        n_first + n_second trips behind two reservoirs: how many come from
+        each side is drawn from the hypergeometric distribution.
+        """
+        size = min(self.min_rows, n_first + n_second)
+        from_first = 0
+        for drawn in range(size):
+            if self.random.random() * (n_first + n_second - drawn) < n_first - from_first:
+                from_first += 1
+        return (self.random.sample(first, from_first)
+                + self.random.sample(second, size - from_first))
+
+    def rows(self, month, user_type):
+        """
+        This function returns the sampled durations of one stratum.
+        """
+        i = _stratum(month, user_type)
+        if self.reservoir[i] is None:
+            return self.kept[i]
+        return self.reservoir[i]
+
+    def count(self, months=range(1, 13), user_types=USER_TYPES):
+        """
+        This function returns the exact number of trips in the given months
+        by the given user types.
+        """
+        return sum(self.seen[_stratum(m, user)] for user in user_types for m in months)
+
+    def estimate(self, value=None, months=range(1, 13), user_types=USER_TYPES,
+                 confidence=CONFIDENCE):
+        """
+        This function returns the stratified Estimate of the mean of
+        value(duration) (the duration itself if value is None) over the
+        trips in the given months by the given user types, with its
+        confidence interval. Strata weigh in by their trip counts, and
+        strata sampled in full add no variance.
+        """
+        strata = [(m, user) for user in user_types for m in months]
+        n_total = sum(self.seen[_stratum(m, user)] for m, user in strata)
+        if not n_total:
+            return Estimate(0.0, 0.0, 0.0)
+        mean = 0.0
+        variance = 0.0
+        for m, user in strata:
+            n_stratum = self.seen[_stratum(m, user)]
+            rows = self.rows(m, user)
+            if not n_stratum or not rows:
+                continue
+            values = rows if value is None else [value(duration) for duration in rows]
+            n_rows = len(values)
+            stratum_mean = sum(values) / n_rows
+            weight = n_stratum / n_total
+            mean += weight * stratum_mean
+            if 1 < n_rows < n_stratum:
+                spread = sum((v - stratum_mean) ** 2 for v in values) / (n_rows - 1)
+                variance += weight * weight * (1 - n_rows / n_stratum) * spread / n_rows
+        margin = _z(confidence) * math.sqrt(variance)
+        return Estimate(mean, mean - margin, mean + margin)
+
+    @property
+    def size(self):
+        """
+        The number of sampled durations the estimates are based on.
+        """
+        return sum(len(self.rows(m, user)) for user in USER_TYPES for m in range(1, 13))
+
+    def to_dict(self):
+        """
+        This function returns the sample as a JSON-serializable dictionary.
+        """
+        return {'version': SAMPLE_VERSION,
+                'rate': self.rate,
+                'min_rows': self.min_rows,
+                'seen': self.seen,
+                'kept': self.kept,
+                'reservoir': self.reservoir}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        This function rebuilds a StratifiedSample from to_dict() output.
+        """
+        if state.get('version') != SAMPLE_VERSION:
+            raise ValueError('Unsupported sample version: {!r}'.format(state.get('version')))
+        sample = cls(state['rate'], state['min_rows'])
+        sample.seen = list(state['seen'])
+        sample.kept = [list(rows) for rows in state['kept']]
+        sample.reservoir = [None if rows is None else list(rows) for rows in state['reservoir']]
+        return sample
+
+    def save(self, filename, source=None):
+        """
+        This function writes the sample to a JSON file. source, if given, is
+        stored alongside to record what the sample was built from.
+        """
+        state = self.to_dict()
+        state['source'] = source
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w') as f_out:
+            json.dump(state, f_out)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as f_in:
+            return cls.from_dict(json.load(f_in))
+
+
+def _z(confidence):
+    """
+    This function returns the two-sided standard normal quantile of a
+    confidence level (1.96 for 0.95).
+    """
+    if not 0 < confidence < 1:
+        raise ValueError('Confidence must be in (0, 1): {!r}'.format(confidence))
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def _exact(value):
+    return Estimate(value, value, value)
+
+
+def sample_path(summary_file):
+    """
+    This function returns the sample file that belongs to a summary file.
+    """
+    root, ext = os.path.splitext(summary_file)
+    return (root if ext == '.csv' else summary_file) + '.sample.json'
+
+
+def save_sample(sample, filename, summary_file):
+    """
+    This function saves a sample taken while condensing summary_file,
+    recording the summary file's fingerprint so city_sample reuses it.
+    """
+    from bikeshare.cache import fingerprint
+
+    sample.save(filename, fingerprint(summary_file))
+
+
+def build_sample(filename, rate=SAMPLE_RATE, min_rows=MIN_ROWS):
+    """
+    This function reads a condensed trip data file once and returns a
+    StratifiedSample of it.
+    """
+    with open(filename, 'r') as f_in:
+        reader = csv.reader(f_in)
+        next(reader)
+        return StratifiedSample(rate, min_rows).update(reader)
+
+
+def city_sample(summary_file, rate=SAMPLE_RATE):
+    """
+    This function returns the StratifiedSample of a summary file, loading
+    it from sample_path(summary_file) when it was taken at this rate from
+    the file as it is now, and building and saving it otherwise.
+    """
+    from bikeshare.cache import fingerprint
+
+    source = fingerprint(summary_file)
+    path = sample_path(summary_file)
+    try:
+        with open(path, 'r') as f_in:
+            state = json.load(f_in)
+        if state.get('source') == source and state.get('rate') == rate:
+            return StratifiedSample.from_dict(state)
+    except (OSError, ValueError):
+        pass
+    sample = build_sample(summary_file, rate)
+    sample.save(path, source)
+    return sample
+
+
+def approx_number_of_trips(filename, rate=SAMPLE_RATE, confidence=CONFIDENCE):
+    """
+    This function returns what analysis.number_of_trips does (subscriber,
+    customer and total trips, subscriber and customer average duration) as
+    Estimates, answered from the city's sample. The counts are exact.
+    """
+    sample = city_sample(filename, rate)
+    n_subscribers = sample.count(user_types=('Subscriber',))
+    n_customers = sample.count(user_types=('Customer',))
+    return (_exact(n_subscribers), _exact(n_customers), _exact(n_subscribers + n_customers),
+            sample.estimate(user_types=('Subscriber',), confidence=confidence),
+            sample.estimate(user_types=('Customer',), confidence=confidence))
+
+
+def approx_trip_duration(filename, rate=SAMPLE_RATE, confidence=CONFIDENCE):
+    """
+    This function returns what analysis.trip_duration does (average trip
+    duration, percentage of trips longer than 30 minutes) as Estimates,
+    answered from the city's sample.
+    """
+    sample = city_sample(filename, rate)
+    over_30 = sample.estimate(lambda duration: 100.0 if duration > 30 else 0.0,
+                              confidence=confidence)
+    return (sample.estimate(confidence=confidence),
+            Estimate(over_30.value, max(over_30.low, 0.0), min(over_30.high, 100.0)))
+
+
+def approx_monthly_ratios(filename, rate=SAMPLE_RATE):
+    """
+    This function returns {month name: [subscriber %, customer %]} as
+    summarize()'s 'ratios' does, with Estimates answered from the city's
+    sample. The stratum sizes are exact, and so are the ratios.
+    """
+    sample = city_sample(filename, rate)
+    ratios = {}
+    for m in range(1, 13):
+        total = sample.count(months=(m,))
+        if total:
+            ratios[calendar.month_name[m]] = [
+                _exact(sample.count((m,), (user,)) / total * 100) for user in USER_TYPES]
+    return ratios
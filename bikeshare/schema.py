@@ -0,0 +1,181 @@
+"""
+Registry of raw trip file layouts, one entry per bike share system.
+
+Each city's raw file names its columns differently, records duration in a
+different unit and labels user types its own way.  Instead of branching on
+the city name for every row, a ``CitySchema`` describes the layout as data,
+and ``compile_transform`` turns it into one specialized row function before
+the condensing loop starts.  Adding a system means adding an entry here (or
+in a JSON file passed to ``load_schemas``), not writing code.
+"""
+from collections import namedtuple
+import calendar
+from datetime import datetime
+import json
+
+from bikeshare.timeparse import parse_start_time, parse_timestamp
+
+# timestamp layouts parse_start_time reads without strptime
+FAST_TIME_FORMATS = ('%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S')
+
+
+class CitySchema(namedtuple('CitySchema', ['duration', 'duration_divisor', 'start_time',
+                                           'time_format', 'user_type', 'user_type_map',
+                                           'default_user_type', 'start_station',
+                                           'end_station', 'end_time'])):
+    """
+    Layout of one city's raw trip file:
+
+    - duration:          column with the trip duration
+    - duration_divisor:  divides the duration into minutes (60 for seconds)
+    - start_time:        column with the trip start timestamp
+    - time_format:       strptime format of start_time
+    - user_type:         column with the user type
+    - user_type_map:     raw user type -> 'Subscriber'/'Customer', or None to
+                         keep the raw value
+    - default_user_type: used for raw user types missing from user_type_map
+    - start_station:     column with the start station id, or None
+    - end_station:       column with the end station id, or None
+    - end_time:          column with the trip end timestamp (in time_format), or
+                         None
+    """
+
+    @property
+    def columns(self):
+        """
+        The raw columns condensing reads, in the order compile_transform's
+        row function expects them.
+        """
+        return (self.duration, self.start_time, self.user_type)
+
+    @property
+    def station_columns(self):
+        """
+        The raw start and end station columns, read by bikeshare.stations.
+        """
+        if self.start_station is None or self.end_station is None:
+            raise ValueError('No station columns registered for this city')
+        return (self.start_station, self.end_station)
+
+    @property
+    def event_columns(self):
+        """
+        The raw start and end time and station columns, read by
+        bikeshare.rebalance.
+        """
+        if self.end_time is None:
+            raise ValueError('No end time column registered for this city')
+        return (self.start_time, self.end_time) + self.station_columns
+
+
+CITY_SCHEMAS = {}
+
+
+def register_city(city, duration, duration_divisor, start_time, time_format, user_type,
+                  user_type_map=None, default_user_type='Customer', start_station=None,
+                  end_station=None, end_time=None):
+    """
+    This function adds (or replaces) the raw file layout of a city.
+    """
+    CITY_SCHEMAS[city] = CitySchema(duration, duration_divisor, start_time, time_format,
+                                    user_type, user_type_map, default_user_type,
+                                    start_station, end_station, end_time)
+    return CITY_SCHEMAS[city]
+
+
+def load_schemas(filename):
+    """
+    This function registers every city layout in a JSON file of the form
+    {city: {register_city keyword arguments}}.
+    """
+    with open(filename, 'r') as f_in:
+        for city, fields in json.load(f_in).items():
+            register_city(city, **fields)
+
+
+def get_schema(city):
+    """
+    This function returns the registered layout of a city, raising
+    ValueError for a city that is not registered.
+    """
+    try:
+        return CITY_SCHEMAS[city]
+    except KeyError:
+        raise ValueError('City Unknown: {!r} (registered: {})'.format(
+            city, ', '.join(sorted(CITY_SCHEMAS))))
+
+
+def time_parser(time_format):
+    """
+    This function returns a function that turns a start timestamp in
+    time_format into (month, hour, day of week name).
+    """
+    if time_format in FAST_TIME_FORMATS:
+        return parse_start_time
+
+    def parse(text):
+        w_date = datetime.strptime(text, time_format)
+        return (w_date.month, w_date.hour, calendar.day_name[w_date.weekday()])
+    return parse
+
+
+def timestamp_parser(time_format):
+    """
+    This function returns a function that turns a timestamp in time_format
+    into whole seconds from 1970-01-01.
+    """
+    if time_format in FAST_TIME_FORMATS:
+        return parse_timestamp
+    epoch = datetime(1970, 1, 1)
+
+    def parse(text):
+        return int((datetime.strptime(text, time_format) - epoch).total_seconds())
+    return parse
+
+
+def compile_transform(city):
+    """
+    This function builds the row function for a city once. It takes a tuple
+    of the schema's columns (duration, start time, user type) and returns the
+    condensed point (duration in minutes, month, hour, day_of_week,
+    user_type).
+    """
+    schema = get_schema(city)
+    divisor = schema.duration_divisor
+    parse_time = time_parser(schema.time_format)
+    user_type_map = schema.user_type_map
+    default_user_type = schema.default_user_type
+
+    if user_type_map is None:
+        def transform(values):
+            duration, start_time, user_type = values
+            month, hour, day_of_week = parse_time(start_time)
+            return (float(duration)/divisor, month, hour, day_of_week, user_type)
+    else:
+        def transform(values):
+            duration, start_time, user_type = values
+            month, hour, day_of_week = parse_time(start_time)
+            return (float(duration)/divisor, month, hour, day_of_week,
+                    user_type_map.get(user_type, default_user_type))
+    return transform
+
+
+# Motivate systems used by the notebook
+register_city('NYC', 'tripduration', 60, 'starttime', '%m/%d/%Y %H:%M:%S', 'usertype',
+              start_station='start station id', end_station='end station id',
+              end_time='stoptime')
+register_city('Chicago', 'tripduration', 60, 'starttime', '%m/%d/%Y %H:%M', 'usertype',
+              start_station='from_station_id', end_station='to_station_id',
+              end_time='stoptime')
+# Washington labels long-term members 'Registered' and short-term users 'Casual'
+register_city('Washington', 'Duration (ms)', 60000, 'Start date', '%m/%d/%Y %H:%M',
+              'Member Type', {'Registered': 'Subscriber', 'Casual': 'Customer'},
+              start_station='Start station number', end_station='End station number',
+              end_time='End date')
+
+# other systems publishing trip data in a similar shape
+register_city('Boston', 'tripduration', 60, 'starttime', '%Y-%m-%d %H:%M:%S', 'usertype',
+              start_station='start station id', end_station='end station id',
+              end_time='stoptime')
+register_city('SF Bay', 'Duration', 60, 'Start Date', '%m/%d/%Y %H:%M', 'Subscriber Type',
+              start_station='Start Terminal', end_station='End Terminal', end_time='End Date')
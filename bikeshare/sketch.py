@@ -0,0 +1,362 @@
+"""
+Mergeable quantile sketches of trip durations.
+
+Trip durations are heavily skewed, so the mean says little about a typical
+trip, but exact medians and percentiles need every duration in memory (as
+analysis.trip_times keeps them).  A ``KLLSketch`` (Karnin, Lang and Liberty,
+"Optimal Quantile Approximation in Streams", 2016) keeps a few hundred
+values in levels of compactors: when a level fills up it is sorted and every
+other value moves up a level, where it stands for twice as many trips.
+Quantiles and ranks come out within about 1.7/k of the true rank (k = 200
+gives about 1%) in memory that does not grow with the number of trips, and
+two sketches merge into a sketch of both streams.
+
+``DurationSketches`` holds one sketch per month and user type.  Like
+bikeshare.sampling's StratifiedSample it is a writer, so condensing can fill
+it in the same pass, and it is saved next to the summary file as
+``*-2016-Summary.sketch.json``.
+"""
+import csv
+import json
+import math
+import os
+import random
+
+from bikeshare.aggregate import USER_TYPES
+
+# capacity of the top compactor; rank error is about 1.7 / k
+DEFAULT_K = 200
+
+# each compactor below the top holds this fraction of the one above it
+CAPACITY_DECAY = 2.0 / 3.0
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+SKETCH_VERSION = 1
+
+# sketches are numbered user * 13 + month (month 0 unused), as TripStats keeps them
+_STRATA = 2 * 13
+
+
+class KLLSketch(object):
+    """
+    KLL quantile sketch of a stream of numbers. compactors[h] holds values
+    of weight 2**h; n, low and high are the exact count, minimum and
+    maximum of the stream.
+    """
+
+    def __init__(self, k=DEFAULT_K, seed=2016):
+        if k < 8:
+            raise ValueError('k must be at least 8: {!r}'.format(k))
+        self.k = k
+        self.random = random.Random(seed)
+        self.compactors = [[]]
+        self.n = 0
+        self.low = None
+        self.high = None
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    def _capacity(self, level):
+        """
+        This function returns how many values compactor level may hold
+        before it is compacted; the top level holds k.
+        """
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.k * CAPACITY_DECAY ** depth)) + 1
+
+    def add(self, value):
+        """
+        This function adds one value.
+        """
+        self.compactors[0].append(value)
+        self.n += 1
+        if self.low is None or value < self.low:
+            self.low = value
+        if self.high is None or value > self.high:
+            self.high = value
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def update(self, values):
+        """
+        This function adds every value of an iterable and returns self.
+        """
+        for value in values:
+            self.add(value)
+        return self
+
+    def _compress(self):
+        """
+        This function compacts full levels, lowest first, until the sketch
+        is back under its size limit. Compacting sorts a level and moves
+        every other value (from a random offset) up; an odd one out stays.
+        """
+        for level in range(len(self.compactors)):
+            compactor = self.compactors[level]
+            if len(compactor) < self._capacity(level):
+                continue
+            if level + 1 == len(self.compactors):
+                self.compactors.append([])
+            compactor.sort()
+            leftover = [compactor.pop()] if len(compactor) % 2 else []
+            self.compactors[level + 1].extend(compactor[self.random.randrange(2)::2])
+            self.compactors[level] = leftover
+            self._size = sum(len(values) for values in self.compactors)
+            self._max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+            if self._size < self._max_size:
+                break
+
+    def merge(self, other):
+        """
+        This function adds the values summarized by another KLLSketch to
+        this one and returns self.
+        """
+        if other.n == 0:
+            return self
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, values in enumerate(other.compactors):
+            self.compactors[level].extend(values)
+        self.n += other.n
+        self.low = other.low if self.low is None else min(self.low, other.low)
+        self.high = other.high if self.high is None else max(self.high, other.high)
+        self._size = sum(len(values) for values in self.compactors)
+        self._max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def _weighted(self):
+        """
+        This function returns the retained values and their weights, sorted
+        by value.
+        """
+        return sorted((value, 1 << level) for level, values in enumerate(self.compactors)
+                      for value in values)
+
+    def quantiles(self, qs):
+        """
+        This function returns the approximate q-quantile of the stream for
+        each q in qs (0 gives the minimum and 1 the maximum exactly), or
+        None for each when the sketch is empty.
+        """
+        if not self.n:
+            return [None for _ in qs]
+        weighted = self._weighted()
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for q in qs:
+            if not 0 <= q <= 1:
+                raise ValueError('Quantile out of range: {!r}'.format(q))
+            if q == 0:
+                results.append(self.low)
+                continue
+            if q == 1:
+                results.append(self.high)
+                continue
+            target = q * total
+            seen = 0
+            for value, weight in weighted:
+                seen += weight
+                if seen >= target:
+                    results.append(value)
+                    break
+            else:
+                results.append(self.high)
+        return results
+
+    def quantile(self, q):
+        return self.quantiles((q,))[0]
+
+    def rank(self, value):
+        """
+        This function returns the approximate fraction of the stream that
+        is at most value.
+        """
+        if not self.n:
+            return 0.0
+        total = 0
+        below = 0
+        for level, values in enumerate(self.compactors):
+            weight = 1 << level
+            total += weight * len(values)
+            below += weight * sum(1 for retained in values if retained <= value)
+        return below / total
+
+    def to_dict(self):
+        """
+        This function returns the sketch as a JSON-serializable dictionary.
+        """
+        return {'k': self.k, 'n': self.n, 'low': self.low, 'high': self.high,
+                'compactors': self.compactors}
+
+    @classmethod
+    def from_dict(cls, state, seed=2016):
+        """
+        This function rebuilds a KLLSketch from to_dict() output.
+        """
+        sketch = cls(state['k'], seed)
+        sketch.compactors = [list(values) for values in state['compactors']]
+        sketch.n = state['n']
+        sketch.low = state['low']
+        sketch.high = state['high']
+        sketch._size = sum(len(values) for values in sketch.compactors)
+        sketch._max_size = sum(sketch._capacity(h) for h in range(len(sketch.compactors)))
+        return sketch
+
+
+class DurationSketches(object):
+    """
+    A KLLSketch of trip duration for every month and user type
+    ('Subscriber', or 'Customer' for every other user type). Queries merge
+    the sketches of the selected months and user types.
+    """
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+        self.sketches = [KLLSketch(k, seed=i) for i in range(_STRATA)]
+
+    def writerow(self, point):
+        self.writerows((point,))
+
+    def writerows(self, points):
+        """
+        This function records condensed points (duration, month, hour,
+        day_of_week, user_type), as numbers or as the strings csv.reader
+        yields from a summary file.
+        """
+        sketches = self.sketches
+        for duration, month, _, _, user_type in points:
+            sketches[(0 if user_type == 'Subscriber' else 13) + int(month)].add(float(duration))
+
+    def update(self, rows):
+        """
+        This function records condensed trip rows as csv.reader yields them
+        from a summary file and returns self.
+        """
+        self.writerows(rows)
+        return self
+
+    def merge(self, other):
+        """
+        This function merges the sketches of another DurationSketches (e.g.
+        of another chunk of the same file) into this one and returns self.
+        """
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        return self
+
+    def sketch(self, months=range(1, 13), user_types=USER_TYPES):
+        """
+        This function returns a new KLLSketch of the trips in the given
+        months by the given user types.
+        """
+        merged = KLLSketch(self.k)
+        for user in user_types:
+            for m in months:
+                merged.merge(self.sketches[(0 if user == 'Subscriber' else 13) + m])
+        return merged
+
+    def quantiles(self, qs=QUANTILES, months=range(1, 13), user_types=USER_TYPES):
+        """
+        This function returns {q: approximate q-quantile of duration} for
+        the trips in the given months by the given user types.
+        """
+        return dict(zip(qs, self.sketch(months, user_types).quantiles(qs)))
+
+    def share_over(self, threshold, months=range(1, 13), user_types=USER_TYPES):
+        """
+        This function returns the approximate percentage of the trips in
+        the given months by the given user types that last longer than
+        threshold minutes.
+        """
+        return (1 - self.sketch(months, user_types).rank(threshold)) * 100
+
+    def to_dict(self):
+        """
+        This function returns the sketches as a JSON-serializable dictionary.
+        """
+        return {'version': SKETCH_VERSION, 'k': self.k,
+                'sketches': [sketch.to_dict() for sketch in self.sketches]}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        This function rebuilds a DurationSketches from to_dict() output.
+        """
+        if state.get('version') != SKETCH_VERSION:
+            raise ValueError('Unsupported sketch version: {!r}'.format(state.get('version')))
+        sketches = cls(state['k'])
+        sketches.sketches = [KLLSketch.from_dict(sketch, seed=i)
+                             for i, sketch in enumerate(state['sketches'])]
+        return sketches
+
+    def save(self, filename, source=None):
+        """
+        This function writes the sketches to a JSON file. source, if given,
+        is stored alongside to record what they were built from.
+        """
+        state = self.to_dict()
+        state['source'] = source
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w') as f_out:
+            json.dump(state, f_out)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as f_in:
+            return cls.from_dict(json.load(f_in))
+
+
+def sketch_path(summary_file):
+    """
+    This function returns the sketch file that belongs to a summary file.
+    """
+    root, ext = os.path.splitext(summary_file)
+    return (root if ext == '.csv' else summary_file) + '.sketch.json'
+
+
+def save_sketches(sketches, filename, summary_file):
+    """
+    This function saves sketches built while condensing summary_file,
+    recording the summary file's fingerprint so city_sketches reuses them.
+    """
+    from bikeshare.cache import fingerprint
+
+    sketches.save(filename, fingerprint(summary_file))
+
+
+def build_sketches(filename, k=DEFAULT_K):
+    """
+    This function reads a condensed trip data file once and returns its
+    DurationSketches.
+    """
+    with open(filename, 'r') as f_in:
+        reader = csv.reader(f_in)
+        next(reader)
+        return DurationSketches(k).update(reader)
+
+
+def city_sketches(summary_file, k=DEFAULT_K):
+    """
+    This function returns the DurationSketches of a summary file, loading
+    them from sketch_path(summary_file) when they were built with this k
+    from the file as it is now, and building and saving them otherwise.
+    """
+    from bikeshare.cache import fingerprint
+
+    source = fingerprint(summary_file)
+    path = sketch_path(summary_file)
+    try:
+        with open(path, 'r') as f_in:
+            state = json.load(f_in)
+        if state.get('source') == source and state.get('k') == k:
+            return DurationSketches.from_dict(state)
+    except (OSError, ValueError):
+        pass
+    sketches = build_sketches(summary_file, k)
+    sketches.save(path, source)
+    return sketches
@@ -0,0 +1,427 @@
+"""
+Station traffic: an origin-destination matrix and the busiest stations.
+
+The summary files keep no stations, so the question of which locations see
+the most traffic is answered from the raw files' start and end station
+columns (see bikeshare.schema).  ``StationTraffic`` counts, in one pass over
+a raw file:
+
+- departures, arrivals and total traffic per station,
+- trips per (origin, destination) route: the sparse OD matrix.
+
+Station ids are numbered as they are first seen, and a route is one integer
+(origin * PAIR_BASE + destination) rather than a nested dictionary.  Each
+count starts out as an exact dictionary.  Once it holds more than max_exact
+keys (the OD matrix of a large system over a full year), it is folded into a
+``CountMinSketch``, whose memory does not grow, and a heap keeps the k keys
+with the largest estimated counts (Cormode and Muthukrishnan, "An Improved
+Data Stream Summary: The Count-Min Sketch and its Applications", 2005).
+Estimates are never below the true count and exceed it by at most
+e / width of all trips with probability 1 - exp(-depth).
+
+The counts are saved next to the summary file as
+``*-2016-Summary.stations.json``.
+"""
+from collections import Counter
+import heapq
+import json
+import math
+import os
+from operator import itemgetter
+import zlib
+
+from bikeshare.compression import open_raw
+from bikeshare.reader import iter_batches
+from bikeshare.schema import get_schema
+
+# heaviest stations or routes kept once a count is sketched
+TOP_K = 100
+
+# keys a count holds exactly before it switches to a sketch
+MAX_EXACT = 100000
+
+# count-min sketch columns and rows: about 0.1% error with 99.97% confidence
+SKETCH_WIDTH = 2719
+SKETCH_DEPTH = 8
+
+# route number = origin * PAIR_BASE + destination, for up to PAIR_BASE stations
+PAIR_BASE = 1 << 20
+
+STATIONS_VERSION = 1
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch of non-negative counts of integer keys: depth rows of
+    width counters, stored one row after another in table. The rows hash a
+    key as h1 + row * h2 (Kirsch and Mitzenmacher's double hashing), from
+    two crc32s of the key.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = [0] * (width * depth)
+
+    def _cells(self, key):
+        data = key.to_bytes(8, 'little')
+        h1 = zlib.crc32(data)
+        h2 = zlib.crc32(data, h1) | 1
+        width = self.width
+        return [(h1 + row * h2) % width + row * width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        """
+        This function adds count to key and returns key's new estimate.
+        """
+        table = self.table
+        cells = self._cells(key)
+        for cell in cells:
+            table[cell] += count
+        return min(map(table.__getitem__, cells))
+
+    def estimate(self, key):
+        """
+        This function returns an upper bound on the count of key.
+        """
+        return min(map(self.table.__getitem__, self._cells(key)))
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth, 'table': self.table}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['width'], state['depth'])
+        sketch.table = list(state['table'])
+        return sketch
+
+
+class HeavyHitters(object):
+    """
+    Counts of integer keys, exact while there are at most max_exact of them
+    (always, if max_exact is None) and afterwards a CountMinSketch plus the
+    k keys with the largest estimates. total is the exact sum of all counts.
+    """
+
+    def __init__(self, k=TOP_K, max_exact=MAX_EXACT, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.k = k
+        self.max_exact = max_exact
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.counts = {}
+        self.sketch = None
+        self.top = {}
+        self._heap = []
+
+    @property
+    def exact(self):
+        return self.sketch is None
+
+    def update(self, counts):
+        """
+        This function adds a {key: count} mapping (e.g. the Counter of one
+        batch of trips).
+        """
+        self.total += sum(counts.values())
+        if self.sketch is None:
+            exact = self.counts
+            for key, count in counts.items():
+                exact[key] = exact.get(key, 0) + count
+            if self.max_exact is not None and len(exact) > self.max_exact:
+                self._start_sketch()
+            return
+        sketch = self.sketch
+        for key, count in counts.items():
+            self._offer(key, sketch.add(key, count))
+
+    def _start_sketch(self):
+        """
+        This function moves the exact counts into a sketch, keeping the k
+        largest as the first heavy hitters.
+        """
+        self.sketch = CountMinSketch(self.width, self.depth)
+        for key, count in self.counts.items():
+            self.sketch.add(key, count)
+        self.top = dict(heapq.nlargest(self.k, self.counts.items(), key=itemgetter(1)))
+        self._rebuild_heap()
+        self.counts = None
+
+    def _rebuild_heap(self):
+        self._heap = [(count, key) for key, count in self.top.items()]
+        heapq.heapify(self._heap)
+
+    def _offer(self, key, estimate):
+        """
+        This function records key's new estimate, making key a heavy hitter
+        if it now beats the smallest one. Estimates only grow, so heap
+        entries that no longer match top are stale and are dropped when
+        they reach the front.
+        """
+        top = self.top
+        heap = self._heap
+        if key in top or len(top) < self.k:
+            top[key] = estimate
+            heapq.heappush(heap, (estimate, key))
+            if len(heap) > 4 * self.k:
+                self._rebuild_heap()
+            return
+        while heap[0][0] != top.get(heap[0][1]):
+            heapq.heappop(heap)
+        if estimate > heap[0][0]:
+            del top[heapq.heappop(heap)[1]]
+            top[key] = estimate
+            heapq.heappush(heap, (estimate, key))
+
+    def count(self, key):
+        """
+        This function returns the count of key (an upper bound once the
+        counts are sketched).
+        """
+        if self.sketch is None:
+            return self.counts.get(key, 0)
+        return self.sketch.estimate(key)
+
+    def most_common(self, n=None):
+        """
+        This function returns the n (default all, or k once sketched) keys
+        with the largest counts as (key, count) pairs, largest first.
+        """
+        if self.sketch is None:
+            counts = self.counts
+        else:
+            # collisions since a heavy hitter was last seen may have raised its estimate
+            counts = {key: self.sketch.estimate(key) for key in self.top}
+        if n is None:
+            return sorted(counts.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, counts.items(), key=itemgetter(1))
+
+    @property
+    def error_bound(self):
+        """
+        The most a count may be overestimated by, with probability
+        1 - exp(-depth): 0 while the counts are exact.
+        """
+        if self.sketch is None:
+            return 0
+        return int(math.ceil(math.e / self.width * self.total))
+
+    def to_dict(self):
+        """
+        This function returns the counts as a JSON-serializable dictionary.
+        """
+        return {'k': self.k, 'max_exact': self.max_exact, 'width': self.width,
+                'depth': self.depth, 'total': self.total,
+                'counts': None if self.counts is None else sorted(self.counts.items()),
+                'sketch': None if self.sketch is None else self.sketch.to_dict(),
+                'top': sorted(self.top.items())}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        This function rebuilds a HeavyHitters from to_dict() output.
+        """
+        hitters = cls(state['k'], state['max_exact'], state['width'], state['depth'])
+        hitters.total = state['total']
+        if state['sketch'] is None:
+            hitters.counts = dict(map(tuple, state['counts']))
+        else:
+            hitters.counts = None
+            hitters.sketch = CountMinSketch.from_dict(state['sketch'])
+            hitters.top = dict(map(tuple, state['top']))
+            hitters._rebuild_heap()
+        return hitters
+
+
+class StationTraffic(object):
+    """
+    Departures, arrivals and traffic (both) per station, and trips per
+    route, of one city's raw trips. stations lists the station ids in the
+    order they were numbered; missing counts trips without a start or end
+    station.
+    """
+
+    def __init__(self, k=TOP_K, max_exact=MAX_EXACT):
+        self.k = k
+        self.max_exact = max_exact
+        self.stations = []
+        self._index = {}
+        self.missing = 0
+        self.departures = HeavyHitters(k, max_exact)
+        self.arrivals = HeavyHitters(k, max_exact)
+        self.traffic = HeavyHitters(k, max_exact)
+        self.routes = HeavyHitters(k, max_exact)
+
+    def _number(self, station):
+        index = self._index.get(station)
+        if index is None:
+            index = self._index[station] = len(self.stations)
+            if index >= PAIR_BASE:
+                raise ValueError('More than {} stations'.format(PAIR_BASE))
+            self.stations.append(station)
+        return index
+
+    def merge(self, other):
+        """
+        This function adds the counts of another StationTraffic (e.g. that
+        of the next chunk of the same raw file), numbering its new stations
+        after this one's, and returns self. other's counts must be exact:
+        a sketch cannot be renumbered.
+        """
+        if not all(hitters.exact for hitters in (other.departures, other.arrivals,
+                                                 other.traffic, other.routes)):
+            raise ValueError('Only exact station counts can be merged')
+        numbers = [self._number(station) for station in other.stations]
+        self.missing += other.missing
+        for name in ('departures', 'arrivals', 'traffic'):
+            getattr(self, name).update({numbers[index]: count for index, count
+                                        in getattr(other, name).counts.items()})
+        self.routes.update({numbers[key // PAIR_BASE] * PAIR_BASE + numbers[key % PAIR_BASE]:
+                            count for key, count in other.routes.counts.items()})
+        return self
+
+    def add_trips(self, trips):
+        """
+        This function counts trips given as (start station, end station)
+        id pairs, e.g. one batch of raw rows.
+        """
+        pairs = Counter(trips)
+        departures = Counter()
+        arrivals = Counter()
+        routes = {}
+        number = self._number
+        for (start, end), count in pairs.items():
+            if not start or not end:
+                self.missing += count
+                continue
+            origin = number(start)
+            destination = number(end)
+            departures[origin] += count
+            arrivals[destination] += count
+            routes[origin * PAIR_BASE + destination] = count
+        self.departures.update(departures)
+        self.arrivals.update(arrivals)
+        self.traffic.update(departures + arrivals)
+        self.routes.update(routes)
+
+    def top_stations(self, n=10, by='traffic'):
+        """
+        This function returns the n busiest stations by 'traffic',
+        'departures' or 'arrivals' as (station id, trips) pairs.
+        """
+        if by not in ('traffic', 'departures', 'arrivals'):
+            raise ValueError('Unknown station count: {!r}'.format(by))
+        return [(self.stations[index], count)
+                for index, count in getattr(self, by).most_common(n)]
+
+    def top_routes(self, n=10):
+        """
+        This function returns the n busiest routes as (origin id,
+        destination id, trips) tuples.
+        """
+        return [(self.stations[key // PAIR_BASE], self.stations[key % PAIR_BASE], count)
+                for key, count in self.routes.most_common(n)]
+
+    def route_count(self, origin, destination):
+        """
+        This function returns the trips from origin to destination (station
+        ids), an upper bound once the routes are sketched.
+        """
+        if origin not in self._index or destination not in self._index:
+            return 0
+        return self.routes.count(self._index[origin] * PAIR_BASE + self._index[destination])
+
+    def od_matrix(self):
+        """
+        This function returns the sparse origin-destination matrix as
+        {(origin id, destination id): trips}: every route taken while the
+        routes are exact, the heaviest ones once they are sketched.
+        """
+        return {(origin, destination): count
+                for origin, destination, count in self.top_routes(None)}
+
+    def to_dict(self):
+        """
+        This function returns the counts as a JSON-serializable dictionary.
+        """
+        return {'version': STATIONS_VERSION, 'k': self.k, 'max_exact': self.max_exact,
+                'stations': self.stations, 'missing': self.missing,
+                'departures': self.departures.to_dict(), 'arrivals': self.arrivals.to_dict(),
+                'traffic': self.traffic.to_dict(), 'routes': self.routes.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        This function rebuilds a StationTraffic from to_dict() output.
+        """
+        if state.get('version') != STATIONS_VERSION:
+            raise ValueError('Unsupported stations version: {!r}'.format(state.get('version')))
+        traffic = cls(state['k'], state['max_exact'])
+        for station in state['stations']:
+            traffic._number(station)
+        traffic.missing = state['missing']
+        for name in ('departures', 'arrivals', 'traffic', 'routes'):
+            setattr(traffic, name, HeavyHitters.from_dict(state[name]))
+        return traffic
+
+    def save(self, filename, source=None):
+        """
+        This function writes the counts to a JSON file. source, if given, is
+        stored alongside to record what they were built from.
+        """
+        state = self.to_dict()
+        state['source'] = source
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w') as f_out:
+            json.dump(state, f_out)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as f_in:
+            return cls.from_dict(json.load(f_in))
+
+
+def station_path(summary_file):
+    """
+    This function returns the station counts file that belongs to a
+    summary file.
+    """
+    root, ext = os.path.splitext(summary_file)
+    return (root if ext == '.csv' else summary_file) + '.stations.json'
+
+
+def build_stations(in_file, city, k=TOP_K, max_exact=MAX_EXACT):
+    """
+    This function reads the station columns of a raw city file once and
+    returns its StationTraffic.
+    """
+    columns = get_schema(city).station_columns
+    traffic = StationTraffic(k, max_exact)
+    with open_raw(in_file) as f_in:
+        for batch in iter_batches(f_in, columns):
+            traffic.add_trips(batch)
+    return traffic
+
+
+def city_stations(in_file, summary_file, city, k=TOP_K, max_exact=MAX_EXACT):
+    """
+    This function returns the StationTraffic of a raw city file, loading it
+    from station_path(summary_file) when it was counted with these limits
+    from the raw file as it is now, and building and saving it otherwise.
+    """
+    from bikeshare.cache import fingerprint
+
+    source = fingerprint(in_file)
+    path = station_path(summary_file)
+    try:
+        with open(path, 'r') as f_in:
+            state = json.load(f_in)
+        if (state.get('source') == source and state.get('k') == k
+                and state.get('max_exact') == max_exact):
+            return StationTraffic.from_dict(state)
+    except (OSError, ValueError):
+        pass
+    traffic = build_stations(in_file, city, k, max_exact)
+    traffic.save(path, source)
+    return traffic
@@ -0,0 +1,130 @@
+"""
+Fast parsing of trip start timestamps.
+
+NYC ``starttime``, Chicago ``starttime`` and Washington ``Start date`` all use
+the fixed ``%m/%d/%Y %H:%M`` layout, with NYC adding ``:%S``.  Rather than
+running ``datetime.strptime`` (and three ``strftime`` calls) on every row,
+``parse_start_time`` splits the fields directly and looks the month and day
+of the week up in a table memoized by date.  Trips cluster on a few hundred
+distinct dates per year, so almost every lookup is a cache hit.
+
+Run ``python -m bikeshare.timeparse`` to compare it against the strptime path.
+"""
+import calendar
+from datetime import date, datetime
+from functools import lru_cache
+import timeit
+
+
+@lru_cache(maxsize=4096)
+def _date_fields(date_text):
+    """
+    This function returns the month and day-of-week name for a 'm/d/Y' date
+    string. Results are memoized, so each distinct date is parsed only once.
+    """
+    month, day, year = date_text.split('/')
+    month = int(month)
+    day_of_week = calendar.day_name[date(int(year), month, int(day)).weekday()]
+    return (month, day_of_week)
+
+
+def parse_start_time(text):
+    """
+    This function takes a '%m/%d/%Y %H:%M' or '%m/%d/%Y %H:%M:%S' timestamp
+    and returns the month, hour, and day of the week (as a name, e.g.
+    'Friday') in which the trip was made, matching what time_of_trip returns.
+    A malformed timestamp raises ValueError, as strptime would.
+    """
+    date_text, sep, time_text = text.partition(' ')
+    colon = time_text.find(':')
+    if not sep or colon < 1:
+        raise ValueError('time data {!r} does not match format '
+                         "'%m/%d/%Y %H:%M[:%S]'".format(text))
+    hour = int(time_text[:colon])
+    if not 0 <= hour < 24:
+        raise ValueError('hour out of range in {!r}'.format(text))
+    month, day_of_week = _date_fields(date_text)
+    return (month, hour, day_of_week)
+
+
+@lru_cache(maxsize=4096)
+def _date_seconds(date_text):
+    """
+    This function returns the seconds from 1970-01-01 to midnight of a
+    'm/d/Y' date string, memoized like _date_fields.
+    """
+    month, day, year = date_text.split('/')
+    return (date(int(year), int(month), int(day)).toordinal() - _EPOCH_ORDINAL) * 86400
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def parse_timestamp(text):
+    """
+    This function takes a '%m/%d/%Y %H:%M' or '%m/%d/%Y %H:%M:%S' timestamp
+    and returns it as whole seconds from 1970-01-01 (ignoring time zones),
+    e.g. for ordering trip start and end events.
+    """
+    date_text, sep, time_text = text.partition(' ')
+    fields = time_text.split(':')
+    if not sep or not 2 <= len(fields) <= 3:
+        raise ValueError('time data {!r} does not match format '
+                         "'%m/%d/%Y %H:%M[:%S]'".format(text))
+    hour = int(fields[0])
+    if not 0 <= hour < 24:
+        raise ValueError('hour out of range in {!r}'.format(text))
+    seconds = _date_seconds(date_text) + hour * 3600 + int(fields[1]) * 60
+    return seconds + int(fields[2]) if len(fields) == 3 else seconds
+
+
+def parse_start_time_strptime(text, time_format):
+    """
+    This function is the original strptime/strftime path, kept as the
+    reference for benchmarks and equivalence checks.
+    """
+    w_date = datetime.strptime(text, time_format)
+    month = int(w_date.strftime("%m"))
+    hour = int(w_date.strftime("%H"))
+    day_of_week = w_date.strftime("%A")
+    return (month, hour, day_of_week)
+
+
+def benchmark(n_rows=200000, repeat=3):
+    """
+    This function times the strptime path against parse_start_time on
+    n_rows synthetic timestamps in each of the city layouts and returns a
+    dictionary of {layout: (strptime seconds, fast seconds, speedup)}.
+    """
+    layouts = {'NYC': "%m/%d/%Y %H:%M:%S",
+               'Chicago/Washington': "%m/%d/%Y %H:%M"}
+    start = datetime(2016, 1, 1).timestamp()
+    step = (366 * 24 * 60 * 60) / n_rows
+    results = {}
+
+    for name, time_format in layouts.items():
+        stamps = []
+        for i in range(n_rows):
+            w_date = datetime.fromtimestamp(start + i * step)
+            # the raw files do not zero-pad month and day
+            stamps.append('{}/{}/{}'.format(w_date.month, w_date.day, w_date.year)
+                          + w_date.strftime(time_format[8:]))
+
+        for stamp in stamps[:1000]:
+            assert parse_start_time(stamp) == parse_start_time_strptime(stamp, time_format)
+
+        _date_fields.cache_clear()
+        slow = min(timeit.repeat(
+            lambda: [parse_start_time_strptime(s, time_format) for s in stamps],
+            number=1, repeat=repeat))
+        fast = min(timeit.repeat(
+            lambda: [parse_start_time(s) for s in stamps],
+            number=1, repeat=repeat))
+        results[name] = (slow, fast, slow / fast)
+
+    return results
+
+
+if __name__ == '__main__':
+    for name, (slow, fast, speedup) in benchmark().items():
+        print('{}: strptime {:.3f}s, fast {:.3f}s ({:.1f}x)'.format(name, slow, fast, speedup))
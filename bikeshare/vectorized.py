@@ -0,0 +1,179 @@
+"""
+NumPy versions of the notebook's summary statistics functions.
+
+Each function takes the columns of one city (from load_city_columns, loaded
+once per city) instead of a filename, and returns the same tuples and
+dictionaries as the per-row loop version in the notebook.  Selections are
+boolean masks, and monthly and hourly tallies use np.bincount.
+
+Durations in the columnar format are float32, so averages agree with the
+loop versions to within float32 rounding (about 1e-6 relative); all sums are
+accumulated in float64.
+"""
+import calendar
+import csv
+import os
+
+import numpy as np
+
+from bikeshare.columnar import DAY_NAMES, columnar_path, load_columns
+
+
+def load_city_columns(filename):
+    """
+    This function loads the columns of a city's condensed data once. filename
+    may be a columnar directory, a summary csv with a columnar directory
+    alongside it (which is memory-mapped), or a plain summary csv (which is
+    parsed once into arrays).
+    """
+    if os.path.isdir(filename):
+        return load_columns(filename)
+    if os.path.isdir(columnar_path(filename)):
+        return load_columns(columnar_path(filename))
+
+    user_types = ['Subscriber', 'Customer']
+    day_codes = {day: i for i, day in enumerate(DAY_NAMES)}
+    duration, month, hour, day_of_week, user_type = [], [], [], [], []
+    with open(filename, 'r') as f_in:
+        for row in csv.DictReader(f_in):
+            if row['user_type'] not in user_types:
+                user_types.append(row['user_type'])
+            duration.append(float(row['duration']))
+            month.append(int(row['month']))
+            hour.append(int(row['hour']))
+            day_of_week.append(day_codes[row['day_of_week']])
+            user_type.append(user_types.index(row['user_type']))
+
+    return {'meta': {'rows': len(duration),
+                     'dictionaries': {'user_type': user_types, 'day_of_week': DAY_NAMES}},
+            'duration': np.array(duration, dtype=np.float64),
+            'month': np.array(month, dtype=np.uint8),
+            'hour': np.array(hour, dtype=np.uint8),
+            'day_of_week': np.array(day_of_week, dtype=np.uint8),
+            'user_type': np.array(user_type, dtype=np.uint8)}
+
+
+def user_mask(columns, user_type):
+    """
+    This function returns a boolean mask of the trips made by user_type.
+    """
+    user_types = columns['meta']['dictionaries']['user_type']
+    if user_type not in user_types:
+        return np.zeros(len(columns['user_type']), dtype=bool)
+    return columns['user_type'] == user_types.index(user_type)
+
+
+def number_of_trips(columns):
+    """
+    This function reports the number of trips made by subscribers, customers,
+    and total overall, and the average duration of each user type. Like the
+    loop version, every trip that is not a Subscriber trip counts as a
+    customer trip.
+    """
+    duration = columns['duration']
+    subscribers = user_mask(columns, 'Subscriber')
+
+    n_total = len(duration)
+    n_subscribers = int(np.count_nonzero(subscribers))
+    n_customers = n_total - n_subscribers
+    duration_total = duration.sum(dtype=np.float64)
+    duration_subscriber = duration[subscribers].sum(dtype=np.float64)
+    duration_customer = duration_total - duration_subscriber
+
+    subscriber_average = float(duration_subscriber/n_subscribers)
+    customer_average = float(duration_customer/n_customers)
+
+    return(n_subscribers, n_customers, n_total, subscriber_average, customer_average)
+
+
+def trip_duration(columns):
+    """
+    This function reports the average trip length and the proportion of
+    trips with duration > 30 mins.
+    """
+    duration = columns['duration']
+    trips_total = len(duration)
+    trip_average = float(duration.sum(dtype=np.float64)/trips_total)
+    trip_average_gt30 = (int(np.count_nonzero(duration > 30))/trips_total)*100
+    return (trip_average, trip_average_gt30)
+
+
+def trip_times(columns):
+    """
+    This function returns every trip duration (a read-only array view, not a
+    copy), ready to pass to plt.hist.
+    """
+    return columns['duration']
+
+
+def city_trip_times(columns):
+    """
+    This function returns the trip durations of subscribers and of customers
+    as two arrays.
+    """
+    duration = columns['duration']
+    return (duration[user_mask(columns, 'Subscriber')],
+            duration[user_mask(columns, 'Customer')])
+
+
+def monthly_totals(columns):
+    """
+    This function returns the trip counts and duration sums per month for
+    subscribers and customers, as four arrays of length 13 indexed by month
+    number (index 0 is unused): (subs counts, cust counts, subs durations,
+    cust durations).
+    """
+    month = columns['month']
+    duration = columns['duration'].astype(np.float64)
+    results = []
+    masks = [user_mask(columns, 'Subscriber'), user_mask(columns, 'Customer')]
+    for mask in masks:
+        results.append(np.bincount(month[mask], minlength=13))
+    for mask in masks:
+        results.append(np.bincount(month[mask], weights=duration[mask], minlength=13))
+    return tuple(results)
+
+
+def hourly_counts(columns):
+    """
+    This function returns the number of trips starting in each hour of the
+    day (an array of length 24) for subscribers and for customers.
+    """
+    hour = columns['hour']
+    return (np.bincount(hour[user_mask(columns, 'Subscriber')], minlength=24),
+            np.bincount(hour[user_mask(columns, 'Customer')], minlength=24))
+
+
+def city_monthly_trip_times(columns, w_month, totals=None):
+    """
+    This function returns the total trip duration of subscribers and of
+    customers in month w_month (1-12), like the loop version's return value.
+    totals is the monthly_totals(columns) result; pass it in when asking for
+    several months, so the arrays are only summed once.
+    """
+    if totals is None:
+        totals = monthly_totals(columns)
+    subs_n, cust_n, subs_duration, cust_duration = totals
+    return (float(subs_duration[w_month]), float(cust_duration[w_month]))
+
+
+def monthly_ratios(columns):
+    """
+    This function computes, for every month with trips, the dictionaries the
+    notebook's monthly loop fills in: total trips per month (by_month) and the
+    subscriber and customer percentages rounded to 2 places
+    (by_month_ratio_subs, by_month_ratio_cust), keyed by month name.
+    """
+    subs_n, cust_n, subs_duration, cust_duration = monthly_totals(columns)
+    by_month = {}
+    by_month_ratio_subs = {}
+    by_month_ratio_cust = {}
+    for w_month in range(1, 13):
+        m_sum_month = int(subs_n[w_month] + cust_n[w_month])
+        if not m_sum_month:
+            continue
+        m = calendar.month_name[w_month]
+        by_month[m] = m_sum_month
+        by_month_ratio_subs[m] = round((int(subs_n[w_month])/m_sum_month)*100, 2)
+        by_month_ratio_cust[m] = round((int(cust_n[w_month])/m_sum_month)*100, 2)
+    return (by_month, by_month_ratio_subs, by_month_ratio_cust)